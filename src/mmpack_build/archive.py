@@ -0,0 +1,329 @@
+# @mindmaze_header@
+"""
+helpers to create and read tarballs
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import stat
+import tarfile
+
+from contextlib import contextmanager
+from hashlib import sha256
+from io import BufferedWriter
+from subprocess import PIPE, Popen
+from tempfile import TemporaryFile
+from threading import Thread
+from typing import BinaryIO, Iterator, Tuple
+
+from .common import (SHA256_CHUNK_SIZE, compression_from_magic_number,
+                     get_host_dist, memoize_sha256, open_compressed_file,
+                     rmfile)
+from .errors import ShellException
+
+
+class _TarWriter:
+    """
+    Writer of deterministic tar stream. All user, group membership, mode
+    (excepting for the execution bit) and timestamps of entries are set to
+    generic values.
+
+    The generated stream is the same as the one tarfile would produce in
+    PAX format when adding a folder recursively with the attributes reset.
+    However the tree is scanned only once and, when the output is a real
+    file or pipe, the data of the files is sent with os.sendfile().
+    """
+
+    def __init__(self, fileobj: BinaryIO):
+        self._fileobj = fileobj
+        self._offset = 0
+        self._inodes = {}
+        self._use_sendfile = (hasattr(os, 'sendfile')
+                              and isinstance(fileobj, BufferedWriter))
+
+        self._is_windows = get_host_dist() == 'windows'
+
+    def _write(self, data: bytes):
+        self._fileobj.write(data)
+        self._offset += len(data)
+
+    def _write_file_data(self, path: str, size: int):
+        with open(path, 'rb', buffering=0) as srcfile:
+            copied = 0
+            if self._use_sendfile:
+                self._fileobj.flush()
+                outfd = self._fileobj.fileno()
+                try:
+                    while copied < size:
+                        sent = os.sendfile(outfd, srcfile.fileno(), copied,
+                                           size - copied)
+                        if not sent:
+                            break
+                        copied += sent
+                except OSError:
+                    # sendfile() not supported for this pair of files
+                    self._use_sendfile = False
+
+            srcfile.seek(copied)
+            while copied < size:
+                chunk = srcfile.read(min(size - copied, SHA256_CHUNK_SIZE))
+                if not chunk:
+                    break
+                self._fileobj.write(chunk)
+                copied += len(chunk)
+
+        if copied != size:
+            raise OSError(f'{path} has been modified while added to tarball')
+
+        self._offset += size
+        remainder = size % tarfile.BLOCKSIZE
+        if remainder:
+            self._write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def _set_regfile_type(self, tarinfo: tarfile.TarInfo,
+                          st_res: os.stat_result):
+        # Store the data of a file only once: the next paths of the same inode
+        # are added as hardlinks to the first one
+        inode = (st_res.st_ino, st_res.st_dev)
+        linkname = self._inodes.get(inode)
+        if st_res.st_nlink > 1 and linkname and linkname != tarinfo.name:
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = linkname
+        else:
+            tarinfo.size = st_res.st_size
+            if inode[0]:
+                self._inodes[inode] = tarinfo.name
+
+    def _set_type(self, tarinfo: tarfile.TarInfo, path: str,
+                  st_res: os.stat_result) -> bool:
+        """
+        Set type related fields of tarinfo. Returns False if the file type
+        cannot be stored in tarball.
+        """
+        mode = st_res.st_mode
+        if stat.S_ISREG(mode):
+            self._set_regfile_type(tarinfo, st_res)
+        elif stat.S_ISDIR(mode):
+            tarinfo.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            tarinfo.type = tarfile.SYMTYPE
+            tarinfo.linkname = os.readlink(path)
+        elif stat.S_ISFIFO(mode):
+            tarinfo.type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+            tarinfo.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) \
+                else tarfile.BLKTYPE
+            tarinfo.devmajor = os.major(st_res.st_rdev)
+            tarinfo.devminor = os.minor(st_res.st_rdev)
+        else:
+            # Unsupported type (like socket)
+            return False
+
+        return True
+
+    def _add_entry(self, path: str, arcname: str, st_res: os.stat_result):
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.uname = tarinfo.gname = 'root'
+
+        # Unify permission in tarball: all file are RW for own, R for group
+        # and other. If a file is executable for owner it is executable for
+        # every one
+        tarinfo.mode = 0o755 if (st_res.st_mode & 0o100) else 0o644
+
+        # On windows, os.stat() and os.path.access() reports permission
+        # inferred from file type and not permission. More over, the execution
+        # permission required by some file to be usable are wrongly dropped
+        # (like .dll needing execution permission)
+        if self._is_windows:
+            _, ext = os.path.splitext(arcname)
+            if ext.lower() in ('.dll', '.pyd'):
+                tarinfo.mode = 0o755
+
+        if not self._set_type(tarinfo, path, st_res):
+            return
+
+        self._write(tarinfo.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING,
+                                  'surrogateescape'))
+        if tarinfo.size:
+            self._write_file_data(path, tarinfo.size)
+
+        if tarinfo.type == tarfile.DIRTYPE:
+            with os.scandir(path) as dir_it:
+                entries = sorted(dir_it, key=lambda e: e.name)
+            for entry in entries:
+                entry_st = entry.stat(follow_symlinks=False)
+                # On Windows, DirEntry.stat() reports 0 for st_ino and
+                # st_nlink: they are needed to detect hardlinks
+                if self._is_windows and stat.S_ISREG(entry_st.st_mode):
+                    entry_st = os.lstat(entry.path)
+                self._add_entry(entry.path, f'{arcname}/{entry.name}',
+                                entry_st)
+
+    def add_tree(self, srcdir: str):
+        """
+        Add recursively the content of srcdir as the '.' folder
+        """
+        self._add_entry(srcdir, '.', os.lstat(srcdir))
+
+    def close(self):
+        """
+        Write the end of archive marker
+        """
+        self._write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        remainder = self._offset % tarfile.RECORDSIZE
+        if remainder:
+            self._write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+
+
+class _HashingWriter:
+    """
+    Binary file writer wrapper computing size and SHA-256 of the written data
+    """
+    def __init__(self, fileobj: BinaryIO):
+        self._fileobj = fileobj
+        self._sha = sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        """
+        same as fileobj.write() but account data in size and hash
+        """
+        self._sha.update(data)
+        self.size += memoryview(data).nbytes
+        return self._fileobj.write(data)
+
+    def flush(self):
+        """
+        same as fileobj.flush()
+        """
+        self._fileobj.flush()
+
+    def hexdigest(self) -> str:
+        """
+        SHA-256 of data written so far
+        """
+        return self._sha.hexdigest()
+
+
+# Commands compressing standard input to standard output
+_COMPRESSOR_CMDS = {
+    'zst': ['zstd', '-9fqc'],
+    'xz-mt': ['xz', '-6', '-T0', '-c'],
+}
+
+
+@contextmanager
+def _open_compressor_pipe(fileobj: BinaryIO, path: str, compression: str):
+    """
+    Get a pipe to an external compressor whose output is written in fileobj
+    """
+    proc = Popen(_COMPRESSOR_CMDS[compression], stdin=PIPE, stdout=PIPE)
+    pump = Thread(target=shutil.copyfileobj, args=(proc.stdout, fileobj))
+    pump.start()
+    try:
+        yield proc.stdin
+    finally:
+        proc.stdin.close()
+        pump.join()
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise ShellException(f'{proc.args[0]} failed to compress {path}')
+
+
+@contextmanager
+def _open_compressed_writer(fileobj: BinaryIO, path: str, compression: str):
+    """
+    Get a file object compressing data written into fileobj. path is the name
+    of the file to use in compressed stream metadata if any.
+    """
+    if compression == 'gz':
+        with gzip.GzipFile(path, 'wb', fileobj=fileobj, mtime=0) as gzfile:
+            yield gzfile
+    elif compression == 'xz':
+        with lzma.LZMAFile(fileobj, 'wb') as xzfile:
+            yield xzfile
+    elif compression == 'bz2':
+        with bz2.BZ2File(fileobj, 'wb') as bz2file:
+            yield bz2file
+    elif compression in ('zst', 'xz-mt'):
+        with _open_compressor_pipe(fileobj, path, compression) as pipe:
+            yield pipe
+    elif compression == '':
+        yield fileobj
+    else:
+        raise ValueError(f'Invalid compression "{compression}" when'
+                         f'opening compressed file {path}')
+
+
+def create_tarball(srcdir: str, dstfile: str,
+                   compression: str = '') -> Tuple[int, str]:
+    """
+    Generate a tarball from the content of a folder. The generated file should
+    be for deterministic build. Hence all user, group member ship, mode
+    (excepting for the execution but), timestamps will be set to generic
+    values.
+
+    The size and the hash of the tarball are computed while it is written.
+    If dstfile exists, it is removed before being created, hence the content
+    of the files it may be hardlinked to is untouched.
+
+    Args:
+        srcfolder: folder whose content will be put in the tarball
+        dstfile: path of the generated tarball
+        compression: compression algorithm to used with the tarball. It must be
+            one of the following string:
+            - '': create a tarfile without compression (default)
+            - 'gz': create a tarfile with gzip compression
+            - 'bz2': create a tarfile with bzip2 compression
+            - 'xz': create a tarfile with lzma compression
+            - 'xz-mt': create a tarfile with lzma compression using all CPUs
+            - 'zst': create a tarfile with zstd compression
+
+    Return:
+        the tuple (size, sha256) of the generated file
+    """
+    rmfile(dstfile)
+    with open(dstfile, 'wb') as rawfile:
+        hashed_file = _HashingWriter(rawfile)
+        with _open_compressed_writer(hashed_file, dstfile,
+                                     compression) as fileobj:
+            tar = _TarWriter(fileobj)
+            tar.add_tree(srcdir)
+            tar.close()
+
+    hexdig = hashed_file.hexdigest()
+    memoize_sha256(dstfile, hexdig)
+    return (hashed_file.size, hexdig)
+
+
+@contextmanager
+def open_tarball(path: str) -> Iterator[tarfile.TarFile]:
+    """
+    Open a tarball for reading, whatever its compression. Unlike
+    tarfile.open(path, 'r:*'), zstd compressed tarballs are supported. Those
+    are decompressed in a temporary file to support random access.
+
+    Args:
+        path: path to the tarball to open
+
+    Raises:
+        tarfile.ReadError: path is not a supported tarball
+    """
+    if compression_from_magic_number(path) != 'zst':
+        with tarfile.open(path, 'r:*') as tar:
+            yield tar
+        return
+
+    tmpdir = os.path.dirname(os.path.abspath(path))
+    with TemporaryFile(dir=tmpdir) as tmp, \
+            open_compressed_file(path, 'rb', 'zst') as proc:
+        shutil.copyfileobj(proc.stdout, tmp)
+        if proc.wait() != 0:
+            raise tarfile.ReadError(f'failed to decompress {path}')
+
+        tmp.seek(0)
+        with tarfile.open(fileobj=tmp, mode='r:') as tar:
+            yield tar
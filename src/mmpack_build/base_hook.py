@@ -53,6 +53,15 @@ class BaseHook:
         # pylint: disable=unused-argument, no-self-use
         return
 
+    def prepare_provides(self, pkgs: List[PackageInfo]):
+        """
+        Called before update_provides() is called on each of the binary
+        packages of the project. It can be used by hook implementation to
+        analyze the files of all the packages at once.
+        """
+        # pylint: disable=unused-argument, no-self-use
+        return None
+
     def update_provides(self, pkg: PackageInfo,
                         specs_provides: Dict[str, Dict]):
         """
@@ -5,12 +5,16 @@ packaging as mmpack file.
 """
 
 import os
-from typing import Any, List, Dict, TextIO
+import stat
+from hashlib import sha256
+from typing import Any, Dict, Iterable, List, TextIO, Tuple
 
+from .archive import create_tarball
 from .common import *
 from .hooks_loader import MMPACK_BUILD_HOOKS
 from .mm_version import Version
 from .package_info import PackageInfo
+from .workspace import Workspace
 
 
 METADATA_VERSION = '1.0'
@@ -63,12 +67,18 @@ def _gen_dep_list(dependencies: Dict[str, List[Version]]) -> List[str]:
     return deps
 
 
-def _gen_sha256sums(sha256sums_path: str):
+def _gen_sha256sums(sha256sums_path: str, known_sha256: Dict[str, str]):
     """
     assume to be run with pkgdir as current dir
+
+    Args:
+        sha256sums_path: path of the sha256sums file to generate
+        known_sha256: hashes (in sha256sums format) of the files already
+            known. They are not computed again.
     """
-    # Compute hashes of all installed files
+    # Compute hashes of all installed files whose hash is not known yet
     cksums = {}
+    unknown = []
     for dirpath, _, filenames in os.walk('.'):
         dirpath = dirpath.removeprefix('./')
         if dirpath == 'MMPACK':
@@ -76,7 +86,13 @@ def _gen_sha256sums(sha256sums_path: str):
 
         for filename in filenames:
             path = dirpath + '/' + filename
-            cksums[path] = sha256sum(path, follow_symlink=False)
+            cksum = known_sha256.get(path)
+            if cksum:
+                cksums[path] = cksum
+            else:
+                unknown.append(path)
+
+    cksums.update(sha256sums(unknown, follow_symlink=False))
 
     # Write the file sha256sums file
     with open(sha256sums_path, 'wt', newline='\n', encoding='utf-8') as stream:
@@ -84,6 +100,47 @@ def _gen_sha256sums(sha256sums_path: str):
             stream.write(f'{filename}: {cksums[filename]}\n')
 
 
+def _hash_tree(path: str, arcname: str, digest: Any,
+               inodes: Dict[Tuple[int, int], str]):
+    st_res = os.lstat(path)
+    if stat.S_ISDIR(st_res.st_mode):
+        digest.update(f'{arcname}/\n'.encode('utf-8', 'surrogateescape'))
+        with os.scandir(path) as dir_it:
+            names = sorted(entry.name for entry in dir_it)
+        for name in names:
+            _hash_tree(f'{path}/{name}', f'{arcname}/{name}', digest, inodes)
+        return
+
+    # Hardlinked files are stored as link to the first one in archive
+    linkname = arcname
+    if stat.S_ISREG(st_res.st_mode):
+        linkname = inodes.setdefault((st_res.st_ino, st_res.st_dev), arcname)
+
+    if linkname != arcname:
+        content = 'lnk-' + linkname
+    else:
+        content = sha256sum(path, follow_symlink=False)
+
+    perm = 'x' if st_res.st_mode & 0o100 else '-'
+    line = f'{arcname} {perm} {content}\n'
+    digest.update(line.encode('utf-8', 'surrogateescape'))
+
+
+def _gen_fingerprint(pkgdir: str) -> str:
+    """
+    Compute the fingerprint of a staged package, ie the hash of the path,
+    execution permission and content of every entry in pkgdir. Since the
+    archive of a package is deterministic, two staged packages with the same
+    fingerprint lead to the same archive.
+
+    The file hashes are memoized, hence the install files already hashed
+    for the sha256sums are not read again.
+    """
+    digest = sha256()
+    _hash_tree(pkgdir, '.', digest, {})
+    return digest.hexdigest()
+
+
 class BinaryPackage:
     # pylint: disable=too-many-instance-attributes
     """
@@ -101,6 +158,8 @@ class BinaryPackage:
         self.spec_dir = spec_dir
         self.src_hash = src_hash
         self.pkg_path = None
+        self.pkg_size = 0
+        self.pkg_sha256 = None
         self.ghost = ghost
 
         self.description = ''
@@ -113,6 +172,8 @@ class BinaryPackage:
         self._dependencies = {'sysdepends': set(), 'depends': {}}
         self.provides = {}
         self.install_files = set()
+        # hashes of install files, as written in sha256sums
+        self.install_files_sha256 = {}
 
     def licenses_dir(self):
         """
@@ -122,6 +183,13 @@ class BinaryPackage:
         os.makedirs(licenses_dir, exist_ok=True)
         return licenses_dir
 
+    def forget_files_sha256(self, files: Iterable[str]):
+        """
+        Drop the known hashes of install files that have been (re)written
+        """
+        for filename in files:
+            self.install_files_sha256.pop(filename, None)
+
     def _get_specs_provides(self) -> Dict[str, Dict[str, Version]]:
         """
         return a dict containing the specified interface of given package
@@ -176,7 +244,7 @@ class BinaryPackage:
 
         self._gen_pkginfo(pkginfo_path)
 
-        _gen_sha256sums(sha256sums_path)
+        _gen_sha256sums(sha256sums_path, self.install_files_sha256)
         sumsha256sums = sha256sum(sha256sums_path)
 
         with open('MMPACK/metadata', 'wt',
@@ -217,8 +285,24 @@ class BinaryPackage:
 
     def _make_archive(self, pkgdir: str, dstdir: str) -> str:
         mpkfile = f'{dstdir}/{self.name}_{self.version}_{self.arch}.mpk'
+
+        # Reuse the archive generated previously for the same staged content.
+        # The lookup cannot be done before staging: the archive holds the
+        # metadata written by the hooks and the sha256sums of the staged
+        # tree. Staging only hardlinks the install files and writes metadata
+        # whose file hashes are memoized, compression is the costly step.
+        wrk = Workspace()
+        cache_name = f'{self.name}_{_gen_fingerprint(pkgdir)}.mpk'
+        digest = wrk.cache_get(mpkfile, name=cache_name)
+        if digest:
+            dprint(f'[cache] {pkgdir} unchanged, reuse {mpkfile}')
+            self.pkg_size = os.path.getsize(mpkfile)
+            self.pkg_sha256 = digest
+            return mpkfile
+
         dprint(f'[tar] {pkgdir} -> {mpkfile}')
-        create_tarball(pkgdir, mpkfile, 'zst')
+        self.pkg_size, self.pkg_sha256 = create_tarball(pkgdir, mpkfile, 'zst')
+        wrk.cache_file(mpkfile, name=cache_name)
 
         return mpkfile
 
@@ -275,6 +359,7 @@ class BinaryPackage:
         'Create PackageInfo instance out of binary package'
         pkginfo = PackageInfo(self.name)
         pkginfo.files = self.install_files
+        pkginfo.files_sha256 = self.install_files_sha256
         pkginfo.provides = self.provides
         pkginfo.version = self.version
         pkginfo.ghost = self.ghost
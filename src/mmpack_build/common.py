@@ -13,27 +13,44 @@ import re
 import shutil
 import stat
 import sys
-import tarfile
 
 import platform
 
 from argparse import Action
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import cache
 from hashlib import sha256
 from io import TextIOWrapper
 from subprocess import PIPE, CalledProcessError, Popen, run
+from threading import Lock, get_ident
 from typing import (Any, AnyStr, BinaryIO, Hashable, Optional, Union, Dict,
-                    Iterator, Tuple, List, Set)
+                    Iterable, Iterator, Tuple, List, Set)
 
-import urllib3
 import yaml
 
-from .errors import ShellException, DownloadError
+try:
+    from fcntl import ioctl
+except ImportError:
+    # pylint: disable=missing-function-docstring,unused-argument
+    def ioctl(fileno: int, request: int, arg: int = 0):
+        raise OSError('ioctl not supported on this platform')
+
+from .errors import ShellException
 from .yaml_dumper import MMPackDumper
 
 CONFIG = {'debug': True, 'verbose': True}
 LOGGER = None
 
+# Size of the chunks read when hashing a file
+SHA256_CHUNK_SIZE = 1 << 20
+
+# Maximum number of file hashes memoized
+SHA256_MEMO_MAXSIZE = 1 << 17
+
+# ioctl request to share the extents of a file with another one (reflink)
+_FICLONE = 0x40049409
+
 # list of stored level-msg pairs of logged lines issued before the
 # filename-based logger becomes available. Once it becomes available this
 # list will populate the newly created log.
@@ -75,6 +92,26 @@ def _log_or_store(level, *args, **kwargs):
         LOGGER.log(level, line)
 
 
+def log_raw(data: bytes):
+    """
+    write data as is to log, without any formatting. The data is expected to
+    be made of complete lines.
+    """
+    if not LOGGER:
+        text = data.decode('utf-8', errors='replace')
+        TMP_LOG_STRLIST.extend([logging.INFO, line]
+                               for line in text.splitlines())
+        return
+
+    for handler in LOGGER.handlers:
+        if not isinstance(handler, logging.FileHandler):
+            continue
+        # Text stream and data share the same block buffered file
+        with handler.lock:
+            handler.stream.flush()
+            handler.stream.buffer.write(data)
+
+
 def log_info(*args, **kwargs):
     """
     write only to log as info
@@ -189,7 +226,7 @@ def shell(cmd, log: bool = True, input_str: str = None,
 
 
 def run_cmd(cmd: List[str], log: bool = True, env: Dict[str, str] = None,
-            stdin: Optional[BinaryIO] = None):
+            stdin: Optional[BinaryIO] = None, cwd: Optional[str] = None):
     """Execute command.
 
     The called command is assumed to report failure reason (if applicable) on
@@ -201,6 +238,7 @@ def run_cmd(cmd: List[str], log: bool = True, env: Dict[str, str] = None,
         env: full environment with which the process must be executed. If None,
             the environment is inherited from the current process
         stdin: Optional stream opened for reading in binary.
+        cwd: if not None, directory in which the command must be executed
 
     raises:
         ShellException: the command return a failure code
@@ -210,7 +248,7 @@ def run_cmd(cmd: List[str], log: bool = True, env: Dict[str, str] = None,
 
     try:
         run(cmd, capture_output=True, encoding='utf-8',
-            check=True, env=env, stdin=stdin)
+            check=True, env=env, stdin=stdin, cwd=cwd)
     except CalledProcessError as err:
         if err.stdout or err.stderr:
             errmsg = err.stdout + err.stderr
@@ -300,6 +338,57 @@ def _set_representer(dumper, data):
 yaml.add_representer(set, _set_representer)
 
 
+# Hash of the files already hashed, indexed by the file status fields that
+# would change if the file content were modified. The least recently used
+# entries are dropped beyond SHA256_MEMO_MAXSIZE entries.
+_SHA256_MEMO: OrderedDict[Tuple[int, int, int, int], str] = OrderedDict()
+_SHA256_MEMO_LOCK = Lock()
+
+
+def _sha256_memo_key(st_res: os.stat_result) -> Tuple[int, int, int, int]:
+    return (st_res.st_dev, st_res.st_ino, st_res.st_size, st_res.st_mtime_ns)
+
+
+def _sha256_memo_get(key: Tuple[int, int, int, int]) -> Optional[str]:
+    with _SHA256_MEMO_LOCK:
+        hexdig = _SHA256_MEMO.get(key)
+        if hexdig is not None:
+            _SHA256_MEMO.move_to_end(key)
+        return hexdig
+
+
+def _sha256_memo_set(key: Tuple[int, int, int, int], hexdig: str):
+    with _SHA256_MEMO_LOCK:
+        _SHA256_MEMO[key] = hexdig
+        _SHA256_MEMO.move_to_end(key)
+        if len(_SHA256_MEMO) > SHA256_MEMO_MAXSIZE:
+            _SHA256_MEMO.popitem(last=False)
+
+
+def _sha256_fileobj(fileobj: BinaryIO) -> str:
+    """
+    compute SHA-256 of file object, reading it by chunks of SHA256_CHUNK_SIZE
+    """
+    fstat = os.fstat(fileobj.fileno())
+    key = _sha256_memo_key(fstat)
+    hexdig = _sha256_memo_get(key)
+    if hexdig is not None:
+        return hexdig
+
+    sha = sha256()
+    buf = bytearray(min(SHA256_CHUNK_SIZE, fstat.st_size) or 1)
+    view = memoryview(buf)
+    while True:
+        size = fileobj.readinto(buf)
+        if not size:
+            break
+        sha.update(view[:size])
+
+    hexdig = sha.hexdigest()
+    _sha256_memo_set(key, hexdig)
+    return hexdig
+
+
 def sha256sum(filename: str, follow_symlink: bool = True) -> str:
     """
     compute the SHA-256 hash of a file
@@ -310,6 +399,9 @@ def sha256sum(filename: str, follow_symlink: bool = True) -> str:
     symlink) and the hash of a symlink will be the SHA256 of the target
     path of the link.
 
+    The file is read by chunks and its hash is memoized as long as the file
+    is not modified, so hashing the same file several times is cheap.
+
     Args:
         filename: path of file whose hash must be computed
         follow_symlink: symlink must not be followed and computed hash must
@@ -318,15 +410,13 @@ def sha256sum(filename: str, follow_symlink: bool = True) -> str:
     Returns:
         a string containing hexadecimal value of hash
     """
-    sha = sha256()
     if not follow_symlink and os.path.islink(filename):
         # Compute sha256 of symlink target and replace beginning with "sym"
-        sha.update(os.readlink(filename).encode('utf-8'))
-        shastr = sha.hexdigest()
-        return "sym-" + shastr
-    with open(filename, 'rb') as fileobj:
-        sha.update(fileobj.read())
-    hexdig = sha.hexdigest()
+        sha = sha256(os.readlink(filename).encode('utf-8'))
+        return "sym-" + sha.hexdigest()
+
+    with open(filename, 'rb', buffering=0) as fileobj:
+        hexdig = _sha256_fileobj(fileobj)
 
     if not follow_symlink:
         return "reg-" + hexdig
@@ -334,6 +424,30 @@ def sha256sum(filename: str, follow_symlink: bool = True) -> str:
     return hexdig
 
 
+def sha256sums(filenames: Iterable[str],
+               follow_symlink: bool = True) -> Dict[str, str]:
+    """
+    compute the SHA-256 hash of several files in parallel. See sha256sum()
+    for the meaning of arguments and format of the hashes.
+
+    Returns:
+        dictionary mapping each filename to its hash
+    """
+    filenames = list(filenames)
+    with ThreadPoolExecutor() as executor:
+        hashes = executor.map(lambda f: sha256sum(f, follow_symlink),
+                              filenames)
+        return dict(zip(filenames, hashes))
+
+
+def memoize_sha256(filename: str, hexdig: str):
+    """
+    Record the sha256 of a file whose content has just been written, so that
+    sha256sum() does not read it again while it is not modified.
+    """
+    _sha256_memo_set(_sha256_memo_key(os.stat(filename)), hexdig)
+
+
 @cache
 def get_host_arch() -> str:
     """
@@ -467,58 +581,70 @@ class Assert(AssertionError):
         _log_or_store(logging.ERROR, *args, **kwargs)
 
 
-def _reset_entry_attrs(tarinfo: tarfile.TarInfo):
+def tmpfile_name(path: str) -> str:
     """
-    filter function for tar creation that will remove all file attributes
-    (uid, gid, mtime) from the file added to tar would can make the build
-    of package not reproducible.
-
-    Args:
-        tarinfo: entry being added to the tar
-
-    Returns:
-        the modified tarinfo that will be actually added to tar
+    Get a name of temporary file, unique to the calling thread, located next to
+    path. Once written, it can be renamed into path with os.replace() so
+    that path is never seen partially written by concurrent readers.
     """
-    tarinfo.uid = tarinfo.gid = 0
-    tarinfo.uname = tarinfo.gname = 'root'
-    tarinfo.mtime = 0
+    return f'{path}.{os.getpid()}-{get_ident()}.tmp'
 
-    # On windows, os.stat() and os.path.access() reports permission inferred
-    # from file type and not permission. More over, the execution permission
-    # required by some file to be usable are wrongly dropped (like .dll needing
-    # execution permission)
-    if get_host_dist() == 'windows':
-        _, ext = os.path.splitext(tarinfo.name)
-        if ext.lower() in ('.dll', '.pyd'):
-            tarinfo.mode = 0o755
 
-    # Unify permission in tarball: all file are RW for own, R for group and
-    # other. If a file is executable for owner it is executable for every one
-    tarinfo.mode = 0o755 if (tarinfo.mode & 0o100) else 0o644
+def _reflink(src: str, dst: str):
+    with open(src, 'rb') as srcfile, open(dst, 'xb') as dstfile:
+        ioctl(dstfile.fileno(), _FICLONE, srcfile.fileno())
 
-    return tarinfo
 
-
-def create_tarball(srcdir: str, dstfile: str, compression: str = '') -> None:
+def link_or_copy(src: str, dst: str, hardlink: bool = True) -> str:
     """
-    Generate a tarball from the content of a folder. The generated file should
-    be for deterministic build. Hence all user, group member ship, mode
-    (excepting for the execution but), timestamps will be set to generic
-    values.
+    Make dst a file with the same content as src, avoiding to copy the data
+    when possible: reflink (copy on write clone) is tried first, then
+    hardlink and finally regular copy. If dst exists, it is replaced.
 
     Args:
-        srcfolder: folder whose content will be put in the tarball
-        dstfile: path of the generated tarball
-        compression: compression algorithm to used with the tarball. It must be
-            one of the following string:
-            - '': create a tarfile without compression (default)
-            - 'gz': create a tarfile with gzip compression
-            - 'bz2': create a tarfile with bzip2 compression
-            - 'xz': create a tarfile with lzma compression
+        src: path of the file to copy
+        dst: path of the destination file or folder. If it is a folder,
+            the destination file will be located in this folder with the
+            basename of src.
+        hardlink: if False, src and dst are never hardlinked, so that a
+            later modification of one of them does not affect the other.
+
+    Return:
+        path of the destination file
     """
-    with (open_compressed_file(dstfile, 'wb', compression) as fileobj,
-          tarfile.open(fileobj=fileobj, mode='w|') as tar):
-        tar.add(srcdir, recursive=True, filter=_reset_entry_attrs, arcname='.')
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+
+    # Nothing to do if dst is already a hardlink of src (replacing a hardlink
+    # by another hardlink of the same file is a no-op)
+    try:
+        if hardlink and os.path.samefile(src, dst):
+            return dst
+    except FileNotFoundError:
+        pass
+
+    tmp = tmpfile_name(dst)
+    rmfile(tmp)
+    try:
+        try:
+            _reflink(src, tmp)
+            shutil.copymode(src, tmp)
+        except OSError:
+            rmfile(tmp)
+            if not hardlink:
+                shutil.copy(src, tmp)
+            else:
+                try:
+                    os.link(src, tmp)
+                except OSError:
+                    shutil.copy(src, tmp)
+
+        os.replace(tmp, dst)
+    except BaseException:
+        rmfile(tmp)
+        raise
+
+    return dst
 
 
 def _compression_from_filename(path: str) -> str:
@@ -530,7 +656,12 @@ def _compression_from_filename(path: str) -> str:
     return compression
 
 
-def _compression_from_magic_number(path: str) -> str:
+def compression_from_magic_number(path: str) -> str:
+    """
+    Get the compression of a file from its magic number, or from its
+    extension if the file is missing or empty. '' is returned if the file
+    is not compressed.
+    """
     try:
         with open(path, 'rb', buffering=0) as fileobj:
             magic = fileobj.read(6)
@@ -577,7 +708,7 @@ def open_compressed_file(path: str, mode: str = 'rt',
     """
     if compression is None:
         if 'w' not in mode:
-            compression = _compression_from_magic_number(path)
+            compression = compression_from_magic_number(path)
         else:
             compression = _compression_from_filename(path)
 
@@ -655,31 +786,6 @@ def get_name_version_from_srcdir(srcdir: str) -> Tuple[str, str]:
     return (specs['name'], specs['version'])
 
 
-def get_http_req(url: str) -> urllib3.response.HTTPResponse:
-    """
-    Get urllib3 http response to request of remote resource
-    """
-    request = urllib3.PoolManager().request('GET', url)
-    if request.status != 200:
-        eprint('Failed ' + request.reason)
-        raise DownloadError(request.reason, url)
-
-    return request
-
-
-def download(url: str, path: str):
-    """
-    Download file from url to the specified path
-    """
-    iprint(f'Downloading {url} ... ')
-
-    request = get_http_req(url)
-    with open(path, 'wb') as outfile:
-        outfile.write(request.data)
-
-    iprint('Done')
-
-
 def list_files(topdir: str, exclude_dirs: bool = False) -> List[str]:
     """
     List files in topdir recursively. This does not follow symbolic links.
@@ -745,23 +851,74 @@ def str2bool(value: str) -> bool:
     raise ValueError(f'"{value}" does not represent a boolean value')
 
 
-def extract_matching_set(pcre: str, str_set: Set[str]) -> Set[str]:
-    """
-    given some pcre, get the set of matching string from str_set.
-    Those matching are removed from this set given in argument
+# Constructs of a pattern that would change meaning once the pattern is
+# embedded in a bigger regex: group names, backreferences and conditional
+# group references (numbering would be shifted) and global inline flags
+# (would apply to other patterns).
+_UNCOMBINABLE_RE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?<[^=!]|\(\?\('
+                              r'|\(\?[aiLmsux]+\)')
 
-    Args:
-        pcre: regex to test
-        str_set: set of string to update
 
-    Return:
-        The set of string in str_set matching pcre argument
+class RegexSet:
+    """
+    Set of regular expressions matched at once against strings.
 
+    The patterns are compiled into a single regex alternating all of them,
+    each in a named group. Hence a string is tested against all the patterns
+    in one regex match instead of one match per pattern. If the patterns
+    cannot be combined safely, they are tested one after the other.
     """
-    matching_re = re.compile(pcre)
-    matching_set = {f for f in str_set if matching_re.fullmatch(f)}
-    str_set.difference_update(matching_set)
-    return matching_set
+
+    def __init__(self, patterns: Iterable[str]):
+        self._regexes = [re.compile(p) for p in patterns]
+        self._combined = None
+        if self._regexes and not any(_UNCOMBINABLE_RE.search(r.pattern)
+                                     for r in self._regexes):
+            alternatives = [f'(?P<_{i}>{r.pattern})'
+                            for i, r in enumerate(self._regexes)]
+            try:
+                self._combined = re.compile('|'.join(alternatives))
+            except re.error:
+                pass
+
+    def match(self, string: str) -> Optional[int]:
+        """
+        Get the index of the first pattern matching the whole string, or None
+        if no pattern matches it.
+        """
+        if self._combined:
+            # The group of each pattern encloses all its inner groups: it is
+            # the last group closed when the pattern matches.
+            match = self._combined.fullmatch(string)
+            return int(match.lastgroup[1:]) if match else None
+
+        for i, regex in enumerate(self._regexes):
+            if regex.fullmatch(string):
+                return i
+
+        return None
+
+    def extract_matching(self, str_set: Set[str]) -> Dict[int, Set[str]]:
+        """
+        Remove from str_set the strings matching one of the patterns.
+
+        Args:
+            str_set: set of string to update
+
+        Return:
+            dictionary mapping the index of a pattern to the set of removed
+            strings whose first matching pattern is this one.
+        """
+        matching = {}
+        for string in str_set:
+            index = self.match(string)
+            if index is not None:
+                matching.setdefault(index, set()).add(string)
+
+        for matching_set in matching.values():
+            str_set.difference_update(matching_set)
+
+        return matching
 
 
 # pylint: disable=unused-argument
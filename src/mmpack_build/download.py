@@ -0,0 +1,148 @@
+# @mindmaze_header@
+"""
+helpers to download remote resources over HTTP
+"""
+
+import os
+import time
+
+from functools import cache, partial
+from hashlib import sha256
+
+import urllib3
+
+from .common import (SHA256_CHUNK_SIZE, eprint, iprint, memoize_sha256,
+                     rmfile, wprint)
+from .errors import DownloadError
+
+# Maximum number of connections kept open per host by the shared HTTP pool.
+# This also bounds the number of downloads that can be run in parallel.
+HTTP_POOL_MAXSIZE = 8
+
+# Maximum number of attempts of a download interrupted by transient errors
+DOWNLOAD_ATTEMPTS = 4
+
+
+@cache
+def _http_pool() -> urllib3.PoolManager:
+    """
+    Get the HTTP connection pool shared by all requests of the process
+    """
+    return urllib3.PoolManager(maxsize=HTTP_POOL_MAXSIZE, block=True)
+
+
+def get_http_req(url: str) -> urllib3.response.HTTPResponse:
+    """
+    Get urllib3 http response to request of remote resource
+    """
+    request = _http_pool().request('GET', url)
+    if request.status != 200:
+        eprint('Failed ' + request.reason)
+        raise DownloadError(request.reason, url)
+
+    return request
+
+
+# Errors after which a download is worth resuming
+_TRANSIENT_HTTP_ERRORS = (
+    urllib3.exceptions.IncompleteRead,
+    urllib3.exceptions.MaxRetryError,
+    urllib3.exceptions.ProtocolError,
+    urllib3.exceptions.TimeoutError,
+)
+
+
+def _download_part(url: str, partfile: str) -> str:
+    """
+    Download url into partfile. If partfile exists, only the missing data is
+    requested, if the server supports it.
+
+    Return: the sha256 of the whole partfile
+    """
+    hasher = sha256()
+    try:
+        offset = os.stat(partfile).st_size
+    except FileNotFoundError:
+        offset = 0
+
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    resp = _http_pool().request('GET', url, headers=headers,
+                                preload_content=False)
+    try:
+        content_range = resp.headers.get('Content-Range', '')
+        if resp.status == 206 and content_range.startswith(f'bytes {offset}-'):
+            mode = 'r+b'
+        elif resp.status == 200:
+            mode = 'wb'
+        elif offset and resp.status in (206, 416):
+            # Partial file cannot be resumed: start over
+            resp.drain_conn()
+            rmfile(partfile)
+            return _download_part(url, partfile)
+        else:
+            eprint('Failed ' + resp.reason)
+            raise DownloadError(resp.reason, url)
+
+        with open(partfile, mode) as outfile:
+            if mode == 'r+b':
+                for block in iter(partial(outfile.read, SHA256_CHUNK_SIZE),
+                                  b''):
+                    hasher.update(block)
+
+            for chunk in resp.stream(SHA256_CHUNK_SIZE):
+                outfile.write(chunk)
+                hasher.update(chunk)
+    finally:
+        resp.release_conn()
+
+    return hasher.hexdigest()
+
+
+def download(url: str, path: str, expected_sha256: str = None) -> str:
+    """
+    Download file from url to the specified path. The data is written in a
+    partial file (path with '.part' appended) renamed into path once complete
+    and verified. A transfer interrupted by a transient error is resumed
+    where it stopped, up to DOWNLOAD_ATTEMPTS times.
+
+    If expected_sha256 is set, a partial file left by a previous interrupted
+    download is resumed as well (the result is verified). Otherwise it is
+    discarded.
+
+    Args:
+        url: URL of the resource to download
+        path: path where to save downloaded file
+        expected_sha256: if not None, expected sha256 of the downloaded file
+
+    Return:
+        the sha256 of the downloaded file
+
+    Raises:
+        DownloadError: the download has failed or the downloaded file does
+            not match expected_sha256.
+    """
+    iprint(f'Downloading {url} ... ')
+
+    partfile = path + '.part'
+    if not expected_sha256:
+        rmfile(partfile)
+
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        try:
+            hexdig = _download_part(url, partfile)
+            break
+        except _TRANSIENT_HTTP_ERRORS as error:
+            if attempt == DOWNLOAD_ATTEMPTS:
+                raise DownloadError(str(error), url) from error
+            wprint(f'Download of {url} interrupted ({error}). Resuming...')
+            time.sleep(attempt)
+
+    if expected_sha256 and hexdig != expected_sha256:
+        rmfile(partfile)
+        raise DownloadError(f'sha256 mismatch (got {hexdig})', url)
+
+    os.replace(partfile, path)
+    memoize_sha256(path, hexdig)
+
+    iprint('Done')
+    return hexdig
@@ -4,10 +4,11 @@ helper module containing elf parsing functions
 """
 
 import os
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 from elftools.common.exceptions import ELFError
 from elftools.elf.elffile import ELFFile
+from elftools.elf.constants import SH_FLAGS
 from elftools.elf.dynamic import DynamicSection
 from elftools.elf.sections import NoteSection
 
@@ -87,6 +88,21 @@ def build_id(filename: str) -> Optional[str]:
     return None
 
 
+def data_sections(filename: str) -> Iterator[bytes]:
+    """
+    Iterate over the content of the initialized data sections loaded at
+    runtime (.rodata, .data, ...) of an ELF file.
+    """
+    with open(filename, 'rb') as fileobj:
+        elffile = ELFFile(fileobj)
+        for section in elffile.iter_sections():
+            flags = section['sh_flags']
+            if (section['sh_type'] == 'SHT_PROGBITS'
+                    and flags & SH_FLAGS.SHF_ALLOC
+                    and not flags & SH_FLAGS.SHF_EXECINSTR):
+                yield section.data()
+
+
 def _has_dynamic_section(filename) -> bool:
     """
     return whether the input filename is an elf file with a dynamic section
@@ -0,0 +1,72 @@
+# @mindmaze_header@
+"""
+inter-process locking based on lock files
+"""
+
+import os
+import time
+
+from contextlib import contextmanager
+
+try:
+    from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_SH
+
+    def _lock_fd(lock_fd: int, shared: bool, blocking: bool):
+        flock(lock_fd, (LOCK_SH if shared else LOCK_EX)
+              | (0 if blocking else LOCK_NB))
+
+except ImportError:
+    import msvcrt
+
+    # pylint: disable=missing-function-docstring,unused-argument
+    def _lock_fd(lock_fd: int, shared: bool, blocking: bool):
+        # Only exclusive locks are supported. Unlike LK_LOCK which gives up
+        # after 10 attempts, wait for the lock as long as needed.
+        while True:
+            try:
+                msvcrt.locking(lock_fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError as error:
+                if not blocking:
+                    raise BlockingIOError(str(error)) from error
+                time.sleep(0.1)
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False, blocking: bool = True):
+    """
+    Execute the block while holding a lock on the lock file at path. The lock
+    file is created if it does not exist. It is released when the block is
+    left, even if the process is killed.
+
+    The lock file may be removed by its holder to signal the removal of the
+    resource it protects: the waiters will then lock the newly created lock
+    file instead.
+
+    Args:
+        path: path of the lock file
+        shared: if True, a shared lock is taken, an exclusive lock otherwise
+            (on Windows, the lock is always exclusive)
+        blocking: if False, BlockingIOError is raised instead of waiting if
+            the lock is held by someone else
+    """
+    while True:
+        lock_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock_fd(lock_fd, shared, blocking)
+            try:
+                if os.stat(path).st_ino == os.fstat(lock_fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+        except BaseException:
+            os.close(lock_fd)
+            raise
+
+        # lock file has been removed while waiting for the lock
+        os.close(lock_fd)
+
+    try:
+        yield
+    finally:
+        os.close(lock_fd)
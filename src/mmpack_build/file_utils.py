@@ -5,7 +5,9 @@ Helpers to find out what files are
 
 import re
 import sysconfig
+from contextlib import contextmanager
 from os.path import islink, basename, splitext
+from typing import Dict, Iterator, Optional
 
 from .common import shell, wprint
 from .errors import MMPackBuildError
@@ -23,7 +25,30 @@ from .errors import MMPackBuildError
 _SHEBANG_REGEX = re.compile(br'#!\s*(?:/[^ \n/]+)*/(?:env\s+)?([^\s]+)')
 
 
-# pylint: disable=too-many-return-statements
+# Types of the files already inspected, indexed by path. Set only within
+# filetype_cache() context
+_FILETYPE_CACHE: Optional[Dict[str, str]] = None
+
+
+@contextmanager
+def filetype_cache() -> Iterator[None]:
+    """
+    Context manager within which filetype() inspects a file only once: the
+    type of each path is memoized until the outermost context exits. Hence
+    the files must not be modified, nor the current directory changed, while
+    in the context.
+    """
+    global _FILETYPE_CACHE  # pylint: disable=global-statement
+    prev_cache = _FILETYPE_CACHE
+    if prev_cache is None:
+        _FILETYPE_CACHE = {}
+
+    try:
+        yield
+    finally:
+        _FILETYPE_CACHE = prev_cache
+
+
 def filetype(filename):
     """
     get file type
@@ -33,6 +58,19 @@ def filetype(filename):
 
     If the file has a shebang, the interpreter name will be returned
     """
+    if _FILETYPE_CACHE is None:
+        return _filetype(filename)
+
+    ftype = _FILETYPE_CACHE.get(filename)
+    if ftype is None:
+        ftype = _filetype(filename)
+        _FILETYPE_CACHE[filename] = ftype
+
+    return ftype
+
+
+# pylint: disable=too-many-return-statements
+def _filetype(filename):
     if not islink(filename):
         try:
             # Open file and read magic number (binary)
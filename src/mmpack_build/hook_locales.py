@@ -4,16 +4,59 @@ plugin to package internationalization files
 """
 
 import re
-from struct import iter_unpack, unpack
-from typing import Dict, List, Set
+from hashlib import sha256
+from mmap import mmap, ACCESS_READ
+from operator import add
+from struct import unpack
+from typing import Dict, FrozenSet, Iterator, List, Optional
 
+from . import elf_utils, pe_utils
 from .base_hook import BaseHook
-from .common import shell, Assert
+from .common import Assert
 from .file_utils import filetype
 from .package_info import DispatchData, PackageInfo
 
 
-def _extract_msgids_from_gnu_mo(filename: str) -> Set[str]:
+# msgid sets of the GNU MO files already parsed, indexed by the hash of their
+# original strings
+_MO_MSGIDS_CACHE: Dict[bytes, FrozenSet[str]] = {}
+
+
+def _mo_msgids(data: memoryview, endianness: str) -> FrozenSet[str]:
+    """
+    Get the original strings (msgid) of GNU MO file data. The result is
+    cached by the content of the original strings, shared by the catalogs of
+    all languages of a project.
+    """
+    num, toffset = unpack(endianness + 'II', data[8:16])
+    if not num:
+        return frozenset()
+
+    table = data[toffset:toffset + num*8]
+    entries = unpack(f'{endianness}{num*2}I', table)
+    lengths = entries[0::2]
+    offsets = entries[1::2]
+
+    # Original strings are usually stored contiguously: hash the whole area
+    # containing them along with the table
+    strings_start = min(offsets)
+    strings_end = max(map(add, offsets, lengths))
+    key = sha256(table)
+    key.update(data[strings_start:strings_end])
+    key = key.digest()
+
+    msgids = _MO_MSGIDS_CACHE.get(key)
+    if msgids is None:
+        # '' is not an actual string entry (GNU MO metadata)
+        msgids = frozenset(str(data[offset:offset + slen], 'utf-8')
+                           for slen, offset in zip(lengths, offsets)
+                           if slen)
+        _MO_MSGIDS_CACHE[key] = msgids
+
+    return msgids
+
+
+def _extract_msgids_from_gnu_mo(filename: str) -> Optional[FrozenSet[str]]:
     """
     Extract the original strings (msgid) of GNU MO file. The format is simple
     and described at:
@@ -27,42 +70,54 @@ def _extract_msgids_from_gnu_mo(filename: str) -> Set[str]:
         return None
 
     with open(filename, 'rb') as gmo_fp:
-        # Read header and determine the endianness of the file from its magic
-        # number
-        magic = gmo_fp.read(4)
-        if magic[:4] == b'\x95\x04\x12\xde':
+        try:
+            gmo_map = mmap(gmo_fp.fileno(), 0, access=ACCESS_READ)
+        except ValueError:  # empty file cannot be mapped
+            return None
+
+    with gmo_map:
+        # Determine the endianness of the file from its magic number
+        magic = gmo_map[:4]
+        if magic == b'\x95\x04\x12\xde':
             endianness = '>'
-        elif magic[:4] == b'\xde\x12\x04\x95':
+        elif magic == b'\xde\x12\x04\x95':
             endianness = '<'
         else:
             return None
 
-        # Read whole file content in gmo_data
-        gmo_fp.seek(0)
-        gmo_data = gmo_fp.read()
+        rev = unpack(endianness + 'I', gmo_map[4:8])[0]
+        if rev != 0:
+            raise Assert(f'{filename} has an unsupported format revision '
+                         f'{rev}')
 
-    rev, num, toffset = unpack(endianness + 'III', gmo_data[4:16])
-    if rev != 0:
-        raise Assert(f'{filename} has an unsupported format revision {rev}')
+        with memoryview(gmo_map) as gmo_data:
+            return _mo_msgids(gmo_data, endianness)
 
-    # Walk in all entries of original strings
-    msgids = set()
-    fmt = endianness + 'II'
-    for slen, offset in iter_unpack(fmt, gmo_data[toffset:toffset+num*8]):
-        msgid = gmo_data[offset:slen+offset].decode('utf-8')
-        # '' is not an actual string entry (GNU MO metadata)
-        if msgid:
-            msgids.add(msgid)
 
-    return msgids
+# Control characters (whitespaces excepted) and bytes never found in UTF-8
+# cannot be part of a translated string: they delimit the candidate strings in
+# data sections. Since the bytes preceding a string may be data looking like
+# UTF-8, the printable ASCII strings (as reported by "strings -w") are tested
+# as well.
+_DATA_STRING_SEP_RES = (
+    re.compile(rb'[\x00-\x08\x0e-\x1f\x7f\xc0\xc1\xf5-\xff]+'),
+    re.compile(rb'[^\t-\r\x20-\x7e]+'),
+)
+
+# Minimal length of the msgids searched in data sections (the default minimal
+# string length of "strings"). Shorter msgids are likely to be found by chance.
+_MIN_MSGID_LEN = 4
 
 
-def _get_execfmt_strings(filename: str) -> List[str]:
+def _get_execfmt_data_sections(filename: str) -> Iterator[bytes]:
     """
-    Get the strings of the executable format file
+    Get the content of the data sections of the executable format file
     """
-    cmd = ['strings', '-d', '-w', '--output-separator=\x03', filename]
-    return shell(cmd, log=False).split('\x03')
+    file_type = filetype(filename)
+    if file_type == 'elf':
+        yield from elf_utils.data_sections(filename)
+    elif file_type == 'pe':
+        yield from pe_utils.data_sections(filename)
 
 
 class MMPackBuildHook(BaseHook):
@@ -103,7 +158,8 @@ class MMPackBuildHook(BaseHook):
             return
 
         # Collect the translated strings from all message file contained in the
-        # package
+        # package. Catalogs of the different languages mostly share the same
+        # msgids: merge them in a single set.
         msgids = set()
         for filename in pkg.files:
             mo_keys = _extract_msgids_from_gnu_mo(filename)
@@ -119,17 +175,32 @@ class MMPackBuildHook(BaseHook):
         if not locales_pkgs or pkg.ghost:
             return
 
-        # Collect all strings of data section in binary executable or shared
-        # library. This should encompass translatated strings if any
-        used_keys = set()
+        # Map each translated string, encoded as in executable data, to the
+        # names of the locales packages providing it
+        msgid_pkgs = {}
+        for other in locales_pkgs:
+            for msgid in other.provides['locales']:
+                key = msgid.encode('utf-8')
+                if len(key) < _MIN_MSGID_LEN:
+                    continue
+                msgid_pkgs.setdefault(key, set()).add(other.name)
+
+        # Scan the strings of data section in binary executable or shared
+        # library. This should encompass translatated strings if any. A
+        # dependency link is established with the locales package if one of
+        # the string matches one of its translated strings. Stop as soon as
+        # all locales packages are known to be used.
+        unused = {p.name for p in locales_pkgs}
         for filename in pkg.files:
-            file_type = filetype(filename)
-            if file_type in ('pe', 'elf'):
-                used_keys.update(_get_execfmt_strings(filename))
+            for data in _get_execfmt_data_sections(filename):
+                for sep_re in _DATA_STRING_SEP_RES:
+                    for key in msgid_pkgs.keys() & sep_re.split(data):
+                        unused.difference_update(msgid_pkgs[key])
+                if not unused:
+                    break
+            if not unused:
+                break
 
-        # Inspect locales provided by other cobuilded package and establish a
-        # dependency link if one of the string in data of current package match
-        # one of the translated string.
         for other in locales_pkgs:
-            if not used_keys.isdisjoint(other.provides['locales']):
+            if other.name not in unused:
                 pkg.add_to_deplist(other.name)
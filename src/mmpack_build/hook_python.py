@@ -3,28 +3,34 @@
 plugin tracking containing python file handling functions
 """
 
-import filecmp
+import atexit
 import json
 import os
 import re
+import stat
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from email.parser import Parser
 from glob import glob, iglob
 from itertools import chain
 from os.path import basename, commonpath, dirname, pathsep
 from pathlib import Path
+from subprocess import PIPE, Popen
 from textwrap import dedent
 from typing import (Set, Dict, List, Iterable, Iterator, NamedTuple, Optional,
                     Tuple)
 
 from .base_hook import BaseHook
-from .common import shell, iprint, rmfile, rmtree_force, wprint
+from .common import (dprint, eprint, shell, iprint, rmfile, rmtree_force,
+                     sha256sum, wprint)
+from .errors import ShellException
 from .file_utils import filetype
 from .package_info import PackageInfo, DispatchData
-from .prefix import cmd_in_optional_prefix
+from .prefix import build_in_prefix, cmd_in_optional_prefix
 from .provide import Provide, ProvideList, load_mmpack_provides, pkgs_provides
 from .syspkg_manager import get_syspkg_mgr
+from .workspace import Workspace
 
 
 # example of matches:
@@ -162,25 +168,133 @@ class _BuildFilenameGenerator:
 _FILENAME_GENERATOR = _BuildFilenameGenerator()
 
 
+def _pyscripts_env() -> Dict[str, str]:
+    # Prepend PKGDATADIR to PYTHONPATH for environment used to exec script
+    script_env = os.environ.copy()
+    prev = script_env.get('PYTHONPATH')
+    datadir = str(Path(__file__).parent.parent)
+    script_env['PYTHONPATH'] = datadir + ((pathsep + prev) if prev else '')
+    return script_env
+
+
+def _pyscripts_cache_opt() -> str:
+    return '--cache-dir=' + Workspace().cachedir() + '/pyscripts'
+
+
+class _PyScriptsServer:
+    """
+    Long-lived pyscripts process serving the requests of a build. This keeps
+    the astroid cache warm across all the analysis of the python files.
+    """
+    def __init__(self):
+        self._proc = None
+
+    def _start(self):
+        cmd = ['python3', '-m', 'pyscripts', _pyscripts_cache_opt(), 'serve']
+        dprint('[pyscripts] ' + ' '.join(cmd))
+        # The process outlives this call: it is terminated in stop()
+        # pylint: disable=consider-using-with
+        self._proc = Popen(cmd, stdin=PIPE, stdout=PIPE,
+                           env=_pyscripts_env(), encoding='utf-8')
+
+    def stop(self):
+        """
+        Terminate the server process if running
+        """
+        if not self._proc:
+            return
+
+        self._proc.stdin.close()
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
+
+    def _send(self, req: Dict, name: str):
+        if not self._proc:
+            self._start()
+
+        try:
+            self._proc.stdin.write(json.dumps(req) + '\n')
+            self._proc.stdin.flush()
+            line = self._proc.stdout.readline()
+        except BrokenPipeError:
+            line = ''
+
+        if not line:
+            self.stop()
+            raise ShellException('pyscripts server exited unexpectedly')
+
+        response = json.loads(line)
+        for logline in response['log'].splitlines():
+            eprint(logline)
+
+        if 'error' in response:
+            eprint(response['error'])
+            raise ShellException(f'pyscripts {name} failed')
+
+        return response['result']
+
+    def request(self, name: str, sitedirs: List[str],
+                files: List[str]) -> Dict[str, List[str]]:
+        """
+        Run pyscripts command in server process
+
+        Args:
+            name: name of the pyscripts command
+            sitedirs: python site-packages folders
+            files: list of files to pass to the command
+
+        Raises:
+            ShellException: the command has failed or the server has died
+        """
+        req = {'command': name, 'site_paths': sitedirs, 'files': files}
+        return self._send(req, name)
+
+    def request_batch(self, name: str,
+                      calls: List[Tuple[List[str], List[str]]]
+                      ) -> List[Dict[str, List[str]]]:
+        """
+        Run a pyscripts command several times in a single server request
+
+        Args:
+            name: name of the pyscripts command
+            calls: list of couple of site-packages folders and files to pass
+                to each command run
+
+        Return: the list of the result of each command run
+
+        Raises:
+            ShellException: a command has failed or the server has died
+        """
+        batch = [{'command': name, 'site_paths': sitedirs, 'files': files}
+                 for sitedirs, files in calls]
+        return self._send({'batch': batch}, name)
+
+
+_PYSCRIPTS_SERVER = _PyScriptsServer()
+atexit.register(_PYSCRIPTS_SERVER.stop)
+
+
 def _exec_pyscript(name: str, sitedirs: List[str], files: Iterable[str],
                    try_in_prefix: bool = False) -> Dict[str, Set[str]]:
+    files = list(files)
+
+    # The server runs outside of prefix, hence a command that must be
+    # executed in the build prefix needs its own process
+    if not (try_in_prefix and build_in_prefix()):
+        output = _PYSCRIPTS_SERVER.request(name, sitedirs, files)
+        return {k: set(v) for k, v in output.items()}
+
     infile = _FILENAME_GENERATOR.get(f'{name}.pyfiles')
 
-    cmd = ['python3', '-m', 'pyscripts']
+    cmd = ['python3', '-m', 'pyscripts', _pyscripts_cache_opt()]
     cmd += ['--site-path='+path for path in sitedirs]
     cmd += [name, infile]
 
     with open(infile, 'w', encoding='utf-8') as stream:
         stream.write('\n'.join(files))
 
-    # Prepend PKGDATADIR to PYTHONPATH for environment used to exec script
-    script_env = os.environ.copy()
-    prev = script_env.get('PYTHONPATH')
-    datadir = str(Path(__file__).parent.parent)
-    script_env['PYTHONPATH'] = datadir + ((pathsep + prev) if prev else '')
-
-    cmd_output = shell(cmd_in_optional_prefix(cmd) if try_in_prefix else cmd,
-                       env=script_env)
+    cmd_output = shell(cmd_in_optional_prefix(cmd), env=_pyscripts_env())
     return {k: set(v) for k, v in json.loads(cmd_output).items()}
 
 
@@ -210,6 +324,71 @@ def _create_launcher(launcher: str, settings: str):
     os.chmod(script, mode)
 
 
+def _stat_signature(st_res: os.stat_result) -> Tuple[int, int, int]:
+    return (stat.S_IFMT(st_res.st_mode), st_res.st_size, st_res.st_mtime_ns)
+
+
+def _check_same_files(conflicts: List[Tuple[str, str]]):
+    """
+    Check that the files of each pair have the same content. The cheap tests
+    on the file status are done first, the content of the remaining pairs are
+    hashed in parallel.
+
+    Raises:
+        FileExistsError: the files of a pair differ
+    """
+    to_hash = []
+    for src, dst in conflicts:
+        src_st = os.stat(src)
+        dst_st = os.stat(dst)
+        if (src_st.st_dev, src_st.st_ino) == (dst_st.st_dev, dst_st.st_ino):
+            continue
+        if src_st.st_size != dst_st.st_size:
+            raise FileExistsError(dst)
+        if _stat_signature(src_st) == _stat_signature(dst_st):
+            continue
+        to_hash.append((src, dst))
+
+    if not to_hash:
+        return
+
+    with ThreadPoolExecutor() as executor:
+        src_hashes = executor.map(sha256sum, [src for src, _ in to_hash])
+        dst_hashes = executor.map(sha256sum, [dst for _, dst in to_hash])
+        for (_, dst), src_hash, dst_hash in zip(to_hash, src_hashes,
+                                                dst_hashes):
+            if src_hash != dst_hash:
+                raise FileExistsError(dst)
+
+
+def _relocate_tree(srcdir: str, dstdir: str):
+    """
+    Move the content of srcdir into dstdir. An entry of srcdir whose
+    destination does not exist is moved at once (whole folder if it is one).
+    A file is allowed to exist in both only if they have the same content.
+
+    Raises:
+        FileExistsError: a file differs from the one existing in dstdir
+    """
+    conflicts = []
+    todo = [(srcdir, dstdir)]
+    while todo:
+        src_parent, dst_parent = todo.pop()
+        with os.scandir(src_parent) as entries:
+            for entry in entries:
+                dst = os.path.join(dst_parent, entry.name)
+                if not os.path.lexists(dst):
+                    os.replace(entry.path, dst)
+                elif entry.is_dir(follow_symlinks=False):
+                    if not os.path.isdir(dst):
+                        raise FileExistsError(dst)
+                    todo.append((entry.path, dst))
+                else:
+                    conflicts.append((entry.path, dst))
+
+    _check_same_files(conflicts)
+
+
 def _add_launchers(entry_file: str):
     parser = EntryPointsParser(entry_file)
 
@@ -222,13 +401,70 @@ def _add_launchers(entry_file: str):
         _create_launcher(launcher, settings)
 
 
+class _ImportNameResolver:
+    """
+    Resolver of the root import name of python files based only on their path.
+    A folder is considered as a regular package if it contains a __init__
+    module, as namespace package otherwise.
+    """
+    def __init__(self, sitedirs: Iterable[str]):
+        # Try the most specific sitedirs first, current dir at last resort
+        roots = [os.path.abspath(d) for d in sitedirs]
+        self._roots = sorted(roots, key=len, reverse=True)
+        self._fallback_root = os.getcwd()
+        self._is_regular_pkg = {}
+
+    def _is_regular_pkg_dir(self, path: str) -> bool:
+        is_regular = self._is_regular_pkg.get(path)
+        if is_regular is None:
+            try:
+                is_regular = any(n.split('.')[0] == '__init__'
+                                 for n in os.listdir(path))
+            except OSError:
+                is_regular = False
+            self._is_regular_pkg[path] = is_regular
+
+        return is_regular
+
+    def root_modname(self, pyfile: str) -> str:
+        """
+        Get the name of the deepest regular package containing pyfile, ie the
+        first parent package that is not a namespace package.
+        """
+        path = os.path.abspath(pyfile)
+        for root in self._roots:
+            if path.startswith(root + os.sep):
+                break
+        else:
+            root = self._fallback_root
+
+        # A module name cannot contain dot, hence what follows the first dot
+        # is the extension (this covers compiled module suffixes)
+        modpath = os.path.relpath(path, root).split(os.sep)
+        modpath[-1] = modpath[-1].split('.')[0]
+
+        pkgdir = root
+        for depth, name in enumerate(modpath[:-1], start=1):
+            pkgdir = os.path.join(pkgdir, name)
+            if self._is_regular_pkg_dir(pkgdir):
+                break
+        else:
+            depth = len(modpath)
+
+        return '.'.join(modpath[:depth])
+
+
 def _gen_py_importname(pyfiles: Iterable[str],
                        sitedirs: List[str]) -> Dict[str, Set[str]]:
     cmdfiles = [f for f in pyfiles if _is_py_file(f)]
     if not cmdfiles:
         return {}
 
-    pkgfiles = _exec_pyscript('dispatch', sitedirs, cmdfiles)
+    resolver = _ImportNameResolver(sitedirs)
+    pkgfiles = {}
+    for pyfile in cmdfiles:
+        modname = resolver.root_modname(pyfile)
+        pkgfiles.setdefault(modname, set()).add(pyfile)
 
     # Assign data file to its enclosing python public package
     data_files = set(pyfiles).difference(set(cmdfiles))
@@ -243,25 +479,56 @@ def _gen_py_importname(pyfiles: Iterable[str],
     return pkgfiles
 
 
-def _gen_pysymbols(pkgfiles: Set[str],
-                   sitedirs: List[str]) -> Dict[str, Set[str]]:
-    # Filter out files that are not python script nor subpath of any sitedirs
+def _sites_pyfiles(pkgfiles: Iterable[str],
+                   sitedirs: Iterable[str]) -> List[str]:
+    """
+    Get python scripts of pkgfiles that are subpath of any sitedirs
+    """
     sites_files = set()
     for sitedir in sitedirs:
         sites_files.update({f for f in pkgfiles
                             if _is_py_file(f)
                             and os.path.commonpath([f, sitedir]) == sitedir})
 
-    # Skip processing if there are no python package in sitedirs
-    if not sites_files:
-        return {}
+    return sorted(sites_files)
+
+
+def _gen_pysymbols(pkgfiles: Set[str],
+                   sitedirs: List[str]) -> Dict[str, Set[str]]:
+    return _gen_pysymbols_batch([(pkgfiles, sitedirs)])[0]
+
+
+def _gen_pysymbols_batch(groups: List[Tuple[Set[str], List[str]]]
+                         ) -> List[Dict[str, Set[str]]]:
+    """
+    Get the python symbols provided by several groups of files in a single
+    pyscripts run
+
+    Args:
+        groups: list of couple of files and the sitedirs in which the provided
+            python packages must be searched
+
+    Return: the mapping of python package to symbols for each group
+    """
+    calls = []
+    for pkgfiles, sitedirs in groups:
+        # Filter out files that are not python script nor subpath of any
+        # sitedirs
+        sitedirs = sorted(sitedirs)
+        calls.append((sitedirs, _sites_pyfiles(pkgfiles, sitedirs)))
+
+    # Skip processing of groups that have no python package in sitedirs
+    todo = [c for c in calls if c[1]]
+    results = iter(_PYSCRIPTS_SERVER.request_batch('provides', todo)
+                   if todo else [])
 
-    return _exec_pyscript('provides', sitedirs, sites_files)
+    return [{k: set(v) for k, v in next(results).items()} if files else {}
+            for _, files in calls]
 
 
-def _gen_py_provides(pkg: PackageInfo, sitedirs: List[str]) -> ProvideList:
+def _py_provides(pkg: PackageInfo, symbols: Dict[str, Set[str]]
+                 ) -> ProvideList:
     providelist = ProvideList('python')
-    symbols = _gen_pysymbols(pkg.files, sitedirs)
 
     # Group provided symbols by python package names (import name)
     for pyname, pyname_syms in symbols.items():
@@ -419,8 +686,12 @@ class MMPackBuildHook(BaseHook):
         super().__init__(**kwargs)
         self._mmpack_py_provides = None
         self._private_sitedirs = []
+        self._pkgs_pysymbols = {}
         _FILENAME_GENERATOR.reset(self._builddir)
 
+        # Start from fresh astroid state for each build
+        _PYSCRIPTS_SERVER.stop()
+
     def _get_mmpack_provides(self) -> ProvideList:
         """
         Get all shared library soname and associated symbols for all mmpack
@@ -492,41 +763,33 @@ class MMPackBuildHook(BaseHook):
         # unversioned one
         for pydir in glob('lib/python3.*/site-packages'):
             os.makedirs(_MMPACK_REL_PY_SITEDIR, exist_ok=True)
-            for srcdir, dirs, files in os.walk(pydir):
-                reldir = os.path.relpath(srcdir, pydir)
-                dstdir = os.path.join(_MMPACK_REL_PY_SITEDIR, reldir)
-
-                # Create the folders in unversioned python3 site package
-                for dirpath in dirs:
-                    os.makedirs(os.path.join(dstdir, dirpath), exist_ok=True)
-
-                # Move files to unversioned python3 site package
-                for filename in files:
-                    src = os.path.join(srcdir, filename)
-                    dst = os.path.join(dstdir, filename)
-
-                    # If destination file exists, we have no issue if source
-                    # and destination are the same
-                    if os.path.lexists(dst):
-                        if filecmp.cmp(src, dst):
-                            continue
-                        raise FileExistsError
-
-                    os.replace(src, dst)
+            _relocate_tree(pydir, _MMPACK_REL_PY_SITEDIR)
 
             # Remove the remainings
             rmtree_force(pydir)
 
-        # Transform versioned egg-info to unversioned one
+        try:
+            with os.scandir(_MMPACK_REL_PY_SITEDIR) as entries:
+                sitedir_entries = sorted(e.name for e in entries)
+        except FileNotFoundError:
+            return
+
         egginfo_re = re.compile(r'(.*)-py3(?:\.\d\w*)*.egg-info$')
-        for eggdir in glob(_MMPACK_REL_PY_SITEDIR + '/*.egg-info'):
-            match = egginfo_re.fullmatch(eggdir)
+        for name in sitedir_entries:
+            path = os.path.join(_MMPACK_REL_PY_SITEDIR, name)
+
+            # Transform versioned egg-info to unversioned one
+            match = egginfo_re.fullmatch(name)
             if match:
-                os.rename(eggdir, match.group(1) + '.egg-info')
+                newpath = os.path.join(_MMPACK_REL_PY_SITEDIR,
+                                       match.group(1) + '.egg-info')
+                os.rename(path, newpath)
+                path = newpath
 
-        # Create launcher for entry points
-        for entry_file in glob('lib/python3/site-packages/*/entry_points.txt'):
-            _add_launchers(entry_file)
+            # Create launcher for entry points
+            entry_file = os.path.join(path, 'entry_points.txt')
+            if os.path.exists(entry_file):
+                _add_launchers(entry_file)
 
     def dispatch(self, data: DispatchData):
         pypkgs: Dict[str, _PyPkg] = {}
@@ -574,17 +837,32 @@ class MMPackBuildHook(BaseHook):
 
         self._guess_private_sitedirs(data.pkgs.keys())
 
+    def prepare_provides(self, pkgs: List[PackageInfo]):
+        # Search public and private python package symbols of all packages
+        # in one pyscripts run
+        groups = []
+        for pkg in pkgs:
+            groups.append((pkg.files, _get_packaged_public_sitedirs(pkg)))
+            groups.append((pkg.files, self._private_sitedirs))
+
+        symbols = _gen_pysymbols_batch(groups)
+        for i, pkg in enumerate(pkgs):
+            self._pkgs_pysymbols[pkg.name] = (symbols[2*i], symbols[2*i + 1])
+
     def update_provides(self, pkg: PackageInfo,
                         specs_provides: Dict[str, Dict]):
+        if pkg.name not in self._pkgs_pysymbols:
+            self.prepare_provides([pkg])
+        public_syms, private_syms = self._pkgs_pysymbols.pop(pkg.name)
+
         # Add public python package
-        public_sitedirs = _get_packaged_public_sitedirs(pkg)
-        py3_provides = _gen_py_provides(pkg, public_sitedirs)
+        py3_provides = _py_provides(pkg, public_syms)
         py3_provides.update_from_specs(specs_provides, pkg)
         pkg.provides['python'] = py3_provides
 
         # Register private python package for cobuilded package dependency
         # resolution
-        pkg.provides['pypriv'] = _gen_py_provides(pkg, self._private_sitedirs)
+        pkg.provides['pypriv'] = _py_provides(pkg, private_syms)
 
     def store_provides(self, pkg: PackageInfo, folder: str):
         filename = f'{folder}/{pkg.name}.pyobjects.gz'
@@ -9,7 +9,7 @@ from argparse import ArgumentParser, Namespace
 from typing import Any, Callable, Dict
 
 from .errors import MMPackBuildError
-from .source_tarball import SourceTarball
+from .source_tarball import SourceTarball, SRC_COMPRESSIONS
 from .src_package import SrcPackage
 
 
@@ -45,6 +45,14 @@ def add_parser_args(parser: ArgumentParser):
     parser.add_argument('--update-version-from-vcs',
                         action='store_true', default=False,
                         help='update version from commits since version tag')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='maximum number of projects whose source package '
+                             'are generated concurrently (default: number '
+                             'of CPUs)')
+    parser.add_argument('--src-compression', dest='src_compression',
+                        choices=SRC_COMPRESSIONS.keys(), default='xz',
+                        help='compression of the source packages generated '
+                             '(default: xz)')
     parser.add_argument('--stop-on-error',
                         action='store_true', default=False,
                         help='stop at first error when building multiple '
@@ -52,7 +60,9 @@ def add_parser_args(parser: ArgumentParser):
 
 
 def _source_tarball_kwargs(args: Namespace) -> Dict[str, Any]:
-    kwargs = {'version_from_vcs': args.update_version_from_vcs}
+    kwargs = {'version_from_vcs': args.update_version_from_vcs,
+              'jobs': args.jobs,
+              'src_compression': args.src_compression}
 
     if args.only_modified is not False:
         kwargs['build_only_modified'] = args.only_modified
@@ -93,7 +103,8 @@ def call_foreach_srcpkg(func: Callable[[SrcPackage, Namespace], None],
                                **_source_tarball_kwargs(args))
     for prj in srctarball.iter_mmpack_srcs():
         try:
-            pkg = SrcPackage(prj.tarball, srctarball.tag, prj.srcdir)
+            pkg = SrcPackage(prj.tarball, srctarball.tag, prj.srcdir,
+                             incremental=args.incremental)
             func(pkg, args)
         except MMPackBuildError as err:
             print(f'Build of {prj.name} failed: {err}', file=sys.stderr)
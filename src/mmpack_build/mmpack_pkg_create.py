@@ -24,6 +24,10 @@ def add_parser_args(parser: ArgumentParser):
     parser.add_argument('--skip-build-tests',
                         action='store_true', dest='skip_tests',
                         help='indicate that build tests must not be run')
+    parser.add_argument('--incremental',
+                        action='store_true', dest='incremental',
+                        help='reuse the build tree of the previous build '
+                             'of the same package and tag')
     parser.add_argument('--build-deps',
                         action='store_const', dest='build_deps', const=True,
                         help='install build dependencies (DEPRECATED)')
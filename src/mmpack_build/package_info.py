@@ -4,9 +4,9 @@ interexchange data for package definition
 """
 
 import re
-from typing import Set, Tuple
+from typing import Dict, List, Set, Tuple
 
-from .common import extract_matching_set
+from .common import RegexSet
 from .mm_version import Version
 
 
@@ -99,6 +99,7 @@ class PackageInfo:
     def __init__(self, name: str):
         self.name = name
         self.files = set()
+        self.files_sha256 = {}  # hashes of files, in sha256sums format
         self.provides = {}
         self.deplist = []  # List of triplet of (dep_name, min_ver, max_ver)
         self.version = Version('any')
@@ -121,9 +122,10 @@ class PackageInfo:
         """
         self.sysdeps.add(sysdep)
 
-    def init_from_specs(self, specs, host_dist: str, install_files: Set[str]):
+    def init_from_specs(self, specs, host_dist: str):
         """
-        Init fields from custom package specification.
+        Init fields from custom package specification. The files are not
+        populated here, see DispatchData.assign_matching().
         """
         self.description = specs.get('description', '').strip()
 
@@ -136,10 +138,6 @@ class PackageInfo:
         for dep in specs.get(sysdeps_key, []):
             self.add_sysdep(dep)
 
-        # Populate files
-        for regex in specs.get('files', []):
-            self.files.update(extract_matching_set(regex, install_files))
-
 
 class DispatchData:
     # pylint: disable=too-few-public-methods
@@ -175,3 +173,24 @@ class DispatchData:
             self.unassigned_files.difference_update(files)
 
         return pkg
+
+    def assign_matching(self, pkg_patterns: Dict[str, List[str]]):
+        """
+        Assign the unassigned files matching regex patterns to packages. A
+        file is assigned to the package of the first pattern matching it,
+        considering the packages in the order of pkg_patterns. Whatever the
+        number of patterns, each file is tested only once.
+
+        Args:
+            pkg_patterns: dictionary mapping package name to the list of
+                regex that the path of its files must match.
+        """
+        owners = []
+        patterns = []
+        for name, regexes in pkg_patterns.items():
+            owners += [name] * len(regexes)
+            patterns += regexes
+
+        matching = RegexSet(patterns).extract_matching(self.unassigned_files)
+        for index, files in matching.items():
+            self.assign_to_pkg(owners[index], files)
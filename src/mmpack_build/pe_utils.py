@@ -5,7 +5,7 @@ helper module containing pe parsing functions
 
 import os
 from os.path import join as joinpath
-from typing import Optional
+from typing import Iterator, Optional
 
 import pefile
 
@@ -20,6 +20,11 @@ from .provide import Provide as ShlibProvide
 pefile.allowed_function_name += b'.'
 
 
+_SCN_CNT_INITIALIZED_DATA = \
+    pefile.SECTION_CHARACTERISTICS['IMAGE_SCN_CNT_INITIALIZED_DATA']
+_SCN_MEM_EXECUTE = pefile.SECTION_CHARACTERISTICS['IMAGE_SCN_MEM_EXECUTE']
+
+
 def soname(filename: str) -> str:
     """
     Return the SONAME of given library
@@ -70,6 +75,22 @@ def build_id(filename: str) -> Optional[str]:
     return None
 
 
+def data_sections(filename: str) -> Iterator[bytes]:
+    """
+    Iterate over the content of the initialized data sections (.rdata,
+    .data, ...) of a PE file.
+    """
+    pe_file = pefile.PE(filename, fast_load=True)
+    try:
+        for section in pe_file.sections:
+            flags = section.Characteristics
+            if (flags & _SCN_CNT_INITIALIZED_DATA
+                    and not flags & _SCN_MEM_EXECUTE):
+                yield section.get_data()
+    finally:
+        pe_file.close()
+
+
 def soname_deps(filename):
     """
     Parse given pe file and return its dependency soname list
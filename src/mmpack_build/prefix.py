@@ -8,9 +8,10 @@ from argparse import Namespace
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from enum import Enum
+from threading import Lock
 from typing import Dict, Iterable, List, Optional
 
-from .common import popdir, pushdir, run_cmd
+from .common import run_cmd
 from .workspace import Workspace
 
 
@@ -59,6 +60,10 @@ class PrefixHandlingOptions:
 
 _PREFIX_OPTIONS = PrefixHandlingOptions()
 
+# Serialize the package installations in prefix (they may be requested by
+# concurrent source package generations)
+_PREFIX_INSTALL_LOCK = Lock()
+
 
 def _mmpack_cmd() -> List[str]:
     wrk = Workspace()
@@ -80,8 +85,16 @@ def prefix_install(pkgs: Iterable[str]):
         return
 
     cmd = _mmpack_cmd()
-    run_cmd(cmd + ['update'])
-    run_cmd(cmd + ['install', '-y'] + install_list)
+    with _PREFIX_INSTALL_LOCK:
+        run_cmd(cmd + ['update'])
+        run_cmd(cmd + ['install', '-y'] + install_list)
+
+
+def build_in_prefix() -> bool:
+    """
+    Return whether the commands of the build are run in a mmpack prefix
+    """
+    return _PREFIX_OPTIONS.use_build_prefix is not BuildPrefix.NONE
 
 
 def cmd_in_optional_prefix(args: List[str]) -> List[str]:
@@ -89,7 +102,7 @@ def cmd_in_optional_prefix(args: List[str]) -> List[str]:
     Return list of args to run command in mmpack prefix if prefix set,
     otherwise directly.
     """
-    if _PREFIX_OPTIONS.use_build_prefix is not BuildPrefix.NONE:
+    if build_in_prefix():
         return _mmpack_cmd() + ['run'] + args
 
     return args
@@ -153,6 +166,5 @@ def run_build_script(name: str, execdir: str, specdir: str,
     cmd = ['sh', os.path.abspath(script)]
     cmd += args if args else []
 
-    pushdir(os.path.abspath(execdir))
-    run_cmd(cmd_in_optional_prefix(cmd), env=hook_env)
-    popdir()
+    run_cmd(cmd_in_optional_prefix(cmd), env=hook_env,
+            cwd=os.path.abspath(execdir))
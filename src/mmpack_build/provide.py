@@ -344,16 +344,11 @@ class ProvideList:
         if not provide:
             return (None, Version(None))
 
-        min_version = None
-        for sym in list(symbols):  # iterate over a shallow copy of the list
-            if sym in provide.symbols:
-                metadata_version = provide.symbols[sym]
-                if min_version:
-                    min_version = max(min_version, metadata_version)
-                else:
-                    min_version = metadata_version
-                symbols.remove(sym)  # remove symbol from the list
+        # Intersection cost depends only on the smaller set
+        found = symbols.intersection(provide.symbols)
+        symbols.difference_update(found)
 
+        min_version = max((provide.symbols[s] for s in found), default=None)
         if not min_version:
             min_version = Version(None)
 
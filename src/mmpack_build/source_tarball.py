@@ -6,22 +6,40 @@ Fetch/gather sources of a mmpack package and create source tarball
 import os
 import re
 import shutil
-from copy import copy
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
+from itertools import islice
 from os.path import abspath, basename, exists, join as join_path
 from subprocess import call, DEVNULL
-from tarfile import open as taropen, TarFile, TarInfo
+from tarfile import TarFile, TarInfo
+from threading import local
 from typing import Dict, Iterator, List, NamedTuple, Optional
 from zipfile import ZipFile
 
+from .archive import create_tarball, open_tarball
 from .common import *
+from .download import download
 from .errors import DownloadError, MMPackBuildError, ShellException
+from .file_lock import file_lock
 from .file_utils import filetype
-from .prefix import new_mmpack_prefix_context, prefix_install, run_build_script
+from .prefix import (build_in_prefix, new_mmpack_prefix_context,
+                     prefix_install, run_build_script)
 from .source_strap_specs import SourceStrapSpecs
 from .workspace import Workspace, cached_download, find_project_root_folder
 from .builddeps_guess import guess_build_depends
 
 
+# Supported compressions of source tarball and the associated file extension.
+# The compression is detected from file content when tarballs are read.
+SRC_COMPRESSIONS = {
+    'xz': 'tar.xz',
+    'xz-mt': 'tar.xz',
+    'zst': 'tar.zst',
+}
+
+
 class ProjectSource(NamedTuple):
     """
     Project source to be build
@@ -66,6 +84,38 @@ def _git_subcmd(subcmd: List[str], repodir: str,
     return shell(args, env=env).strip()
 
 
+def _git_fetch_from_mirror(url: str, repodir: str, refspec: str,
+                           git_ssh_cmd: str = None):
+    """
+    Fetch refspec from url into repodir, reusing the objects previously
+    fetched from url by any build. The mirror of url in cache is updated with
+    the missing objects and is registered as alternate object store of
+    repodir: objects are neither downloaded nor copied again.
+    """
+    mirror = Workspace().git_mirror(url)
+    with file_lock(mirror + '.lock'):
+        # Mark the mirror as used for the cache cleanup
+        os.utime(mirror + '.lock')
+
+        if not os.path.isdir(mirror):
+            shell(['git', 'init', '--quiet', '--bare', mirror])
+
+        # Update mirror. The fetched object is kept referenced by a ref
+        # otherwise it could be garbage collected.
+        fetch_ref = 'refs/mmpack-build/fetched'
+        _git_subcmd(['fetch', '--quiet', '--tags', '--force', url,
+                     f'+{refspec}:{fetch_ref}'], mirror, git_ssh_cmd)
+
+        alternates = join_path(repodir, '.git/objects/info/alternates')
+        with open(alternates, 'a', encoding='utf-8') as alt_file:
+            alt_file.write(abspath(mirror + '/objects') + '\n')
+
+        # All objects are available through alternates, only refs are
+        # transferred
+        _git_subcmd(['fetch', '--quiet', '--tags', abspath(mirror),
+                     fetch_ref], repodir)
+
+
 # pylint: disable=too-many-arguments
 def _git_clone(url: str, repodir: str,
                refspec: str = None, git_ssh_cmd: str = None):
@@ -89,9 +139,17 @@ def _git_clone(url: str, repodir: str,
     # Create and init git repository
     _git_subcmd(['init', '--quiet'], repodir)
 
-    # Fetch git refspec
+    # Fetch git refspec, through the mirror of the repository if it can be
+    # updated
     fetch_args = ['fetch', '--quiet', '--tags', url, refspec]
-    _git_subcmd(fetch_args, repodir, git_ssh_cmd)
+    if url.startswith('file://'):
+        _git_subcmd(fetch_args, repodir, git_ssh_cmd)
+    else:
+        try:
+            _git_fetch_from_mirror(url, repodir, refspec, git_ssh_cmd)
+        except ShellException as exc:
+            wprint(f'Cannot use git mirror of {url}: {exc}')
+            _git_subcmd(fetch_args, repodir, git_ssh_cmd)
 
     # Checkout the specified refspec
     _git_subcmd(['checkout', '--quiet', '--detach', 'FETCH_HEAD'], repodir)
@@ -139,6 +197,10 @@ class SourceTarball:
                 it will be located in Workspace().outdir()
             **kwargs: supported optional keyword arguments are following
                 git_ssh_cmd: ssh cmd to use when cloning git repo through ssh
+                jobs: maximum number of projects whose sources are generated
+                    concurrently. If unset, the number of CPUs is used.
+                src_compression: compression of the generated source
+                    tarballs, 'xz' (default), 'xz-mt' or 'zst'
         """
         if not path_url:
             path_url = find_project_root_folder(find_multiproj=True)
@@ -150,12 +212,22 @@ class SourceTarball:
         self._method = method if method else 'guess'
         self._path_url = path_url
         self._kwargs = kwargs
-        self._builddir = Workspace().tmpdir()
+        # Sources of projects may be generated while the current directory
+        # is changed: use only absolute paths
+        self._builddir = abspath(Workspace().tmpdir())
         self._downloaded_file = None
         self._srcdir = None
-        self._outdir = outdir if outdir else Workspace().outdir()
-        self._curr_subdir = ''
+        self._outdir = abspath(outdir if outdir else Workspace().outdir())
         self.trace = {}
+        self._jobs = kwargs.get('jobs') or os.cpu_count() or 1
+        self._compression = kwargs.get('src_compression') or 'xz'
+        if self._compression not in SRC_COMPRESSIONS:
+            raise MMPackBuildError('Invalid source compression '
+                                   + self._compression)
+
+        # State of the project whose source is being generated in the
+        # current thread: subdir and trace
+        self._prj = local()
         self._update_version = kwargs.get('version_from_vcs', False)
 
         if self._method == 'guess':
@@ -192,7 +264,7 @@ class SourceTarball:
 
         if exists(self._path_url):
             dprint(f'{self._path_url} is a local file/dir')
-            self._downloaded_file = self._path_url
+            self._downloaded_file = abspath(self._path_url)
             return self._downloaded_file
 
         path = join_path(self._builddir, basename(self._path_url))
@@ -213,7 +285,7 @@ class SourceTarball:
 
         try:
             path = self._get_path_or_url_file()
-            with taropen(path, 'r:*') as tar:
+            with open_tarball(path) as tar:
                 if './mmpack/src_orig_tracing' in tar.getnames():
                     return 'srcpkg'
                 else:
@@ -226,9 +298,10 @@ class SourceTarball:
 
     def _gen_project_sources(self, subdir: str = '') -> ProjectSource:
         srcdir = self._srcdir
-        self._curr_subdir = subdir
+        self._prj.subdir = subdir
+        self._prj.trace = deepcopy(self.trace)
         if subdir:
-            self.trace['pkg']['subdir'] = subdir
+            self._prj.trace['pkg']['subdir'] = subdir
             srcdir += '/' + subdir
 
         os.makedirs(self._get_prj_builddir(), exist_ok=True)
@@ -239,7 +312,7 @@ class SourceTarball:
             srctar = f'{self._outdir}/{basename(self._path_url)}'
             name, version = get_name_version_from_srcdir(srcdir)
             try:
-                shutil.copy(self._path_url, srctar)
+                shutil.copy(self._get_path_or_url_file(), srctar)
             except shutil.SameFileError:
                 pass
         else:
@@ -248,7 +321,8 @@ class SourceTarball:
 
             # extract minimal metadata from package
             name, version = get_name_version_from_srcdir(srcdir)
-            srctar = f'{self._outdir}/{name}_{version}_src.tar.xz'
+            ext = SRC_COMPRESSIONS[self._compression]
+            srctar = f'{self._outdir}/{name}_{version}_src.{ext}'
 
             # Prevent git folder being packaged
             if self._method == 'git' and not subdir:
@@ -256,7 +330,7 @@ class SourceTarball:
 
             # Create source package tarball
             dprint('Building source tarball ' + srctar)
-            create_tarball(srcdir, srctar, 'xz')
+            create_tarball(srcdir, srctar, self._compression)
 
         return ProjectSource(name=name,
                              version=version,
@@ -264,7 +338,7 @@ class SourceTarball:
                              srcdir=srcdir)
 
     def _get_prj_builddir(self):
-        return os.path.join(self._builddir, self._curr_subdir)
+        return os.path.join(self._builddir, self._prj.subdir)
 
     def _get_unpacked_upstream_dir(self):
         """
@@ -300,7 +374,7 @@ class SourceTarball:
             env = {}
         env['BUILDDIR'] = abspath(self._get_prj_builddir())
 
-        specdir = join_path(self._srcdir, self._curr_subdir, 'mmpack')
+        specdir = join_path(self._srcdir, self._prj.subdir, 'mmpack')
         run_build_script(name, execdir, specdir, [method], env)
 
     def iter_mmpack_srcs(self) -> Iterator[ProjectSource]:
@@ -328,19 +402,44 @@ class SourceTarball:
             iprint(f'No mmpack source found in {self._srcdir}')
             return
 
-        # iterate over project subdirs and generate the source package
+        # iterate over project subdirs and generate the source package. If
+        # there are several projects, their sources are generated concurrently
+        # in a bounded pool, the results being reported in the order of
+        # subdirs. This is not done if commands run in a mmpack prefix since
+        # the consumer of the results may switch the prefix in use.
         with new_mmpack_prefix_context(self._builddir + '/tmp-prefix'):
-            for subdir in subdirs:
-                yield self._gen_project_sources(subdir)
+            if len(subdirs) <= 1 or self._jobs <= 1 or build_in_prefix():
+                for subdir in subdirs:
+                    yield self._gen_project_sources(subdir)
+                return
+
+            # Sources of a project occupy disk space until they are consumed:
+            # do not run ahead of the consumer by more than the number of jobs
+            executor = ThreadPoolExecutor(min(self._jobs, len(subdirs)))
+            pending = deque()
+            subdirs_it = iter(subdirs)
+            try:
+                for subdir in islice(subdirs_it, self._jobs):
+                    pending.append(executor.submit(self._gen_project_sources,
+                                                   subdir))
+                while pending:
+                    prj_src = pending.popleft().result()
+                    for subdir in islice(subdirs_it, 1):
+                        pending.append(
+                            executor.submit(self._gen_project_sources, subdir))
+                    yield prj_src
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
 
     def _store_src_orig_tracing(self, srcdir: str):
         """
         Write src_orig_tracing file from trace information
         """
-        upstream_info = self.trace.get('upstream', {'method': 'in-src-pkg'})
-        data = {'packaging': self.trace['pkg'], 'upstream': upstream_info}
+        trace = self._prj.trace
+        upstream_info = trace.get('upstream', {'method': 'in-src-pkg'})
+        data = {'packaging': trace['pkg'], 'upstream': upstream_info}
 
-        patch_list = self.trace.get('patches')
+        patch_list = trace.get('patches')
         if patch_list:
             data['patches'] = patch_list
 
@@ -404,7 +503,7 @@ class SourceTarball:
         """
         path = self._get_path_or_url_file()
 
-        with taropen(path, 'r:*') as tar:
+        with open_tarball(path) as tar:
             if ('mmpack/specs' in tar.getnames()
                     or 'mmpack.projects' in tar.getnames()):
                 members = None
@@ -478,7 +577,7 @@ class SourceTarball:
                    refspec=specs.get('branch'))
 
         gitref = _git_subcmd(['rev-parse', 'HEAD'], repodir=srcdir)
-        self.trace['upstream'].update({'url': url, 'ref': gitref})
+        self._prj.trace['upstream'].update({'url': url, 'ref': gitref})
 
     def _fetch_upstream_from_tar(self, specs: SourceStrapSpecs):
         """
@@ -498,7 +597,7 @@ class SourceTarball:
         if expected_sha256 and expected_sha256 != file_hash:
             raise Assert("Downloaded file does not match expected sha256")
 
-        self.trace['upstream'].update({'url': url, 'sha256': file_hash})
+        self._prj.trace['upstream'].update({'url': url, 'sha256': file_hash})
 
         # Only copy to upstreamdir if noextract requested
         if noextract:
@@ -511,7 +610,7 @@ class SourceTarball:
             with ZipFile(downloaded_file) as zfile:
                 zfile.extractall(path=upstreamdir)
         else:
-            with taropen(downloaded_file, 'r:*') as tar:
+            with open_tarball(downloaded_file) as tar:
                 tar.extractall(path=upstreamdir)
 
     def _fetch_upstream(self, specs: SourceStrapSpecs, srcdir: str):
@@ -530,7 +629,7 @@ class SourceTarball:
         upstream_srcdir = self._get_unpacked_upstream_dir()
 
         # Select proper _fetch_upstream_* function according to method entry
-        self.trace['upstream'] = {'method': method}
+        self._prj.trace['upstream'] = {'method': method}
         method_mapping[method](specs)
 
         # Determine in which subfolder of extracted upstream dir the source are
@@ -560,7 +659,7 @@ class SourceTarball:
             with open(os.path.join(srcdir, patch), 'rb') as patchfile:
                 run_cmd(['patch', '-d', srcdir, '-p1'], stdin=patchfile)
 
-        self.trace['patches'] = patches
+        self._prj.trace['patches'] = patches
 
     @staticmethod
     def _guess_build_depends(specs: SourceStrapSpecs, srcdir: str):
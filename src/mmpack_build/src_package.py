@@ -3,20 +3,24 @@
 Class to handle source packages, build them and generates binary packages.
 """
 
+import json
 import os
 import re
 import shutil
 import sys
-import tarfile
 
 from copy import copy
+from functools import partial
 from os import path
 from pathlib import Path
+from selectors import DefaultSelector, EVENT_READ
 from subprocess import Popen
 from threading import Thread
 from tempfile import mkdtemp
+from typing import BinaryIO
 
 from .workspace import Workspace
+from .archive import open_tarball
 from .binary_package import BinaryPackage
 from .common import *
 from .file_utils import *
@@ -40,22 +44,178 @@ _LICDIR = os.environ.get('MMPACK_BUILD_LICENSES_DIR',
                          str(Path(__file__).parent.parent / 'common-licenses'))
 
 
-class _FileConsumer(Thread):
+# Size of the blocks read from the output of build commands
+_OUTPUT_BLOCK_SIZE = 1 << 16
+
+
+class _OutputLogger:
     """
-    Read in a thread from file input and duplicate onto the file output and
-    logger.
+    Copy the output of a command to the log and, in debug mode, to the file
+    output. The data is forwarded in blocks of complete lines, so that the
+    lines of the different outputs are not mixed in the log.
+    """
+
+    def __init__(self, file_out):
+        self.file_out = getattr(file_out, 'buffer', None)
+        self.pending = b''
+
+    def write(self, data: bytes):
+        """forward data up to its last complete line"""
+        end = data.rfind(b'\n') + 1
+        if not end:
+            self.pending += data
+            return
+
+        block = self.pending + data[:end]
+        self.pending = data[end:]
+        self._forward(block)
+
+    def _forward(self, data: bytes):
+        log_raw(data)
+        if CONFIG['debug'] and self.file_out:
+            self.file_out.write(data)
+            self.file_out.flush()
+
+    def close(self):
+        """forward remaining incomplete line if any"""
+        if self.pending:
+            self._forward(self.pending + b'\n')
+            self.pending = b''
+
+
+def _copy_pipe(pipe: BinaryIO, output: _OutputLogger):
+    for data in iter(partial(pipe.read1, _OUTPUT_BLOCK_SIZE), b''):
+        output.write(data)
+
+
+def _pump_build_output(proc: Popen):
     """
+    Transfer the standard output and error of the process to the log (and to
+    the standard output and error in debug mode) until both are closed.
+    """
+    outputs = {proc.stdout: _OutputLogger(sys.stdout),
+               proc.stderr: _OutputLogger(sys.stderr)}
+
+    if os.name == 'nt':
+        # Pipes cannot be polled on Windows: read each one in a thread
+        threads = [Thread(target=_copy_pipe, args=item)
+                   for item in outputs.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        with DefaultSelector() as selector:
+            for pipe in outputs:
+                selector.register(pipe, EVENT_READ)
+
+            while selector.get_map():
+                for key, _ in selector.select():
+                    data = os.read(key.fd, _OUTPUT_BLOCK_SIZE)
+                    if data:
+                        outputs[key.fileobj].write(data)
+                    else:
+                        selector.unregister(key.fileobj)
+
+    for output in outputs.values():
+        output.close()
+
+
+# Name of the file listing the sources (and their hash) of the last
+# incremental build, relative to package build dir
+_INCREMENTAL_MANIFEST = 'incremental-sources.json'
+
+
+def _rmpath(filepath: str):
+    """
+    Remove file or directory tree, ignore if filepath does not exist
+    """
+    if os.path.isdir(filepath) and not os.path.islink(filepath):
+        rmtree_force(filepath)
+    else:
+        rmfile(filepath)
+
+
+def _sync_srcdir(srcdir: str, dstdir: str, manifest: str):
+    """
+    Move the sources of srcdir into dstdir, which contains the sources listed
+    in manifest along with build artifacts. The files whose content has not
+    changed since the last sync are kept untouched (along with their
+    timestamp), hence are not considered modified by the build systems.
+    Sources removed since the last sync are removed, as well as their
+    directories if no build artifacts are left in them. The other files
+    (build artifacts) are kept. The manifest is updated and srcdir is
+    removed.
+    """
+    try:
+        with open(manifest, encoding='utf-8') as stream:
+            prev_hashes = json.load(stream)
+    except FileNotFoundError:
+        prev_hashes = {}
+
+    subdirs = []
+    files = []
+    for relpath in list_files(srcdir):
+        srcpath = os.path.join(srcdir, relpath)
+        if os.path.isdir(srcpath) and not os.path.islink(srcpath):
+            subdirs.append(relpath)
+        else:
+            files.append(relpath)
+
+    # Directories are recorded in manifest with None as hash
+    hashes = sha256sums([os.path.join(srcdir, f) for f in files],
+                        follow_symlink=False)
+    hashes = {f: hashes[os.path.join(srcdir, f)] for f in files}
+    hashes.update(dict.fromkeys(subdirs))
+
+    # Remove the content of directories before the directories themselves
+    for relpath in sorted(prev_hashes.keys() - hashes.keys(), reverse=True):
+        dst = os.path.join(dstdir, relpath)
+        if prev_hashes[relpath] is not None:
+            rmfile(dst)
+        elif os.path.isdir(dst) and not os.listdir(dst):
+            os.rmdir(dst)
 
-    def __init__(self, file_in, file_out):
-        super().__init__()
-        self.file_in = file_in
-        self.file_out = file_out
+    for relpath in subdirs:
+        dst = os.path.join(dstdir, relpath)
+        if os.path.islink(dst) or os.path.isfile(dst):
+            rmfile(dst)
+        os.makedirs(dst, exist_ok=True)
 
-    def run(self):
-        for line in self.file_in:
-            if CONFIG['debug']:
-                self.file_out.write(line)
-            log_info(line.strip('\n\r'))
+    num_updated = 0
+    for relpath in files:
+        dst = os.path.join(dstdir, relpath)
+        if (prev_hashes.get(relpath) == hashes[relpath]
+                and os.path.lexists(dst)):
+            continue
+
+        _rmpath(dst)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        shutil.move(os.path.join(srcdir, relpath), dst)
+        num_updated += 1
+
+    dprint(f'{num_updated} source files updated in {dstdir}')
+
+    with open(manifest, 'w', encoding='utf-8') as stream:
+        json.dump(hashes, stream)
+
+    rmtree_force(srcdir)
+
+
+def _clean_incremental_builddir(builddir: str, srcname: str):
+    """
+    Remove the content of package build dir except the sources and build
+    tree of the previous incremental build
+    """
+    keep = (srcname, _INCREMENTAL_MANIFEST)
+    for entry in os.scandir(builddir):
+        if entry.name in keep:
+            continue
+
+        if entry.is_dir(follow_symlinks=False):
+            rmtree_force(entry.path)
+        else:
+            rmfile(entry.path)
 
 
 def _get_install_prefix() -> str:
@@ -67,7 +227,7 @@ def _get_install_prefix() -> str:
 
 def _extract_mmpack_source(srctar_path: str) -> str:
     srcdir = Workspace().tmpdir()
-    with tarfile.open(srctar_path, 'r:*') as tarstream:
+    with open_tarball(srctar_path) as tarstream:
         tarstream.extractall(path=srcdir)
     return srcdir
 
@@ -78,10 +238,12 @@ class SrcPackage:
     Source package class.
     """
 
-    def __init__(self, srctar: str, buildtag: str, srcdir: str = None):
+    def __init__(self, srctar: str, buildtag: str, srcdir: str = None,
+                 incremental: bool = False):
         # pylint: disable=too-many-arguments
         self.name = ''
         self.tag = buildtag
+        self.incremental = incremental
         self.version = Version(None)
         self.srcversion = self.version
         self.url = ''
@@ -101,6 +263,7 @@ class SrcPackage:
         # dict of (name, BinaryPackage) generated from the source package
         self._packages = {}
         self.install_files_set = set()
+        self.install_files_sha256 = {}
         self._metadata_files_list = []
 
         self._specs = {}
@@ -130,12 +293,22 @@ class SrcPackage:
         wrk = Workspace()
 
         # Init workspace folders
-        wrk.clean(self.name, self.tag)
         builddir = self.pkgbuild_path()
         unpackdir = os.path.join(builddir, self.name)
-
-        iprint(f'moving unpacked sources from {tmp_srcdir} to {unpackdir}')
-        shutil.move(tmp_srcdir, unpackdir)
+        manifest = os.path.join(builddir, _INCREMENTAL_MANIFEST)
+        if self.incremental and os.path.exists(manifest):
+            iprint(f'updating sources in {unpackdir} from {tmp_srcdir}')
+            _clean_incremental_builddir(builddir, self.name)
+            _sync_srcdir(tmp_srcdir, unpackdir, manifest)
+        else:
+            wrk.clean(self.name, self.tag)
+            builddir = self.pkgbuild_path()
+            if self.incremental:
+                _sync_srcdir(tmp_srcdir, unpackdir, manifest)
+            else:
+                iprint(f'moving unpacked sources from {tmp_srcdir} to '
+                       f'{unpackdir}')
+                shutil.move(tmp_srcdir, unpackdir)
 
         # Copy package tarball in package builddir
         new_srctar = os.path.join(builddir, os.path.basename(srctar))
@@ -173,7 +346,9 @@ class SrcPackage:
         prefix = _get_install_prefix()
         name = self.name
         version = self.srcversion
-        hash_suffix = self.src_hash[:4]
+        # The compilation flags depend on the installed source dir. In
+        # incremental mode, they must not change with the sources.
+        hash_suffix = 'incr' if self.incremental else self.src_hash[:4]
         return f'{prefix}/src/{name}-{version}-{hash_suffix}'
 
     def _guess_build_system(self):
@@ -216,18 +391,15 @@ class SrcPackage:
                 binpkg.description += '\n' + description
 
     def _remove_ignored_files(self):
-        for regex in self._specs.get('ignore', []):
-            extract_matching_set(regex, self.install_files_set)
+        patterns = list(self._specs.get('ignore', []))
         # remove files from default ignored patterns
-        extract_matching_set(r'.*\.la$', self.install_files_set)
-        extract_matching_set(r'.*\.def$', self.install_files_set)
-        extract_matching_set(r'.*/__pycache__/.*', self.install_files_set)
-        extract_matching_set(r'.*\.pyc$', self.install_files_set)
+        patterns += [r'.*\.la$', r'.*\.def$', r'.*/__pycache__/.*',
+                     r'.*\.pyc$']
 
         if self.ghost:
-            extract_matching_set(r'.*/share/doc(-base)?/.*',
-                                 self.install_files_set)
-            extract_matching_set(r'.*/lib/debug/.*', self.install_files_set)
+            patterns += [r'.*/share/doc(-base)?/.*', r'.*/lib/debug/.*']
+
+        RegexSet(patterns).extract_matching(self.install_files_set)
 
     def _parse_specfile_general(self, srcdir: str) -> None:
         """
@@ -321,12 +493,17 @@ class SrcPackage:
         build_env['SRCNAME'] = self.name
         build_env['SRCVERSION'] = str(self.srcversion)
         build_env['SRCDIR'] = self.unpack_path()
-        build_env['BUILDDIR'] = mkdtemp(dir=self.unpack_path(),
-                                        prefix='build-')
+        if self.incremental:
+            build_env['BUILDDIR'] = self.unpack_path() + '/build-incremental'
+            os.makedirs(build_env['BUILDDIR'], exist_ok=True)
+        else:
+            build_env['BUILDDIR'] = mkdtemp(dir=self.unpack_path(),
+                                            prefix='build-')
         build_env['DESTDIR'] = self._local_install_path()
         build_env['PREFIX'] = _get_install_prefix()
         build_env['INSTALLED_SRCDIR'] = self._installed_srcdir()
         build_env['SKIP_TESTS'] = str(skip_tests)
+        build_env['INCREMENTAL'] = str(self.incremental)
         if self.build_options:
             build_env['OPTS'] = self.build_options
 
@@ -376,13 +553,8 @@ class SrcPackage:
 
         # Execute command and transfer output to log
         with Popen(build_cmd, env=self._build_env(skip_tests),
-                   stdout=PIPE, stderr=PIPE, universal_newlines=True) as proc:
-            out = _FileConsumer(file_in=proc.stdout, file_out=sys.stdout)
-            err = _FileConsumer(file_in=proc.stderr, file_out=sys.stderr)
-            out.start()
-            err.start()
-            out.join()
-            err.join()
+                   stdout=PIPE, stderr=PIPE) as proc:
+            _pump_build_output(proc)
 
             # Wait the command is actually finished (or failed) and inspect
             # return code
@@ -399,7 +571,7 @@ class SrcPackage:
         """
         local installation of the package from the source package
 
-        fills private var: _install_files_set before returning
+        fills install_files_set and install_files_sha256 before returning
         """
         if self.ghost:
             self._fetch_unpack_syspkg_locally()
@@ -417,6 +589,12 @@ class SrcPackage:
             for hook in MMPACK_BUILD_HOOKS:
                 hook.post_local_install()
         self.install_files_set = set(list_files('.', exclude_dirs=True))
+
+        # Installed files are not modified after this point: hash them once
+        # for all. Files of ghost packages are not packaged, hence not hashed.
+        if not self.ghost:
+            self.install_files_sha256 = sha256sums(self.install_files_set,
+                                                   follow_symlink=False)
         popdir()
 
     def _ventilate_custom_packages(self, data: DispatchData):
@@ -427,10 +605,15 @@ class SrcPackage:
         dist = get_host_dist()
 
         # create skeleton for explicit packages
+        pkg_patterns = {}
         for pkgname, pkgspecs in self._specs.get('custom-pkgs', {}).items():
             pkg = data.assign_to_pkg(pkgname)
-            pkg.init_from_specs(pkgspecs, dist, data.unassigned_files)
+            pkg.init_from_specs(pkgspecs, dist)
             self._format_description(pkg)
+            pkg_patterns[pkgname] = pkgspecs.get('files', [])
+
+        # Populate files of all explicit packages at once
+        data.assign_matching(pkg_patterns)
 
     def _get_fallback_pkgname(self, pkg_names: Set[str]) -> str:
         """
@@ -487,6 +670,7 @@ class SrcPackage:
             licenses_path.add(os.path.join(binpkg.licenses_dir(),
                                            os.path.basename(tmp)))
         binpkg.install_files.update(licenses_path)
+        binpkg.forget_files_sha256(licenses_path)
 
         if not self.copyright:
             return
@@ -502,6 +686,7 @@ class SrcPackage:
 
         # add a copy of the copyright to each package
         binpkg.install_files.add(copyright_file)
+        binpkg.forget_files_sha256([copyright_file])
 
     def _create_binpkgs_from_dispatch(self, data: DispatchData):
         host_arch = get_host_arch_dist()
@@ -515,6 +700,10 @@ class SrcPackage:
                                    src_hash=self.src_hash,
                                    ghost=self.ghost)
             binpkg.install_files = pkginfo.files
+            binpkg.install_files_sha256 = {
+                f: self.install_files_sha256[f] for f in pkginfo.files
+                if f in self.install_files_sha256
+            }
 
             # Init dependency and system dependency that were already specified
             # from specs of custom packages
@@ -563,24 +752,32 @@ class SrcPackage:
         # specified in specs and continuing with the result of dispatch hooks
         data = DispatchData(self.install_files_set)
         self._ventilate_custom_packages(data)
-        for hook in MMPACK_BUILD_HOOKS:
-            hook.dispatch(data)
-
-        for filename in data.unassigned_files.copy():
-            if is_binary(filename) or is_exec_manpage(filename):
-                pkgname = bin_pkg_name
-            elif is_documentation(filename) or is_doc_manpage(filename):
-                pkgname = doc_pkg_name
-            elif is_devel(filename):
-                pkgname = devel_pkg_name
-            elif is_debugsym(filename):
-                pkgname = debug_pkg_name
-            else:
-                # skip this. It will be put in a default fallback
-                # package at the end of the ventilation process
-                continue
 
-            pkg = data.assign_to_pkg(pkgname, {filename})
+        # Files are not modified during the dispatch: the type of each file
+        # can be determined once for all hooks and default rules.
+        with filetype_cache():
+            for hook in MMPACK_BUILD_HOOKS:
+                hook.dispatch(data)
+
+            default_files = {}
+            for filename in data.unassigned_files:
+                if is_binary(filename) or is_exec_manpage(filename):
+                    pkgname = bin_pkg_name
+                elif is_documentation(filename) or is_doc_manpage(filename):
+                    pkgname = doc_pkg_name
+                elif is_devel(filename):
+                    pkgname = devel_pkg_name
+                elif is_debugsym(filename):
+                    pkgname = debug_pkg_name
+                else:
+                    # skip this. It will be put in a default fallback
+                    # package at the end of the ventilation process
+                    continue
+
+                default_files.setdefault(pkgname, set()).add(filename)
+
+        for pkgname, files in default_files.items():
+            pkg = data.assign_to_pkg(pkgname, files)
             if not pkg.description:
                 self._format_description(pkg)
 
@@ -602,8 +799,8 @@ class SrcPackage:
         pkgs = {
             pkgname: {
                 'file': path.basename(binpkg.pkg_path),
-                'size': path.getsize(binpkg.pkg_path),
-                'sha256': sha256sum(binpkg.pkg_path)
+                'size': binpkg.pkg_size,
+                'sha256': binpkg.pkg_sha256
             }
             for pkgname, binpkg in self._packages.items()
         }
@@ -632,10 +829,14 @@ class SrcPackage:
         outdir = Workspace().outdir()
 
         # Copy source package
-        shutil.copy(self.src_tarball, outdir)
+        link_or_copy(self.src_tarball, outdir)
         iprint(f'source {path.basename(self.src_tarball)} copied in {outdir}')
 
         # we need all of the provide infos before starting the dependencies
+        pkginfos = [binpkg.get_pkginfo() for binpkg in self._packages.values()]
+        for hook in MMPACK_BUILD_HOOKS:
+            hook.prepare_provides(pkginfos)
+
         for pkgname, binpkg in self._packages.items():
             binpkg.gen_provides()
 
@@ -666,8 +867,7 @@ class SrcPackage:
 
         for pkgname, binpkg in self._packages.items():
             pkgfile = binpkg.create(instdir, self.pkgbuild_path())
-            shutil.copy(pkgfile, outdir)
-            pkgpath = path.join(outdir, path.basename(pkgfile))
+            pkgpath = link_or_copy(pkgfile, outdir)
             iprint(f'generated package: {pkgname} : {pkgpath}')
 
         manifest = self._generate_manifest()
@@ -4,8 +4,10 @@ Base class abstracting system package manager
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 
+from .download import HTTP_POOL_MAXSIZE
 from .workspace import cached_download
 from .mm_version import Version
 
@@ -120,12 +122,20 @@ class SysPkgManager:
             raise FileNotFoundError(f'No system package found matching {srcs}')
 
         files_sysdep = {}
-        for pkg in pkg_list:
-            # Download and extract the download system package file and update
-            # the mapping files -> syspkg
-            pkg_file = pkg.download(builddir)
-            files = self._extract_syspkg(pkg_file, unpackdir)
-            files_sysdep.update(dict.fromkeys(files, pkg.get_sysdep()))
+        executor = ThreadPoolExecutor(max_workers=HTTP_POOL_MAXSIZE)
+        try:
+            # Start all the downloads at once. The packages are then extracted
+            # in list order as soon as their file is available, hence the
+            # extraction of a package overlaps with the download of the next
+            # ones while the mapping files -> syspkg is still updated in a
+            # deterministic order.
+            downloads = [executor.submit(pkg.download, builddir)
+                         for pkg in pkg_list]
+            for pkg, download in zip(pkg_list, downloads):
+                files = self._extract_syspkg(download.result(), unpackdir)
+                files_sysdep.update(dict.fromkeys(files, pkg.get_sysdep()))
+        finally:
+            executor.shutdown(cancel_futures=True)
 
         version = self._get_mmpack_version(pkg_list[0].version)
         return (version, files_sysdep)
@@ -13,6 +13,7 @@ from importlib import import_module
 from typing import List, TextIO, Iterable, Iterator, NamedTuple, Optional
 
 from .common import *
+from .download import get_http_req
 from .errors import MMPackBuildError, ShellException
 from .mm_version import Version
 from .syspkg_manager_base import SysPkgManager, SysPkg
@@ -3,13 +3,12 @@
 helper module containing pacman wrappers and file parsing functions
 """
 
+import json
 import os
 import re
 import tarfile
 
-from contextlib import contextmanager
-from io import BytesIO, TextIOWrapper
-from typing import Set, List, TextIO
+from typing import Dict, Iterable, Set, List
 
 from .common import *
 from .errors import ShellException
@@ -77,7 +76,7 @@ class PacmanPkg(SysPkg):
     """
     representation of a package in a distribution repository using pacman
     """
-    desc_field_re = re.compile(r'%([A-Z]+)%')
+    desc_field_re = re.compile(r'%([A-Z0-9]+)%')
     desc_field_to_attr = {
         'NAME': 'name',
         'VERSION': 'version',
@@ -86,18 +85,16 @@ class PacmanPkg(SysPkg):
         'SHA256SUM': 'sha256',
     }
 
-    def __init__(self, fileobj: TextIO):
+    def __init__(self, lines: Iterable[str] = ()):
         """
         Parse package description
 
         Args:
-            fileobj: stream reading downloaded repository index
-
-        Return: 1 if a package has been parsed, 0 if end of file is reached
+            lines: lines of the desc file of the package in repository index
         """
         super().__init__()
         key = None
-        for line in fileobj:
+        for line in lines:
             value = line.strip()
             match = self.desc_field_re.fullmatch(value)
             if match:
@@ -108,6 +105,23 @@ class PacmanPkg(SysPkg):
             elif key and value:
                 setattr(self, self.desc_field_to_attr[key], value)
 
+    def fields(self) -> Dict[str, str]:
+        """
+        Get the values of package attributes set from the desc file
+        """
+        return {attr: getattr(self, attr)
+                for attr in self.desc_field_to_attr.values()}
+
+    @classmethod
+    def from_fields(cls, fields: Dict[str, str]) -> 'PacmanPkg':
+        """
+        Create package from the attribute values returned by fields()
+        """
+        pkg = cls()
+        for attr, value in fields.items():
+            setattr(pkg, attr, value)
+        return pkg
+
 
 def _get_msys2_repo_comp(component, arch):
     if component != 'mingw':
@@ -128,19 +142,53 @@ def _get_repo_cpu(arch):
     return val
 
 
-@contextmanager
-def _open_db_tarball(filename: str):
-    # Read whole uncompressed tar in memory because tar decompression will
-    # require later random access
-    with open_compressed_file(filename, 'rb') as zstdfile:
-        buff_io = BytesIO(zstdfile.read())
+def _parse_db_tarball(filename: str) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Parse the compressed tarball of a pacman repository database
+
+    The tarball is read in stream mode, hence the desc files are parsed as
+    they are decompressed without loading the whole database in memory.
+
+    Args:
+        filename: path to the downloaded database
+
+    Return: mapping of source name (BASE) to the list of the fields of the
+    packages built from it.
+    """
+    index = {}
+    with open_compressed_file(filename, 'rb') as stream, \
+            tarfile.open(fileobj=stream, mode='r|') as tar:
+        for fileinfo in tar:
+            if os.path.basename(fileinfo.name) != 'desc':
+                continue
+
+            data = tar.extractfile(fileinfo).read()
+            pkg = PacmanPkg(data.decode('utf-8').splitlines())
+            index.setdefault(pkg.source, []).append(pkg.fields())
+
+    return index
+
+
+def _load_db_index(filename: str) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Get the index of the packages in pacman repository database, either from
+    cache if the same database has already been parsed or by parsing it.
+    """
+    wrk = Workspace()
+
+    # The name of the index is based on the sha256 of the database, hence an
+    # index found in cache is necessarily up to date
+    index_file = f'{filename}.{sha256sum(filename)}.json'
+    if wrk.cache_get(index_file):
+        with open(index_file, 'rt', encoding='utf-8') as stream:
+            return json.load(stream)
+
+    index = _parse_db_tarball(filename)
+    with open(index_file, 'wt', encoding='utf-8') as stream:
+        json.dump(index, stream)
+    wrk.cache_file(index_file)
 
-    try:
-        tar = tarfile.open(fileobj=buff_io, mode='r:')
-        yield tar
-        tar.close()
-    finally:
-        buff_io.close()
+    return index
 
 
 def _parse_pkgindex_comp(repo_url, component: str, builddir: str,
@@ -157,15 +205,11 @@ def _parse_pkgindex_comp(repo_url, component: str, builddir: str,
     # download compressed index
     cached_download(pkgindex_url, pkgindex)
 
-    # Parse actual index
-    with _open_db_tarball(pkgindex) as tar:
-        for fileinfo in tar.getmembers():
-            if os.path.basename(fileinfo.name) == 'desc':
-                pkg = PacmanPkg(TextIOWrapper(tar.extractfile(fileinfo),
-                                              encoding='utf-8'))
-                if pkg.source == source:
-                    pkg.url = pkg_baseurl + pkg.filename
-                    pkg_list.append(pkg)
+    # Get packages built from source in parsed index
+    for fields in _load_db_index(pkgindex).get(source, []):
+        pkg = PacmanPkg.from_fields(fields)
+        pkg.url = pkg_baseurl + pkg.filename
+        pkg_list.append(pkg)
 
     return pkg_list
 
@@ -4,17 +4,43 @@ os helpers to manipulate the paths and environments
 """
 
 import os
-import shutil
 from datetime import datetime, timedelta
+from hashlib import sha256
 from tempfile import mkdtemp
-from time import time_ns
+from typing import Optional
 
-from .common import shell, dprint, download, sha256sum, iprint, rmfile
+from .common import (shell, dprint, sha256sum, iprint, rmfile, link_or_copy,
+                     rmtree_force, tmpfile_name)
 from .decorators import singleton
-from .errors import ShellException
+from .download import download
+from .errors import MMPackBuildError, ShellException
+from .file_lock import file_lock
 from .xdg import XDG_CACHE_HOME, XDG_DATA_HOME
 
 
+# Default maximum size of the cached files
+CACHE_MAXSIZE_DEFAULT = 10 << 30
+
+_SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def _parse_size(value: str) -> int:
+    """
+    Convert size string (number of bytes, optionally suffixed by K, M, G or
+    T) into number of bytes
+    """
+    value = value.strip().upper()
+    unit = value[-1:] if value[-1:] in _SIZE_UNITS else ''
+    try:
+        return int(float(value[:len(value) - len(unit)]) * _SIZE_UNITS[unit])
+    except ValueError as error:
+        raise MMPackBuildError(f'invalid size: {value}') from error
+
+
+def _url_key(url: str) -> str:
+    return sha256(url.encode('utf-8')).hexdigest()
+
+
 def find_project_root_folder(find_multiproj: bool = False) -> str:
     """
     Look for folder named 'mmpack' in the current directory or any parent
@@ -58,6 +84,9 @@ class Workspace:
                                         XDG_DATA_HOME + '/mmpack/packages')
         self._cache = os.environ.get('MMPACK_BUILD_CACHEDIR',
                                      XDG_CACHE_HOME + '/mmpack/cache')
+        self._cache_maxsize = _parse_size(
+            os.environ.get('MMPACK_BUILD_CACHE_MAXSIZE',
+                           str(CACHE_MAXSIZE_DEFAULT)))
         self._cygpath_root = None
         self._mmpack_bin = None
         self.prefix = ''
@@ -131,6 +160,13 @@ class Workspace:
         os.makedirs(self._packages, exist_ok=True)
         return self._packages
 
+    def cachedir(self):
+        """
+        get cache directory. Create it if needed.
+        """
+        os.makedirs(self._cache, exist_ok=True)
+        return self._cache
+
     def builddir(self, srcpkg: str, tag: str):
         """
         get package build directory. Create it if needed.
@@ -155,53 +191,245 @@ class Workspace:
         self.clean()
         shell(f'rm -vrf {self._packages}/* {self._cache}/*')
 
-    def cache_get(self, path: str, expected_sha256: str = None) -> bool:
+    def _cache_lock(self, name: str = 'cache', shared: bool = False,
+                    blocking: bool = True):
+        lockdir = os.path.join(self._cache, 'locks')
+        os.makedirs(lockdir, exist_ok=True)
+        return file_lock(os.path.join(lockdir, name + '.lock'),
+                         shared, blocking)
+
+    def download_lock(self, url: str):
+        """
+        Get a context manager holding a lock specific to url in cache. This
+        serializes the concurrent downloads of the same resource.
+        """
+        return self._cache_lock(_url_key(url))
+
+    def download_path(self, url: str) -> str:
+        """
+        Get the path in cache where url must be downloaded. The partial file
+        of an interrupted download is kept there (with '.part' appended) for
+        the next attempt to resume it. The download must be done while
+        holding download_lock(url).
+        """
+        downloads_dir = os.path.join(self._cache, 'downloads')
+        os.makedirs(downloads_dir, exist_ok=True)
+        return os.path.join(downloads_dir, _url_key(url))
+
+    def _cache_object(self, digest: str) -> str:
+        return os.path.join(self._cache, 'objects', digest)
+
+    def _cache_name(self, name: str) -> str:
+        return os.path.join(self._cache, 'names', name)
+
+    def cache_get(self, path: str, expected_sha256: str = None,
+                  name: Optional[str] = None) -> Optional[str]:
         """
-        Get file from cache if a copy is present
+        Get file from cache if a copy is present. The file is reflinked from
+        the cache when possible, copied otherwise. It is never hardlinked:
+        modifying it must not alter the cache.
 
         Args:
-            path: path of the file to copy (lookup done on basename)
+            path: path of the file to copy
             expected_sha256: if not None, expected sha256 of the file.
+            name: name of the file in cache. If None, basename of path. It is
+                ignored if expected_sha256 is set.
 
-        Return: True if the a cached version has been copied, False otherwise
+        Return: the sha256 of the file if a cached version has been copied,
+            None otherwise
+        """
+        # Cache objects are not evicted while shared lock is held
+        with self._cache_lock(shared=True):
+            digest = expected_sha256
+            if not digest:
+                try:
+                    name = name if name else os.path.basename(path)
+                    with open(self._cache_name(name),
+                              encoding='utf-8') as stream:
+                        digest = stream.read().strip()
+                except FileNotFoundError:
+                    return None
+
+            cache_obj = self._cache_object(digest)
+            try:
+                link_or_copy(cache_obj, path, hardlink=False)
+                # Record the use of the object for the cache eviction
+                os.utime(cache_obj)
+                return digest
+            except FileNotFoundError:
+                pass
+
+        return None
+
+    def cache_file(self, path: str, name: Optional[str] = None):
         """
-        if expected_sha256:
-            cache_file = os.path.join(self._cache, expected_sha256)
-        else:
-            cache_file = os.path.join(self._cache, os.path.basename(path))
+        Store file into cache. The file content is stored once, indexed by
+        its sha256, and can be retrieved by its name or by the sha256. Like
+        in cache_get(), the cached object is not hardlinked to path.
 
-        try:
-            shutil.copyfile(cache_file, path)
-            return True
-        except FileNotFoundError:
-            pass
+        Args:
+            path: path of the file to store
+            name: name of the file in cache. If None, basename of path.
+        """
+        digest = sha256sum(path)
+        cache_obj = self._cache_object(digest)
+        name = self._cache_name(name if name else os.path.basename(path))
+
+        # Entries are written in temporary files renamed once complete: a
+        # concurrent reader sees either the previous entry or the new one
+        with self._cache_lock(shared=True):
+            if os.path.exists(cache_obj):
+                os.utime(cache_obj)
+            else:
+                os.makedirs(os.path.dirname(cache_obj), exist_ok=True)
+                link_or_copy(path, cache_obj, hardlink=False)
+
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+            tmp = tmpfile_name(name)
+            with open(tmp, 'w', encoding='utf-8') as stream:
+                stream.write(digest)
+            os.replace(tmp, name)
+
+    def _evict_cache_objects(self):
+        """
+        Remove the least recently used cache objects until the cache size
+        fits in its maximum size. The names referring to removed objects are
+        removed as well.
+        """
+        objects = []
+        total_size = 0
+        objdir = os.path.join(self._cache, 'objects')
+        if os.path.isdir(objdir):
+            for entry in os.scandir(objdir):
+                try:
+                    st_res = entry.stat()
+                except FileNotFoundError:
+                    continue
+                objects.append((st_res.st_mtime, st_res.st_size, entry.path))
+                total_size += st_res.st_size
+
+        objects.sort()
+        for _, size, path in objects:
+            if total_size <= self._cache_maxsize:
+                break
+            rmfile(path)
+            total_size -= size
 
-        return False
+        namedir = os.path.join(self._cache, 'names')
+        if not os.path.isdir(namedir):
+            return
 
-    def cache_file(self, path: str):
+        for entry in os.scandir(namedir):
+            try:
+                with open(entry.path, encoding='utf-8') as stream:
+                    digest = stream.read().strip()
+            except FileNotFoundError:
+                continue
+            if not os.path.exists(self._cache_object(digest)):
+                rmfile(entry.path)
+
+    def _cleanup_downloads(self, outdated_time: float):
+        lockdir = os.path.join(self._cache, 'locks')
+        for entry in os.scandir(lockdir):
+            if entry.name == 'cache.lock':
+                continue
+
+            # Downloads in progress are left untouched. The partial file of
+            # an interrupted download is kept for a while to be resumed, the
+            # lock file is kept as long as the partial file.
+            key = entry.name[:-len('.lock')]
+            partfile = os.path.join(self._cache, 'downloads', key + '.part')
+            try:
+                with file_lock(entry.path, blocking=False):
+                    try:
+                        if os.stat(partfile).st_mtime >= outdated_time:
+                            continue
+                        rmfile(partfile)
+                    except FileNotFoundError:
+                        pass
+
+                    # The waiters of a removed lock file will lock the
+                    # recreated one
+                    rmfile(entry.path)
+            except (BlockingIOError, PermissionError):
+                pass
+
+    def git_mirror(self, url: str) -> str:
         """
-        Copy file into cache
+        Get the path in cache of the bare git repository mirroring the git
+        repository at url. The mirror is guarded by a lock file whose path is
+        the one of the mirror with '.lock' appended. Its modification time
+        indicates the last use of the mirror.
         """
-        os.makedirs(self._cache, exist_ok=True)
-        cache_file = os.path.join(self._cache, os.path.basename(path))
-        rmfile(cache_file)
-        shutil.copyfile(path, cache_file)
+        mirrors_dir = os.path.join(self._cache, 'git')
+        os.makedirs(mirrors_dir, exist_ok=True)
+        return os.path.join(mirrors_dir, _url_key(url) + '.git')
+
+    def _cleanup_git_mirrors(self, outdated_time: float):
+        mirrors_dir = os.path.join(self._cache, 'git')
+        if not os.path.isdir(mirrors_dir):
+            return
+
+        for entry in os.scandir(mirrors_dir):
+            if not entry.name.endswith('.git.lock'):
+                continue
+
+            try:
+                if entry.stat().st_mtime >= outdated_time:
+                    continue
+            except FileNotFoundError:
+                continue
 
-        # Hard link a version named after the sha256 value of the cached file
-        os.link(cache_file, os.path.join(self._cache, sha256sum(cache_file)))
+            with file_lock(entry.path):
+                # The mirror may have been used while waiting for the lock
+                if os.stat(entry.path).st_mtime >= outdated_time:
+                    continue
+
+                rmtree_force(entry.path[:-len('.lock')])
+
+                # Remove the lock file while holding it: waiters will lock
+                # the recreated one (a file in use cannot be removed on
+                # Windows, the lock file is kept then)
+                try:
+                    rmfile(entry.path)
+                except PermissionError:
+                    pass
 
     def cleanup_cache(self):
         """
-        remove from cache files that have not been accessed in a while
+        remove from cache the least recently used files when the cache size
+        exceeds its maximum, and the other files and git mirrors that have
+        not been used in a while
         """
         outdated_time = (datetime.now() - timedelta(days=7)).timestamp()
-        rmlist = set()
+
+        # git mirrors are removed as a whole depending on their last use
+        self._cleanup_git_mirrors(outdated_time)
+
+        # Do not wait for the cache users: eviction is retried next time
         try:
-            with os.scandir(self._cache) as dir_it:
-                rmlist = {e.path for e in dir_it
-                          if e.is_file() and e.stat().st_atime < outdated_time}
-        except FileNotFoundError:
-            return
+            with self._cache_lock(blocking=False):
+                self._evict_cache_objects()
+                self._cleanup_downloads(outdated_time)
+        except BlockingIOError:
+            pass
+
+        # Other files (not stored by cache_file()) are removed if they have
+        # not been accessed in a while
+        rmlist = set()
+        for dirpath, dirs, files in os.walk(self._cache):
+            if dirpath == self._cache:
+                dirs[:] = [d for d in dirs
+                           if d not in ('downloads', 'git', 'locks', 'names',
+                                        'objects')]
+
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.stat(path).st_atime < outdated_time:
+                        rmlist.add(path)
+                except FileNotFoundError:
+                    pass
 
         for path in rmlist:
             rmfile(path)
@@ -220,12 +448,6 @@ def is_valid_prefix(prefix: str) -> bool:
     return os.path.exists(prefix + '/var/lib/mmpack/')
 
 
-def _update_access_time(path: str):
-    mtime_ns = os.stat(path).st_mtime_ns
-    curtime_ns = time_ns()
-    os.utime(path, ns=(curtime_ns, mtime_ns))
-
-
 def cached_download(url: str, path: str, expected_sha256: str = None):
     """
     Download file from url or copy from cache available to the specified path.
@@ -239,10 +461,14 @@ def cached_download(url: str, path: str, expected_sha256: str = None):
     """
     wrk = Workspace()
 
-    if wrk.cache_get(path, expected_sha256):
-        iprint(f'Skip download {url}. Using cached file')
-        _update_access_time(path)
-        return
+    # A concurrent download of the same url will find the file in cache
+    with wrk.download_lock(url):
+        if wrk.cache_get(path, expected_sha256):
+            iprint(f'Skip download {url}. Using cached file')
+            return
 
-    download(url, path)
-    wrk.cache_file(path)
+        dlpath = wrk.download_path(url)
+        download(url, dlpath, expected_sha256)
+        wrk.cache_file(dlpath, os.path.basename(path))
+        link_or_copy(dlpath, path)
+        rmfile(dlpath)
@@ -2,6 +2,7 @@
 """
 tool to analyze set of python modules
 """
+import json
 import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 from os.path import abspath
@@ -9,8 +10,8 @@ from os.path import abspath
 from astroid import MANAGER as astroid_manager
 
 from .depends import run_depends, __doc__ as depends_doc
-from .dispatch import run_dispatch, __doc__ as dispatch_doc
 from .provides import run_provides, __doc__ as provides_doc
+from .serve import run_server, __doc__ as serve_doc
 
 
 def parse_options():
@@ -23,6 +24,8 @@ def parse_options():
                         action='append', default=[],
                         help='path of python site-packages or folder '
                         'containing python package')
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str,
+                        help='folder where analysis results can be cached')
     subparsers = parser.add_subparsers(dest='command', required=True)
 
     cmd_parser = subparsers.add_parser('depends', help=depends_doc)
@@ -31,8 +34,7 @@ def parse_options():
     cmd_parser = subparsers.add_parser('provides', help=provides_doc)
     cmd_parser.add_argument('infile', type=str, nargs='?')
 
-    cmd_parser = subparsers.add_parser('dispatch', help=dispatch_doc)
-    cmd_parser.add_argument('infile', type=str, nargs='?')
+    subparsers.add_parser('serve', help=serve_doc)
 
     return parser.parse_args()
 
@@ -50,15 +52,23 @@ def main():
 
     astroid_manager.always_load_extensions = True
 
+    if options.command == 'serve':
+        run_server(options.site_paths, options.cache_dir)
+        return
+
     with open(options.infile, encoding='utf-8') as input_stream:
         input_files = [f.strip() for f in input_stream]
 
     if options.command == 'depends':
-        run_depends(input_files, options.site_paths)
+        result = run_depends(input_files, options.site_paths,
+                             options.cache_dir)
     elif options.command == 'provides':
-        run_provides(input_files)
-    elif options.command == 'dispatch':
-        run_dispatch(input_files)
+        result = run_provides(input_files, options.cache_dir)
+    else:
+        raise ValueError(f'Unknown command: {options.command}')
+
+    # Return results as JSON dict on stdout
+    json.dump(result, fp=sys.stdout, indent='    ', separators=(',', ': '))
 
 
 if __name__ == '__main__':
@@ -10,15 +10,23 @@ It will print on standard output a JSON mapping of, for each external python
 package used, the list of qualified name of the public symbols used.
 """
 
+import ast
 import json
+import os
 import sys
-from os.path import abspath, dirname, exists, join as join_path
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr
+from hashlib import sha256
+from io import StringIO
+from os.path import abspath, basename, dirname, exists, join as join_path
+from tempfile import NamedTemporaryFile
 from traceback import print_exc
-from typing import List, Iterable, Iterator, Optional, Set, Tuple, Union
+from typing import (Dict, List, Iterable, Iterator, Optional, Set, Tuple,
+                    Union)
 
 import pkg_resources
 
-from astroid import MANAGER as astroid_manager
+from astroid import MANAGER as astroid_manager, __version__ as astroid_version
 from astroid import Uninferable, Module, Instance, ClassDef, \
     Import, ImportFrom, Call, Attribute, Name
 from astroid.exceptions import AttributeInferenceError, AstroidImportError, \
@@ -28,7 +36,7 @@ from astroid.modutils import (is_standard_module, modpath_from_file,
 from astroid.node_classes import NodeNG
 from astroid.objects import Super
 
-from .utils import is_namespace_pkg
+from .utils import get_pkg, is_namespace_pkg
 
 
 def _is_standard_module(mod: Module) -> bool:
@@ -135,6 +143,264 @@ def _infer_node_def(node: NodeNG) -> Iterator[NodeNG]:
             yield nodedef
 
 
+def _file_modname(filename: str) -> Optional[str]:
+    try:
+        modpath = modpath_from_file_with_callback(filename, None, _is_pkg)
+    except ImportError:
+        return None
+
+    if modpath[-1] == '__init__':
+        modpath.pop()
+
+    return '.'.join(modpath)
+
+
+def _imported_modnames(filename: str, modname: Optional[str]) -> Set[str]:
+    """
+    Get the names of the modules that a python file may import. This is done
+    with python ast module, hence much faster than with astroid inference.
+    """
+    try:
+        with open(filename, 'rb') as stream:
+            tree = ast.parse(stream.read(), filename)
+    except (SyntaxError, ValueError):
+        return set()
+
+    # package in which relative imports are resolved
+    package = []
+    if modname:
+        package = modname.split('.')
+        if basename(filename) != '__init__.py':
+            package.pop()
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = []
+            if node.level:
+                base = package[:len(package) - node.level + 1]
+            if node.module:
+                base += node.module.split('.')
+            if not base:
+                continue
+            from_name = '.'.join(base)
+            names.add(from_name)
+            names.update(from_name + '.' + alias.name for alias in node.names)
+
+    # Importing a submodule imports its parent packages as well
+    modnames = set()
+    for name in names:
+        parts = name.split('.')
+        modnames.update('.'.join(parts[:i+1]) for i in range(len(parts)))
+
+    return modnames
+
+
+class _LocalModules:
+    """
+    Index of the python files being inspected allowing to find the local
+    modules imported by a file.
+    """
+    def __init__(self, pkgfiles: Iterable[str]):
+        self.modnames = {f: _file_modname(f) for f in pkgfiles}
+        self.files = {m: f for f, m in self.modnames.items() if m}
+        self._imports = {}
+
+    def _resolve(self, filename: str, modname: str) -> Optional[str]:
+        localfile = self.files.get(modname)
+        if localfile or self.modnames[filename]:
+            return localfile
+
+        # A script that is not in a public package may import the modules
+        # next to it
+        path = join_path(dirname(filename), *modname.split('.'))
+        for candidate in (path + '.py', join_path(path, '__init__.py')):
+            if candidate in self.modnames:
+                return candidate
+
+        return None
+
+    def direct_imports(self, filename: str) -> Set[str]:
+        """
+        Get the local files that are imported by a python file
+        """
+        files = self._imports.get(filename)
+        if files is None:
+            imported = _imported_modnames(filename, self.modnames[filename])
+            files = {self._resolve(filename, m) for m in imported}
+            files.discard(None)
+            files.discard(filename)
+            self._imports[filename] = files
+
+        return files
+
+    def import_closure(self, files: Iterable[str]) -> Set[str]:
+        """
+        Get the set of files along with the local files that they import
+        recursively
+        """
+        closure = set(files)
+        todo = list(closure)
+        while todo:
+            new = self.direct_imports(todo.pop()).difference(closure)
+            closure.update(new)
+            todo.extend(new)
+
+        return closure
+
+    def shard(self, filename: str) -> str:
+        """
+        Get the name of the group of files to which a file belongs, ie its top
+        level package or the folder of a script
+        """
+        modname = self.modnames[filename]
+        if modname:
+            return modname.split('.')[0]
+
+        return dirname(filename)
+
+
+def _file_sha256(filename: str) -> str:
+    with open(filename, 'rb') as stream:
+        return sha256(stream.read()).hexdigest()
+
+
+def _file_identity(filename: str) -> Optional[List[int]]:
+    try:
+        st_res = os.stat(filename)
+    except OSError:
+        return None
+
+    return [st_res.st_size, st_res.st_mtime_ns]
+
+
+class _DependsCache:
+    """
+    Persistent storage of the dependencies found in each python file.
+
+    The result of a file is stored under a key computed from its content and
+    path, the content of the local modules it imports (recursively), the
+    version of astroid and python and the paths where the modules are looked
+    up. Along with the result, the size and modification time of the files of
+    the external modules it has been resolved through are stored. Hence the
+    result is reused only if none of these has changed.
+    """
+    def __init__(self, cache_dir: Optional[str], sitedirs: Iterable[str]):
+        self._dir = join_path(cache_dir, 'depends') if cache_dir else None
+        self._prefix = '\n'.join(
+            [f'astroid-{astroid_version} '
+             f'python-{sys.version_info[0]}.{sys.version_info[1]}']
+            + sorted(abspath(p) for p in sitedirs)
+            + ['sys.path:'] + sys.path
+        )
+
+    def keys(self, local_mods: _LocalModules) -> Dict[str, str]:
+        """
+        Compute the cache key of each local python file
+        """
+        shas = {f: _file_sha256(f) for f in local_mods.modnames}
+
+        keys = {}
+        for filename in shas:
+            closure = local_mods.import_closure([filename])
+
+            hashobj = sha256(self._prefix.encode('utf-8'))
+            hashobj.update(f'\n{filename}'.encode('utf-8'))
+            for path in sorted(closure):
+                hashobj.update(f'\n{path} {shas[path]}'.encode('utf-8'))
+            keys[filename] = hashobj.hexdigest()
+
+        return keys
+
+    def get(self, key: str) -> Optional[Set[str]]:
+        """
+        Get used symbols stored with key if any and if the external modules
+        they have been resolved through are unchanged
+        """
+        if not self._dir:
+            return None
+
+        path = join_path(self._dir, key + '.json')
+        try:
+            with open(path, encoding='utf-8') as stream:
+                data = json.load(stream)
+            externals = data['externals']
+            symbols = data['symbols']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        if any(_file_identity(f) != identity
+               for f, identity in externals.items()):
+            return None
+
+        os.utime(path)
+        return set(symbols)
+
+    def put(self, key: str, symbols: Set[str], resolved_files: Set[str]):
+        """
+        Store the result of a file analysis
+
+        Args:
+            key: key of the analyzed file
+            symbols: external symbols used by the file
+            resolved_files: files of the external modules that the analysis
+                has been resolved through
+        """
+        if not self._dir:
+            return
+
+        data = {'symbols': sorted(symbols),
+                'externals': {f: _file_identity(f)
+                              for f in sorted(resolved_files)}}
+
+        # Write in temporary file to never expose partially written data to
+        # concurrent builds
+        os.makedirs(self._dir, exist_ok=True)
+        with NamedTemporaryFile('w', dir=self._dir, suffix='.tmp',
+                                encoding='utf-8', delete=False) as stream:
+            json.dump(data, stream)
+        os.replace(stream.name, join_path(self._dir, key + '.json'))
+
+
+def _init_worker(sys_path: List[str], sitedirs: List[str]):
+    """
+    Process pool initializer setting the worker in the state of the parent
+    process: python path and site paths known by pkg_resources (which are
+    lost if the worker is spawned rather than forked)
+    """
+    sys.path[:] = sys_path
+    for sitedir in sitedirs:
+        add_to_pkg_resources(abspath(sitedir))
+    astroid_manager.always_load_extensions = True
+
+
+def _inspect_shard(pkgfiles: List[str], loadfiles: List[str],
+                   files: List[str]):
+    """
+    Process pool job inspecting the files of a shard
+
+    Args:
+        pkgfiles: all files of the inspected package
+        loadfiles: files of the package to load before inspection (imported
+            by the inspected files)
+        files: files to inspect
+
+    Return: the couple of list of (file, used symbols, failed imports,
+    resolved files) and the messages issued by the inspection
+    """
+    log = StringIO()
+    with redirect_stderr(log):
+        inspector = DependsInspector(pkgfiles)
+        for filename in loadfiles:
+            _load_pyfile_module(filename)
+
+        results = [(f,) + inspector.inspect_file(f) for f in files]
+
+    return (results, log.getvalue())
+
+
 class DependsInspector:
     # pylint: disable=too-few-public-methods
     """
@@ -144,6 +410,7 @@ class DependsInspector:
         self.pkgfiles = {abspath(f) for f in pkgfiles}
         self.used_symbols = set()
         self.failed_imports = set()
+        self.resolved_files = set()
 
     def _is_local_module(self, mod: Module) -> bool:
         """
@@ -171,7 +438,18 @@ class DependsInspector:
         if not isinstance(mod, Module):
             return False
 
-        return not (_is_standard_module(mod) or self._is_local_module(mod))
+        if _is_standard_module(mod) or self._is_local_module(mod):
+            return False
+
+        self._track_external_module(mod)
+        return True
+
+    def _track_external_module(self, mod: Module):
+        """
+        Record the file of an external module the inspection depends on
+        """
+        if mod.file:
+            self.resolved_files.add(abspath(mod.file))
 
     def _get_module_namefrom(self, impfrom: ImportFrom,
                              name: str) -> Tuple[str, NodeNG]:
@@ -202,6 +480,7 @@ class DependsInspector:
             # If the pointed node does not belong to package, just report the
             # public name as it is known now
             if not self._is_local_module(module):
+                self._track_external_module(module)
                 return (impfrom.modname + '.' + real_name, node)
 
             attrname, name = self._follow_name_origin(node, real_name)
@@ -359,45 +638,117 @@ class DependsInspector:
         if not is_public_submodule:
             sys.path.pop(0)
 
-    def gen_depends(self):
+    def inspect_file(self,
+                     filename: str) -> Tuple[Set[str], Set[str], Set[str]]:
+        """
+        Inspect a python file
+
+        Return: the tuple of the set of external symbols used by the file, the
+        set of modules that could not be imported and the set of files of the
+        external modules through which the symbols have been resolved.
+        """
+        self.used_symbols = set()
+        self.failed_imports = set()
+        self.resolved_files = set()
+
+        try:
+            self._gather_pyfile_depends(filename)
+        except Exception:  # pylint: disable=broad-except
+            print(f'Warning: Analysis of {filename} raises an exception:',
+                  file=sys.stderr)
+            print_exc(file=sys.stderr)
+            print(' This is possibly an bug from astroid\n'
+                  f' => Skipping {filename} processing for depends',
+                  file=sys.stderr)
+
+        return (self.used_symbols, self.failed_imports, self.resolved_files)
+
+    def _inspect_shards(self, shards: Dict[str, List[str]],
+                        local_mods: _LocalModules,
+                        sitedirs: Iterable[str]) -> Iterator[Tuple]:
+        """
+        Inspect files grouped in shards, in parallel if there are more than one
+        shard. Yield for each file the tuple of file, used symbols, failed
+        imports and resolved files.
+        """
+        pkgfiles = sorted(self.pkgfiles)
+        jobs = []
+        for files in shards.values():
+            # Load the imported local modules before inspection
+            loadfiles = sorted(local_mods.import_closure(files))
+            jobs.append((pkgfiles, loadfiles, files))
+
+        if len(jobs) == 1:
+            for filename in jobs[0][1]:
+                _load_pyfile_module(filename)
+            for filename in jobs[0][2]:
+                yield (filename,) + self.inspect_file(filename)
+            return
+
+        initargs = (list(sys.path), list(sitedirs))
+        with ProcessPoolExecutor(min(len(jobs), os.cpu_count() or 1),
+                                 initializer=_init_worker,
+                                 initargs=initargs) as executor:
+            for results, log in executor.map(_inspect_shard, *zip(*jobs)):
+                sys.stderr.write(log)
+                yield from results
+
+    def gen_depends(self, cache_dir: Optional[str] = None,
+                    sitedirs: Iterable[str] = ()):
         """
         Inspect loaded python files and generate their dependency list
+
+        Args:
+            cache_dir: if not None, folder where the result of the inspection
+                of each file is stored and reused if the file, the ones it
+                imports and the external modules it uses have not changed.
+            sitedirs: python site-packages folders
         """
-        pyfiles = sorted(self.pkgfiles)
+        local_mods = _LocalModules(self.pkgfiles)
+        cache = _DependsCache(cache_dir, sitedirs)
+        keys = cache.keys(local_mods)
+
+        used_symbols = set()
+        failed_imports = set()
+
+        # Get results from cache and group the files to inspect by shard
+        shards = {}
+        for filename in sorted(self.pkgfiles):
+            cached = cache.get(keys[filename])
+            if cached is not None:
+                used_symbols.update(cached)
+                continue
 
-        for filename in pyfiles:
-            _load_pyfile_module(filename)
+            shards.setdefault(local_mods.shard(filename), []).append(filename)
+
+        if shards:
+            results = self._inspect_shards(shards, local_mods, sitedirs)
+            for filename, syms, failed, resolved in results:
+                # A failed import may succeed once the module is installed
+                if not failed:
+                    cache.put(keys[filename], syms, resolved)
+                used_symbols.update(syms)
+                failed_imports.update(failed)
 
-        for filename in pyfiles:
-            try:
-                self._gather_pyfile_depends(filename)
-            except Exception:  # pylint: disable=broad-except
-                print(f'Warning: Analysis of {filename} raises an exception:',
-                      file=sys.stderr)
-                print_exc(file=sys.stderr)
-                print(' This is possibly an bug from astroid\n'
-                      f' => Skipping {filename} processing for depends',
-                      file=sys.stderr)
+        self.used_symbols = used_symbols
+        self.failed_imports = failed_imports
 
     def used_pkgs(self) -> Iterator[Tuple[str, Set[str]]]:
         """
         Get an iterator of the tuple holding the external module name used
         along with their set of symbols.
         """
-        reported_pkgs = set()
-        for modname in self.used_symbols:
-            # Find the first parent package that is not a namespace
-            modpath = modname.split('.')
-            pypkg = modpath.pop(0)
-            while is_namespace_pkg(pypkg):
-                pypkg += '.' + modpath.pop(0)
+        # Group symbols in one pass by the first parent package that is not a
+        # namespace. A symbol naming the package itself reports the package as
+        # used without adding a symbol.
+        pkgs_syms = {}
+        for sym in self.used_symbols:
+            pypkg = get_pkg(sym)
+            syms = pkgs_syms.setdefault(pypkg, set())
+            if sym != pypkg:
+                syms.add(sym)
 
-            if pypkg in reported_pkgs:
-                continue
-
-            syms = {s for s in self.used_symbols if s.startswith(pypkg+'.')}
-            yield (pypkg, syms)
-            reported_pkgs.add(pypkg)
+        return iter(pkgs_syms.items())
 
 
 def add_to_pkg_resources(entry):
@@ -407,15 +758,26 @@ def add_to_pkg_resources(entry):
     sys.path), it will be replaced.
     """
     working_set = pkg_resources.working_set
+    if entry in working_set.entries:
+        return
+
     working_set.entry_keys.setdefault(entry, [])
     working_set.entries.append(entry)
     for dist in pkg_resources.find_distributions(entry, True):
         working_set.add(dist, entry, replace=True)
 
 
-def run_depends(input_files: Iterable[str], sitedirs: Iterable[str]):
+def run_depends(input_files: Iterable[str], sitedirs: Iterable[str],
+                cache_dir: Optional[str] = None) -> Dict[str, List[str]]:
     """
     python_depends utility entry point
+
+    Args:
+        input_files: python files to inspect
+        sitedirs: python site-packages folders
+        cache_dir: if not None, folder where the inspection results are cached
+
+    Return: mapping of external python package name to symbols used
     """
     # If some site path folders are specified, make them known by
     # pkg_resources.
@@ -423,14 +785,12 @@ def run_depends(input_files: Iterable[str], sitedirs: Iterable[str]):
         add_to_pkg_resources(abspath(sitedir))
 
     inspector = DependsInspector(input_files)
-    inspector.gen_depends()
-
-    # Return results as JSON dict on stdout
-    json.dump({k: list(sorted(v)) for k, v in inspector.used_pkgs()},
-              fp=sys.stdout, indent='    ', separators=(',', ': '))
+    inspector.gen_depends(cache_dir, sitedirs)
 
     if inspector.failed_imports:
         print('Warning: Following modules failed to be imported. They may be '
               'optional imports:\n    '
               + '\n    '.join(sorted(inspector.failed_imports)),
               file=sys.stderr)
+
+    return {k: list(sorted(v)) for k, v in inspector.used_pkgs()}
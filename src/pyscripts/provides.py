@@ -21,30 +21,20 @@ package and use this one to run the script.
 """
 
 import json
+import os
 import sys
-from os.path import abspath, basename, dirname
+from hashlib import sha256
+from os.path import abspath, basename, dirname, join as join_path
+from tempfile import NamedTemporaryFile
 from traceback import print_exc
-from typing import Dict, Iterable, Set, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
 
 from astroid import AstroidImportError, AstroidSyntaxError, MANAGER
-from astroid import InconsistentMroError
+from astroid import InconsistentMroError, __version__ as astroid_version
 from astroid.nodes import Import, ImportFrom, AssignName, ClassDef, Module
 from astroid.modutils import modpath_from_file_with_callback
 
-from .utils import is_namespace_pkg
-
-
-def get_pkg(modname: str) -> str:
-    """Get the deepest regular package"""
-    modpath = modname.split('.')
-
-    # Find first parent package that is not a namespace
-    for depth in range(1, len(modpath)+1):
-        root_modname = '.'.join(modpath[:depth])
-        if not is_namespace_pkg(root_modname):
-            break
-
-    return root_modname
+from .utils import get_pkg
 
 
 def _is_public_sym(name: str) -> bool:
@@ -63,48 +53,202 @@ def _is_public_sym(name: str) -> bool:
     return True
 
 
-class PkgData:
+def _module_file(mod: Module) -> Optional[str]:
+    return mod.path[0] if mod.path else None
+
+
+class _ExportTable:
     """
-    Class holding the explored symbols so far and the boundaries of the mmpack
-    package being analyzed (ie, which python module is actually copackaged).
+    Persistent table of the symbols exported by python modules.
+
+    The entry of a module holds its public names, the public symbols of its
+    classes and their ancestors and the list of modules it imports. It is
+    stored under a key computed from the module name and the path and content
+    of its file. The entry is reused only if the files of the modules it
+    imports and of the ancestors of its classes have not changed either
+    (recursively).
     """
-    def __init__(self, pkgfiles: Iterable[str]):
-        self.pkgfiles = {abspath(f) for f in pkgfiles}
-        self.syms = {}
+    def __init__(self, cache_dir: Optional[str]):
+        self._dir = join_path(cache_dir, 'provides') if cache_dir else None
+        self._shas = {}
+        self._valid = {}
+
+    def _file_sha(self, path: str) -> Optional[str]:
+        sha = self._shas.get(path)
+        if sha is None:
+            try:
+                with open(path, 'rb') as stream:
+                    sha = sha256(stream.read()).hexdigest()
+            except OSError:
+                sha = ''
+            self._shas[path] = sha
 
-    def is_module_packaged(self, mod: Module):
+        return sha
+
+    def _entry_path(self, qname: str, path: str) -> Optional[str]:
+        sha = self._file_sha(path)
+        if not (self._dir and sha):
+            return None
+
+        key = f'astroid-{astroid_version}\n{qname}\n{path}\n{sha}'
+        return join_path(self._dir, sha256(key.encode('utf-8')).hexdigest())
+
+    def _load(self, qname: str, path: str) -> Optional[Dict[str, Any]]:
+        entry_path = self._entry_path(qname, path)
+        if not entry_path:
+            return None
+
+        try:
+            with open(entry_path, encoding='utf-8') as stream:
+                entry = json.load(stream)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+
+        return entry
+
+    def _is_valid(self, qname: str, path: str, entry: Dict[str, Any]) -> bool:
+        key = (qname, path)
+        if key in self._valid:
+            return self._valid[key]
+
+        # Assume valid while being checked to support import cycles
+        self._valid[key] = True
+        valid = all(self._file_sha(p) == sha
+                    for p, sha in entry['deps'].items())
+        if valid:
+            for depname, deppath in entry['imports']:
+                depentry = self._load(depname, deppath)
+                if depentry and not self._is_valid(depname, deppath,
+                                                   depentry):
+                    valid = False
+                    break
+
+        self._valid[key] = valid
+        return valid
+
+    def get(self, qname: str, path: str) -> Optional[Dict[str, Any]]:
         """
-        test whether a specified module is provided by the file of the same
-        mmpack package.
+        Get the entry of module qname defined in path if still valid
         """
-        return mod.path and mod.path[0] in self.pkgfiles
+        entry = self._load(qname, path)
+        if entry is None or not self._is_valid(qname, path, entry):
+            return None
 
-    def _add_import(self, imp: Union[Import, ImportFrom], names=None):
-        if names is None:
-            names = [n for n, _ in imp.names]
+        return entry
 
-        for modname in names:
-            try:
-                imp_mod = imp.do_import_module(modname)
-                self.add_module_public_symbols(imp_mod)
-            except AstroidImportError:
-                # If module cannot be imported, this should an external module,
-                # Let's ignore as no provided symbols will be found there
-                pass
-
-    def _add_importfrom(self, impfrom: ImportFrom):
-        try:
-            mod = impfrom.do_import_module(impfrom.modname)
-            self.add_module_public_symbols(mod)
-        except AstroidImportError:
-            # If module cannot be imported, this should an external module,
-            # hence we don't have to search for provided symbols there.
+    def put(self, qname: str, path: str, entry: Dict[str, Any]):
+        """
+        Store the entry of module qname defined in path
+        """
+        # Record the content of the files on which the entry depends
+        files = {p for _, p in entry['imports']}
+        files.update(c['file'] for c in entry['classes'].values())
+        files.discard(path)
+        files.discard(None)
+        entry['deps'] = {p: self._file_sha(p) for p in sorted(files)}
+        self._valid[(qname, path)] = True
+
+        entry_path = self._entry_path(qname, path)
+        if not entry_path:
             return
 
+        # Write in temporary file to never expose partially written data to
+        # concurrent builds
+        os.makedirs(self._dir, exist_ok=True)
+        with NamedTemporaryFile('w', dir=self._dir, suffix='.tmp',
+                                encoding='utf-8', delete=False) as stream:
+            json.dump(entry, stream)
+        os.replace(stream.name, entry_path)
+
+
+def _add_class_exports(cldef: ClassDef, classes: Dict[str, Dict[str, Any]]):
+    """
+    Add class public attributes and those of its ancestors in table of class
+    exports.
+    """
+    qname = cldef.qname()
+    if qname in classes:
+        return
+
+    syms = set()
+
+    # Add public class attributes
+    for attr in cldef.locals:
+        if (isinstance(cldef.locals[attr][-1], AssignName)
+                and _is_public_sym(attr)):
+            syms.add(attr)
+
+    # Add public class methods and instance attributes
+    syms.update({m.name
+                 for m in cldef.mymethods() if _is_public_sym(m.name)})
+    syms.update({attr
+                 for attr in cldef.instance_attrs if _is_public_sym(attr)})
+
+    ancestors = list(cldef.ancestors())
+    classes[qname] = {
+        'file': _module_file(cldef.root()),
+        'syms': sorted(syms),
+        'ancestors': [a.qname() for a in ancestors],
+    }
+
+    # Ancestors without file (builtins) can never be packaged
+    for ancestor in ancestors:
+        if _module_file(ancestor.root()):
+            _add_class_exports(ancestor, classes)
+
+
+def _import_module(imp: Union[Import, ImportFrom], modname: str,
+                   imports: List[List[str]]) -> Optional[Module]:
+    try:
+        mod = imp.do_import_module(modname)
+    except AstroidImportError:
+        # If module cannot be imported, this should an external module,
+        # Let's ignore as no provided symbols will be found there
+        return None
+
+    imports.append([mod.qname(), _module_file(mod)])
+    return mod
+
+
+def _module_exports(mod: Module) -> Dict[str, Any]:
+    """
+    Inspect module and generate its entry in export table
+    """
+    entry = {
+        'public_names': None,
+        'public_classes': [],
+        'classes': {},
+        'imports': [],
+    }
+
+    # Add all public symbols of the namespace, only if the module has its
+    # path well identified
+    if mod.qname() != mod.file:
+        entry['public_names'] = sorted(mod.public_names())
+
+        # Loop over class definition and add those with a public name
+        for cldef in mod.nodes_of_class(ClassDef):
+            if _is_public_sym(cldef.name):
+                entry['public_classes'].append(cldef.qname())
+                _add_class_exports(cldef, entry['classes'])
+
+    # Loop over import statement definition and record imported modules
+    imports = entry['imports']
+    for imp in mod.nodes_of_class(Import):
+        for modname, _ in imp.names:
+            _import_module(imp, modname, imports)
+
+    # Loop over 'from ... import ...' definition and record imported modules
+    for impfrom in mod.nodes_of_class(ImportFrom):
+        frommod = _import_module(impfrom, impfrom.modname, imports)
+        if not frommod:
+            continue
+
         # Get the actual list of imported names (expand wildcard import)
         imported_names = [n for n, _ in impfrom.names]
         if imported_names[0] == '*':
-            imported_names = mod.wildcard_import_names()
+            imported_names = frommod.wildcard_import_names()
 
         # If 'from' name is absolute, imported module name must be prefixed
         # (import is absolute if level is 0 or None)
@@ -113,79 +257,92 @@ class PkgData:
             mod_prefix = impfrom.modname + '.'
 
         # Import module for all names that are not defined in 'from' module
-        names = [mod_prefix + n for n in imported_names if n not in mod.keys()]
-        self._add_import(impfrom, names)
+        for name in imported_names:
+            if name not in frommod.keys():
+                _import_module(impfrom, mod_prefix + name, imports)
+
+    return entry
 
-    def _add_class_public_symbols(self, cldef: ClassDef):
+
+class PkgData:
+    """
+    Class holding the explored symbols so far and the boundaries of the mmpack
+    package being analyzed (ie, which python module is actually copackaged).
+    """
+    def __init__(self, pkgfiles: Iterable[str],
+                 cache_dir: Optional[str] = None):
+        self.pkgfiles = {abspath(f) for f in pkgfiles}
+        self.syms = {}
+        self._exports = _ExportTable(cache_dir)
+        self._visited = set()
+
+    def _is_file_packaged(self, path: Optional[str]) -> bool:
+        return bool(path) and path in self.pkgfiles
+
+    def is_module_packaged(self, mod: Module):
         """
-        Add class attributes symbols and ancestors if they belong to package
+        test whether a specified module is provided by the file of the same
+        mmpack package.
         """
-        qname = cldef.qname()
+        return self._is_file_packaged(_module_file(mod))
 
+    def _add_class_public_symbols(self, qname: str,
+                                  classes: Dict[str, Dict[str, Any]]):
+        """
+        Add class attributes symbols and ancestors if they belong to package
+        """
         # Skip if class has been already processed
         if qname in self.syms:
             return
 
         # Add ancestors if they belong to package
-        for ancestor in cldef.ancestors():
-            if self.is_module_packaged(ancestor.root()):
-                self._add_class_public_symbols(ancestor)
-
-        syms = set()
+        cldef = classes[qname]
+        for ancestor in cldef['ancestors']:
+            ancestor_def = classes.get(ancestor)
+            if ancestor_def and self._is_file_packaged(ancestor_def['file']):
+                self._add_class_public_symbols(ancestor, classes)
 
-        # Add public class attributes
-        for attr in cldef.locals:
-            if (isinstance(cldef.locals[attr][-1], AssignName)
-                    and _is_public_sym(attr)):
-                syms.add(attr)
+        self.syms[qname] = set(cldef['syms'])
 
-        # Add public class methods and instance attributes
-        syms.update({m.name
-                     for m in cldef.mymethods() if _is_public_sym(m.name)})
-        syms.update({attr
-                     for attr in cldef.instance_attrs if _is_public_sym(attr)})
-
-        self.syms[qname] = syms
-
-    def add_module_public_symbols(self, mod: Module):
+    def _add_exports(self, qname: str, path: str,
+                     mod: Optional[Module] = None):
         """
-        Add module public symbols to the symbols exported by the package
+        Add symbols exported by module, from export table if the module has
+        not changed, by inspecting it otherwise.
         """
-        if not self.is_module_packaged(mod) or not _is_public_sym(mod.name):
+        if not self._is_file_packaged(path) or not _is_public_sym(qname):
             return
 
-        qname = mod.qname()
-
         # Skip namespace has already been processed
-        if qname in self.syms:
+        if qname in self.syms or qname in self._visited:
             return
-
-        # Add all public symbols of the namespace, only if the module has its
-        # path well identified
-        if qname != mod.file:
-            self.syms[qname] = set(mod.public_names())
-
-            # Loop over class definition and add those with a public name
-            for cldef in mod.nodes_of_class(ClassDef):
-                if _is_public_sym(cldef.name):
-                    self._add_class_public_symbols(cldef)
-
-        # Loop over import statement definition and process imported modules
-        for imp in mod.nodes_of_class(Import):
+        self._visited.add(qname)
+
+        entry = self._exports.get(qname, path)
+        if entry is None:
+            if mod is None:
+                mod = MANAGER.ast_from_file(path, qname)
+            entry = _module_exports(mod)
+            self._exports.put(qname, path, entry)
+
+        if entry['public_names'] is not None:
+            self.syms[qname] = set(entry['public_names'])
+            for clname in entry['public_classes']:
+                self._add_class_public_symbols(clname, entry['classes'])
+
+        # Process imported modules
+        for impname, imppath in entry['imports']:
             try:
-                self._add_import(imp)
+                self._add_exports(impname, imppath)
             except RecursionError:
                 print('Recursion error, maybe astroid bug...'
                       'Skipping provides processing', file=sys.stderr)
 
-        # Loop over 'from ... import ...' definition and process imported
-        # modules
-        for impfrom in mod.nodes_of_class(ImportFrom):
-            try:
-                self._add_importfrom(impfrom)
-            except RecursionError:
-                print('Recursion error, maybe astroid bug...'
-                      'Skipping provides processing', file=sys.stderr)
+    def add_module_public_symbols(self, mod: Module):
+        """
+        Add module public symbols to the symbols exported by the package
+        """
+        self._add_exports(mod.qname(), _module_file(mod), mod)
 
     def add_namespace_symbol(self, namespace: str, symbol: str):
         """
@@ -196,10 +353,15 @@ class PkgData:
         ns_symset.add(symbol)
 
     def _gen_pyfile_symbols(self, pyfile: str):
+        modpath = modpath_from_file_with_callback(pyfile, None,
+                                                  lambda x, y: True)
+        if modpath[-1] == '__init__':
+            modpath.pop()
+        qname = '.'.join(modpath)
+
         try:
-            modpath = modpath_from_file_with_callback(pyfile, None,
-                                                      lambda x, y: True)
-            mod = MANAGER.ast_from_file(pyfile, '.'.join(modpath))
+            # The module is parsed only if not found in export table
+            self._add_exports(qname, pyfile)
         except (AstroidSyntaxError, InconsistentMroError) as error:
             print(f'Warning: {pyfile} has raised a syntax error:\n'
                   f' {error}\n'
@@ -207,13 +369,11 @@ class PkgData:
                   file=sys.stderr)
             return
 
-        self.add_module_public_symbols(mod)
-
         # For a python package, __main__.py holds the contents which
         # will be executed when the module is run with -m. If module
         # exists, <pypkg>.__main__ will be added to the public symbols.
         if basename(pyfile) == '__main__.py':
-            pkg_namespace = mod.qname().rsplit('.', 1)[0]
+            pkg_namespace = qname.rsplit('.', 1)[0]
             self.add_namespace_symbol(pkg_namespace, '__main__')
 
     def gen_pypkg_symbols(self):
@@ -260,13 +420,19 @@ class PkgData:
         return provided
 
 
-def run_provides(input_files: Iterable[str]):
+def run_provides(input_files: Iterable[str],
+                 cache_dir: Optional[str] = None) -> Dict[str, List[str]]:
     """
     python_provides utility entry point
+
+    Args:
+        input_files: python files whose provided symbols must be found
+        cache_dir: if not None, folder where the export table of each module
+            is stored and reused.
+
+    Return: mapping of python package name to symbols provided
     """
-    pkgdata = PkgData(input_files)
+    pkgdata = PkgData(input_files, cache_dir)
     pkgdata.gen_pypkg_symbols()
 
-    # Return result on stdout as JSON
-    json.dump({k: list(sorted(v)) for k, v in pkgdata.get_provided().items()},
-              fp=sys.stdout, indent='    ', separators=(',', ': '))
+    return {k: list(sorted(v)) for k, v in pkgdata.get_provided().items()}
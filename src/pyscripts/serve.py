@@ -0,0 +1,157 @@
+# @mindmaze_header@
+"""
+long-lived server processing pyscripts commands.
+
+It reads requests on standard input and writes one response on standard output
+for each of them. Each request and response is a JSON object written on a
+single line. A request has the following keys:
+  - command: name of the command to run (depends or provides)
+  - site_paths: list of python site-packages folders
+  - files: list of files to analyze
+
+Several commands can be run with a single request whose "batch" key holds the
+list of their requests. The result is then the list of the results of each
+command. The commands of a batch are run grouped by site paths.
+
+The response holds the result of the command in the "result" key, or a string
+describing the failure in the "error" key. The messages that the command has
+written are reported in the "log" key.
+
+Since the state of astroid is kept between requests, the modules inferred in a
+request do not need to be inferred again in the next ones, as long as the site
+paths do not change.
+"""
+
+import json
+import os
+import sys
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from os.path import abspath
+from traceback import format_exc
+from typing import Any, Dict, List, Optional
+
+from astroid import MANAGER as astroid_manager, __version__ as astroid_version
+
+from .depends import run_depends
+from .provides import run_provides
+from .utils import is_namespace_pkg
+
+
+def _clear_astroid_cache():
+    """
+    Remove from astroid caches the modules that may not be resolved the same
+    way once the site paths have changed
+    """
+    astroid_manager.clear_cache()
+
+    # Before astroid 3.0, clear_cache() keeps the lookups of module files
+    if int(astroid_version.split('.', maxsplit=1)[0]) < 3:
+        # pylint: disable=protected-access
+        astroid_manager._mod_file_cache.clear()
+
+
+class _Server:
+    """
+    State of the server kept between requests
+    """
+    def __init__(self, site_paths: List[str], cache_dir: Optional[str]):
+        self.site_paths = [abspath(p) for p in site_paths]
+        self.cache_dir = cache_dir
+
+    def _set_site_paths(self, site_paths: List[str]):
+        """
+        Replace the site paths of the previous request with the new ones in
+        sys.path
+        """
+        site_paths = [abspath(p) for p in site_paths]
+        if site_paths == self.site_paths:
+            return
+
+        for sitedir in self.site_paths:
+            sys.path.remove(sitedir)
+
+        for sitedir in site_paths:
+            sys.path.insert(0, sitedir)
+
+        # module lookup depends on sys.path
+        is_namespace_pkg.cache_clear()
+        _clear_astroid_cache()
+        self.site_paths = site_paths
+
+    def _run_batch(self, batch: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Run the requests of a batch grouped by site paths, starting with the
+        current ones, so that astroid cache is cleared only once per group.
+        The results are returned in the order of the batch.
+        """
+        def _group_key(idx: int):
+            site_paths = [abspath(p) for p in batch[idx].get('site_paths', [])]
+            return (site_paths != self.site_paths, site_paths)
+
+        results = [None] * len(batch)
+        for idx in sorted(range(len(batch)), key=_group_key):
+            results[idx] = self.run(batch[idx])
+
+        return results
+
+    def run(self, request: Dict[str, Any]) -> Any:
+        """
+        Run the command(s) of a request and return the result
+        """
+        if 'batch' in request:
+            return self._run_batch(request['batch'])
+
+        self._set_site_paths(request.get('site_paths', []))
+        command = request['command']
+        files = request['files']
+
+        if command == 'depends':
+            return run_depends(files, self.site_paths, self.cache_dir)
+        if command == 'provides':
+            return run_provides(files, self.cache_dir)
+
+        raise ValueError(f'Unknown command: {command}')
+
+    def process(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Process a request and return the response to send
+        """
+        log = StringIO()
+        response = {}
+        try:
+            # Anything written on stdout would corrupt the responses stream
+            with redirect_stdout(log), redirect_stderr(log):
+                response['result'] = self.run(request)
+        except Exception:  # pylint: disable=broad-except
+            response['error'] = format_exc()
+
+        response['log'] = log.getvalue()
+        return response
+
+
+def run_server(site_paths: List[str], cache_dir: Optional[str] = None):
+    """
+    Process the requests read on standard input until it is closed
+
+    Args:
+        site_paths: python site-packages folders initially in sys.path
+        cache_dir: if not None, folder where analysis results are cached
+    """
+    server = _Server(site_paths, cache_dir)
+
+    # C extensions loaded during the analysis may write directly on the file
+    # descriptor of stdout, bypassing redirect_stdout(). Hence responses are
+    # written on a private copy of it and stdout is pointed to stderr.
+    sys.stdout.flush()
+    with os.fdopen(os.dup(sys.stdout.fileno()), 'w',
+                   encoding='utf-8') as responses:
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+
+            response = server.process(json.loads(line))
+            responses.write(json.dumps(response) + '\n')
+            responses.flush()
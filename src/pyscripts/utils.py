@@ -15,3 +15,16 @@ def is_namespace_pkg(modname: str) -> bool:
     except ImportError:
         is_ns = False
     return is_ns
+
+
+def get_pkg(modname: str) -> str:
+    """Get the deepest regular package"""
+    modpath = modname.split('.')
+
+    # Find first parent package that is not a namespace
+    for depth in range(1, len(modpath)+1):
+        root_modname = '.'.join(modpath[:depth])
+        if not is_namespace_pkg(root_modname):
+            break
+
+    return root_modname
@@ -0,0 +1,100 @@
+# @mindmaze_header@
+import tarfile
+import unittest
+
+from hashlib import sha256
+from os import chmod, environ, link, makedirs, stat, symlink
+from shutil import rmtree
+
+from mmpack_build.archive import create_tarball, _TarWriter
+from mmpack_build.common import link_or_copy, sha256sum, SHA256_CHUNK_SIZE
+
+
+TEST_TREE = environ.get('TESTSDIR', '.') + '/test_archive'
+
+
+def _reset_tarinfo(tarinfo: tarfile.TarInfo):
+    """
+    reference tarfile filter for deterministic tarballs
+    """
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = 'root'
+    tarinfo.mtime = 0
+    tarinfo.mode = 0o755 if (tarinfo.mode & 0o100) else 0o644
+    return tarinfo
+
+
+class TestCreateTarball(unittest.TestCase):
+    def setUp(self):
+        makedirs(TEST_TREE + '/root/adir', exist_ok=True)
+        for path in ['root/adir/afile', 'root/adir/bfile', 'root/cfile']:
+            with open(f'{TEST_TREE}/{path}', 'w', encoding='utf-8') as stream:
+                stream.write(path)
+
+    def tearDown(self):
+        rmtree(TEST_TREE, ignore_errors=True)
+
+    def test_create_tarball_hash(self):
+        """
+        test size and hash reported by create_tarball() and link_or_copy()
+        """
+        tarpath = TEST_TREE + '/archive.tar.gz'
+        outdir = TEST_TREE + '/outdir'
+        makedirs(outdir, exist_ok=True)
+
+        size, digest = create_tarball(TEST_TREE + '/root', tarpath, 'gz')
+        with open(tarpath, 'rb') as stream:
+            data = stream.read()
+        self.assertEqual(size, len(data))
+        self.assertEqual(digest, sha256(data).hexdigest())
+
+        outpath = link_or_copy(tarpath, outdir)
+        self.assertEqual(outpath, outdir + '/archive.tar.gz')
+        self.assertEqual(sha256sum(outpath), digest)
+
+        # Recreating the tarball must not modify a file linked to it
+        link(tarpath, TEST_TREE + '/archive-link.tar.gz')
+        create_tarball(TEST_TREE + '/root/adir', tarpath, 'gz')
+        self.assertEqual(sha256sum(TEST_TREE + '/archive-link.tar.gz'),
+                         digest)
+        self.assertEqual(sha256sum(outpath), digest)
+        self.assertEqual(stat(tarpath).st_nlink, 1)
+
+    def test_create_tarball_reproducible(self):
+        """
+        test create_tarball() generates the same stream as tarfile
+        """
+        srcdir = TEST_TREE + '/tarsrc'
+        longdir = srcdir + '/' + 'long-directory-name' * 6
+        makedirs(longdir, exist_ok=True)
+        makedirs(srcdir + '/empty-dir', exist_ok=True)
+        for name, size in [('empty', 0), ('block', 512), ('odd', 1000),
+                           ('big', 3 * SHA256_CHUNK_SIZE + 3),
+                           ('unicode-éèà', 42)]:
+            with open(f'{longdir}/{name}', 'wb') as stream:
+                stream.write(bytes(i % 253 for i in range(size)))
+        chmod(longdir + '/odd', 0o700)
+        symlink('long-directory-name' * 6 + '/odd', srcdir + '/link')
+        symlink('../' * 10 + 'dangling', srcdir + '/dangling')
+        link(longdir + '/odd', srcdir + '/hardlink')
+        link(longdir + '/block', TEST_TREE + '/outside-hardlink')
+
+        refpath = TEST_TREE + '/ref.tar'
+        with tarfile.open(refpath, 'w', format=tarfile.PAX_FORMAT) as tar:
+            tar.add(srcdir, recursive=True, filter=_reset_tarinfo,
+                    arcname='.')
+        with open(refpath, 'rb') as stream:
+            ref = stream.read()
+
+        tarpath = TEST_TREE + '/test.tar'
+        create_tarball(srcdir, tarpath)
+        with open(tarpath, 'rb') as stream:
+            self.assertEqual(stream.read(), ref)
+
+        # Same with data copied from file to file by the kernel
+        with open(tarpath, 'wb') as stream:
+            tar = _TarWriter(stream)
+            tar.add_tree(srcdir)
+            tar.close()
+        with open(tarpath, 'rb') as stream:
+            self.assertEqual(stream.read(), ref)
@@ -1,12 +1,15 @@
 # @mindmaze_header@
 import unittest
 
-from os import environ, makedirs, getcwd, chdir
+from hashlib import sha256
+from os import environ, makedirs, getcwd, chdir, stat, symlink
 from os.path import dirname, abspath
 from shutil import rmtree
 
-from mmpack_build.common import list_files, parse_soname, shlib_keyname, \
-    str2bool, wrap_str
+from mmpack_build import common
+from mmpack_build.common import list_files, parse_soname, \
+    shlib_keyname, sha256sum, sha256sums, str2bool, wrap_str, RegexSet, \
+    SHA256_CHUNK_SIZE
 
 
 REF_FILELIST = [
@@ -247,3 +250,98 @@ class TestFileList(unittest.TestCase):
 
         strtest = wrap_str(_DEPLIST_STR, maxlen=45, split_token=', ')
         self.assertEqual(strtest, _WRAPPED_DEPLIST_REF45)
+
+
+class TestRegexSet(unittest.TestCase):
+    def test_regex_set(self):
+        """
+        test RegexSet reports the first pattern matching the whole string
+        """
+        patterns = [r'.*\.la', r'lib/(.*)\.so(\.[0-9]+)*', r'lib/.*',
+                    r'share/(doc|man)/.*']
+        cases = {
+            'lib/libfoo.la': 0,
+            'lib/libfoo.so.1': 1,
+            'lib/libfoo.a': 2,
+            'share/man/foo.1': 3,
+            'share/locale/foo.mo': None,
+            'bin/lib/foo': None,
+        }
+        # The second set cannot be combined in one regex due to the
+        # backreference: patterns must be tested one after the other
+        for extra in ([], [r'(.)\1']):
+            regex_set = RegexSet(patterns + extra)
+            for string, index in cases.items():
+                self.assertEqual(regex_set.match(string), index)
+
+            str_set = set(cases)
+            self.assertEqual(regex_set.extract_matching(str_set),
+                             {0: {'lib/libfoo.la'}, 1: {'lib/libfoo.so.1'},
+                              2: {'lib/libfoo.a'}, 3: {'share/man/foo.1'}})
+            self.assertEqual(str_set, {'share/locale/foo.mo', 'bin/lib/foo'})
+
+        # Conditional group reference must not refer to the group enclosing
+        # the pattern in the combined regex
+        self.assertEqual(RegexSet([r'(x)?(?(1)a|b)', '.*']).match('xa'), 0)
+
+
+class TestSha256(unittest.TestCase):
+    def setUp(self):
+        self.testdir = TEST_TREE + '/sha256'
+        makedirs(self.testdir, exist_ok=True)
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def test_sha256sums(self):
+        """
+        test sha256sum() and sha256sums() on files spanning several chunks
+        """
+        refs = {}
+        for i, size in enumerate([0, 10, SHA256_CHUNK_SIZE,
+                                  3 * SHA256_CHUNK_SIZE + 7]):
+            path = f'{self.testdir}/data{i}'
+            data = bytes(j % 251 for j in range(size))
+            with open(path, 'wb') as stream:
+                stream.write(data)
+            refs[path] = sha256(data).hexdigest()
+
+        for path, ref in refs.items():
+            self.assertEqual(sha256sum(path), ref)
+        self.assertEqual(sha256sums(refs), refs)
+
+        # Hash of symlinks and regular files when symlink are not followed
+        path = self.testdir + '/data1'
+        link = self.testdir + '/link'
+        symlink('data1', link)
+        self.assertEqual(sha256sums([link, path], follow_symlink=False),
+                         {link: 'sym-' + sha256(b'data1').hexdigest(),
+                          path: 'reg-' + refs[path]})
+
+        # Memoized hash must not be used once the file is modified
+        with open(path, 'ab') as stream:
+            stream.write(b'more')
+        ref = sha256(bytes(range(10)) + b'more').hexdigest()
+        self.assertEqual(sha256sum(path), ref)
+
+    def test_sha256_memo_bounded(self):
+        """
+        test least recently used memoized hashes are dropped beyond the limit
+        """
+        paths = []
+        for i in range(3):
+            paths.append(f'{self.testdir}/file{i}')
+            with open(paths[-1], 'w', encoding='utf-8') as stream:
+                stream.write(f'content {i}')
+
+        self.addCleanup(setattr, common, 'SHA256_MEMO_MAXSIZE',
+                        common.SHA256_MEMO_MAXSIZE)
+        common.SHA256_MEMO_MAXSIZE = 2
+        common._SHA256_MEMO.clear()
+
+        keys = [common._sha256_memo_key(stat(p)) for p in paths]
+        sha256sum(paths[0])
+        sha256sum(paths[1])
+        sha256sum(paths[0])
+        sha256sum(paths[2])
+        self.assertEqual(list(common._SHA256_MEMO), [keys[0], keys[2]])
@@ -0,0 +1,129 @@
+# @mindmaze_header@
+import unittest
+
+from functools import partial
+from hashlib import sha256
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os import environ, makedirs, urandom
+from os.path import exists
+from shutil import rmtree
+from threading import Thread
+
+from mmpack_build.common import SHA256_CHUNK_SIZE
+from mmpack_build.download import download
+from mmpack_build.errors import DownloadError
+
+
+TEST_TREE = environ.get('TESTSDIR', '.') + '/test_download'
+
+
+class _RangeHandler(SimpleHTTPRequestHandler):
+    """
+    HTTP handler supporting Range requests. The first response can be
+    interrupted after cut_after bytes.
+    """
+    requested_ranges = []
+    cut_after = None
+
+    def do_GET(self):
+        with open(self.translate_path(self.path), 'rb') as stream:
+            data = stream.read()
+
+        req_range = self.headers.get('Range')
+        type(self).requested_ranges.append(req_range)
+        start = 0
+        if req_range:
+            start = int(req_range[len('bytes='):].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+
+        cut_after = self.cut_after
+        if cut_after is not None:
+            type(self).cut_after = None
+            self.wfile.write(data[start:start + cut_after])
+            self.close_connection = True
+            return
+
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestDownload(unittest.TestCase):
+    server = None
+    srvdir = TEST_TREE + '/srv'
+
+    @classmethod
+    def setUpClass(cls):
+        makedirs(cls.srvdir, exist_ok=True)
+        cls.data = urandom(3 * SHA256_CHUNK_SIZE + 7)
+        cls.digest = sha256(cls.data).hexdigest()
+        with open(cls.srvdir + '/data.bin', 'wb') as stream:
+            stream.write(cls.data)
+
+        handler = partial(_RangeHandler, directory=cls.srvdir)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        host, port = cls.server.server_address
+        cls.url = f'http://{host}:{port}/data.bin'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        rmtree(TEST_TREE, ignore_errors=True)
+
+    def setUp(self):
+        self.path = TEST_TREE + '/downloaded.bin'
+        _RangeHandler.requested_ranges = []
+
+    def _read_downloaded(self) -> bytes:
+        with open(self.path, 'rb') as stream:
+            return stream.read()
+
+    def test_download_interrupted(self):
+        """
+        test interrupted transfer is resumed
+        """
+        _RangeHandler.cut_after = SHA256_CHUNK_SIZE + 11
+        self.assertEqual(download(self.url, self.path), self.digest)
+        self.assertEqual(self._read_downloaded(), self.data)
+        # Resumed from the data received before interruption (the data not
+        # yet returned by urllib3 is lost)
+        first_req, resume_req = _RangeHandler.requested_ranges
+        self.assertIsNone(first_req)
+        offset = int(resume_req[len('bytes='):-1])
+        self.assertTrue(0 < offset <= SHA256_CHUNK_SIZE + 11)
+        self.assertFalse(exists(self.path + '.part'))
+
+    def test_download_resume_partial_file(self):
+        """
+        test partial file of previous download is resumed if verifiable
+        """
+        with open(self.path + '.part', 'wb') as stream:
+            stream.write(self.data[:1000])
+        self.assertEqual(download(self.url, self.path, self.digest),
+                         self.digest)
+        self.assertEqual(_RangeHandler.requested_ranges, ['bytes=1000-'])
+        self.assertEqual(self._read_downloaded(), self.data)
+
+        # Without expected sha256, partial file is not trusted
+        with open(self.path + '.part', 'wb') as stream:
+            stream.write(b'garbage')
+        download(self.url, self.path)
+        self.assertEqual(_RangeHandler.requested_ranges[1:], [None])
+        self.assertEqual(self._read_downloaded(), self.data)
+
+    def test_download_sha256_mismatch(self):
+        """
+        test download fails if data does not match expected sha256
+        """
+        with self.assertRaises(DownloadError):
+            download(self.url, self.path, '0' * 64)
+        self.assertFalse(exists(self.path + '.part'))
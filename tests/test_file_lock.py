@@ -0,0 +1,63 @@
+# @mindmaze_header@
+import unittest
+
+from os import environ, makedirs, stat, unlink
+from shutil import rmtree
+from threading import Event, Thread
+
+from mmpack_build.file_lock import file_lock
+
+
+TEST_TREE = environ.get('TESTSDIR', '.') + '/test_file_lock'
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        makedirs(TEST_TREE, exist_ok=True)
+
+    def tearDown(self):
+        rmtree(TEST_TREE, ignore_errors=True)
+
+    def test_file_lock(self):
+        """
+        test file_lock() serializes holders and supports lock file removal
+        """
+        lockpath = TEST_TREE + '/test.lock'
+        events = []
+        locked = Event()
+
+        def concurrent_holder():
+            locked.wait()
+            with file_lock(lockpath):
+                events.append('waiter')
+
+        thread = Thread(target=concurrent_holder)
+        thread.start()
+        with file_lock(lockpath):
+            locked.set()
+            thread.join(timeout=0.2)
+            self.assertTrue(thread.is_alive())
+            events.append('holder')
+            unlink(lockpath)
+
+        thread.join()
+        self.assertEqual(events, ['holder', 'waiter'])
+        self.assertTrue(stat(lockpath))
+
+        # shared locks can be held concurrently
+        with file_lock(lockpath, shared=True):
+            with file_lock(lockpath, shared=True):
+                pass
+
+    def test_file_lock_non_blocking(self):
+        """
+        test non blocking file_lock() fails if the lock is held elsewhere
+        """
+        lockpath = TEST_TREE + '/test.lock'
+        with file_lock(lockpath):
+            with self.assertRaises(BlockingIOError):
+                with file_lock(lockpath, blocking=False):
+                    pass
+
+        with file_lock(lockpath, blocking=False):
+            pass
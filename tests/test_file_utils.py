@@ -4,7 +4,7 @@ import os
 import unittest
 from zipfile import ZipFile, ZipInfo
 
-from mmpack_build.file_utils import filetype
+from mmpack_build.file_utils import filetype, filetype_cache
 
 
 
@@ -55,3 +55,20 @@ class TestFileUtils(unittest.TestCase):
 
         os.unlink(testfile)
         self.assertEqual(ftype, 'zip')
+
+    def test_filetype_cache(self):
+        """
+        test that filetype() inspects a file once within filetype_cache()
+        """
+        testfile = 'test.file'
+        open(testfile, 'wt').write('#!/bin/sh\n')
+
+        with filetype_cache():
+            self.assertEqual(filetype(testfile), 'sh')
+            open(testfile, 'wt').write('#!/bin/bash\n')
+            self.assertEqual(filetype(testfile), 'sh')
+
+        # Outside of the context, the type is not memoized anymore
+        ftype = filetype(testfile)
+        os.unlink(testfile)
+        self.assertEqual(ftype, 'bash')
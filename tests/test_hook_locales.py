@@ -0,0 +1,255 @@
+# @mindmaze_header@
+import os
+import unittest
+from shutil import rmtree
+from struct import pack
+from typing import Dict, List, Tuple
+
+from mmpack_build import elf_utils, pe_utils
+from mmpack_build.hook_locales import (MMPackBuildHook,
+                                       _extract_msgids_from_gnu_mo)
+from mmpack_build.package_info import PackageInfo
+
+
+_TESTS_DATA_DIR = os.path.abspath(os.environ.get('TESTSDIR', '.')
+                                  + '/tmp-locales')
+
+
+def _write_gnu_mo(path: str, catalog: Dict[str, str], endianness: str = '<'):
+    """
+    Write a GNU MO file with original strings stored before translations
+    """
+    entries = sorted((k.encode('utf-8'), v.encode('utf-8'))
+                     for k, v in catalog.items())
+    num = len(entries)
+    orig_table_offset = 28
+    trans_table_offset = orig_table_offset + num * 8
+    offset = trans_table_offset + num * 8
+
+    orig_table = b''
+    trans_table = b''
+    strings = b''
+    for msgid, _ in entries:
+        orig_table += pack(endianness + 'II', len(msgid), offset)
+        strings += msgid + b'\0'
+        offset += len(msgid) + 1
+    for _, msgstr in entries:
+        trans_table += pack(endianness + 'II', len(msgstr), offset)
+        strings += msgstr + b'\0'
+        offset += len(msgstr) + 1
+
+    header = pack(endianness + 'IIIIIII', 0x950412de, 0, num,
+                  orig_table_offset, trans_table_offset, 0, 0)
+    with open(path, 'wb') as stream:
+        stream.write(header + orig_table + trans_table + strings)
+
+
+def _write_elf(path: str, sections: List[Tuple[str, int, int, bytes]]):
+    """
+    Write a minimal ELF64 file made of the sections described by (name, type,
+    flags, content) tuples
+    """
+    shstrtab = b'\0'
+    names = []
+    for name, _, _, _ in sections + [('.shstrtab', 3, 0, b'')]:
+        names.append(len(shstrtab))
+        shstrtab += name.encode() + b'\0'
+
+    # Section contents are stored right after the ELF header
+    offset = 64
+    contents = b''
+    shdrs = pack('<IIQQQQIIQQ', *[0]*10)
+    for (_, sh_type, flags, data), name in zip(sections, names):
+        shdrs += pack('<IIQQQQIIQQ', name, sh_type, flags, 0,
+                      offset + len(contents), len(data), 0, 0, 1, 0)
+        contents += data
+    shdrs += pack('<IIQQQQIIQQ', names[-1], 3, 0, 0, offset + len(contents),
+                  len(shstrtab), 0, 0, 1, 0)
+    contents += shstrtab
+
+    ident = b'\x7fELF\x02\x01\x01' + bytes(9)
+    header = pack('<16sHHIQQQIHHHHHH', ident, 2, 62, 1, 0, 0,
+                  offset + len(contents), 0, 64, 56, 0, 64,
+                  len(sections) + 2, len(sections) + 1)
+    with open(path, 'wb') as stream:
+        stream.write(header + contents + shdrs)
+
+
+def _write_pe(path: str, sections: List[Tuple[str, int, bytes]]):
+    """
+    Write a minimal PE32+ file made of the sections described by (name,
+    characteristics, content) tuples
+    """
+    file_align = 0x200
+    sect_align = 0x1000
+    hdrs_size = 64 + 4 + 20 + 240 + 40 * len(sections)
+    raw_offset = -(-hdrs_size // file_align) * file_align
+
+    section_table = b''
+    contents = b''
+    for i, (name, flags, data) in enumerate(sections):
+        raw_size = -(-len(data) // file_align) * file_align
+        section_table += pack('<8sIIIIIIHHI', name.encode(), len(data),
+                              (i + 1) * sect_align, raw_size,
+                              raw_offset + len(contents), 0, 0, 0, 0, flags)
+        contents += data.ljust(raw_size, b'\0')
+
+    dos_header = b'MZ'.ljust(0x3c, b'\0') + pack('<I', 64)
+    coff_header = pack('<HHIIIHH', 0x8664, len(sections), 0, 0, 0, 240, 0x22)
+    opt_header = pack('<HBBIIIIIQIIHHHHHHIIIIHHQQQQII', 0x20b, 0, 0, 0, 0, 0,
+                      0, 0, 0x140000000, sect_align, file_align, 6, 0, 0, 0,
+                      6, 0, 0, (len(sections) + 1) * sect_align, raw_offset,
+                      0, 3, 0, 0, 0, 0, 0, 0, 16) + bytes(16 * 8)
+    headers = dos_header + b'PE\0\0' + coff_header + opt_header
+    with open(path, 'wb') as stream:
+        stream.write((headers + section_table).ljust(raw_offset, b'\0'))
+        stream.write(contents)
+
+
+# Flags of ELF sections
+_SHT_PROGBITS = 1
+_SHT_NOBITS = 8
+_SHF_WRITE = 0x1
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+
+# Characteristics of PE sections
+_SCN_CNT_CODE = 0x20
+_SCN_CNT_INITIALIZED_DATA = 0x40
+_SCN_MEM_EXECUTE = 0x20000000
+_SCN_MEM_READ = 0x40000000
+
+
+class TestGnuMo(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(_TESTS_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def test_extract_msgids(self):
+        """
+        test msgids extraction of GNU MO file in both endianness
+        """
+        catalog = {'': 'Content-Type: text/plain; charset=UTF-8\n',
+                   'Hello': 'Bonjour',
+                   'Coffee: %s': 'Café : %s',
+                   'Œuvre': 'Work'}
+        for endianness in '<>':
+            path = f'{_TESTS_DATA_DIR}/fr{endianness == ">"}.mo'
+            _write_gnu_mo(path, catalog, endianness)
+            self.assertEqual(_extract_msgids_from_gnu_mo(path),
+                             {'Hello', 'Coffee: %s', 'Œuvre'})
+
+    def test_extract_msgids_shared(self):
+        """
+        test msgids of catalogs of different languages are parsed once
+        """
+        msgids = ['Open', 'Close', 'Quit']
+        fr_path = _TESTS_DATA_DIR + '/fr.mo'
+        de_path = _TESTS_DATA_DIR + '/de.mo'
+        es_path = _TESTS_DATA_DIR + '/es.gmo'
+        _write_gnu_mo(fr_path, dict(zip(msgids, ['Ouvrir', 'Fermer', 'Q'])))
+        _write_gnu_mo(de_path, dict(zip(msgids, ['Öffnen', 'Zu', 'B'])))
+        _write_gnu_mo(es_path, {'Open': 'Abrir', 'Exit': 'Salir'})
+
+        fr_msgids = _extract_msgids_from_gnu_mo(fr_path)
+        de_msgids = _extract_msgids_from_gnu_mo(de_path)
+        es_msgids = _extract_msgids_from_gnu_mo(es_path)
+        self.assertEqual(fr_msgids, set(msgids))
+        self.assertIs(fr_msgids, de_msgids)
+        self.assertEqual(es_msgids, {'Open', 'Exit'})
+
+    def test_not_gnu_mo(self):
+        """
+        test files that are not GNU MO files are ignored
+        """
+        path = _TESTS_DATA_DIR + '/empty.mo'
+        open(path, 'wb').close()
+        self.assertIsNone(_extract_msgids_from_gnu_mo(path))
+
+        path = _TESTS_DATA_DIR + '/text.mo'
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write('not a gnu mo file')
+        self.assertIsNone(_extract_msgids_from_gnu_mo(path))
+        self.assertIsNone(_extract_msgids_from_gnu_mo('README.txt'))
+
+
+class TestDataSections(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(_TESTS_DATA_DIR, exist_ok=True)
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def test_elf_data_sections(self):
+        """
+        test only initialized data sections loaded at runtime are reported
+        """
+        path = _TESTS_DATA_DIR + '/prog'
+        _write_elf(path, [
+            ('.text', _SHT_PROGBITS, _SHF_ALLOC | _SHF_EXECINSTR, b'code'),
+            ('.rodata', _SHT_PROGBITS, _SHF_ALLOC, b'Hello\0World\0'),
+            ('.data', _SHT_PROGBITS, _SHF_ALLOC | _SHF_WRITE, b'Data'),
+            ('.bss', _SHT_NOBITS, _SHF_ALLOC | _SHF_WRITE, b''),
+            ('.comment', _SHT_PROGBITS, 0, b'GCC: 12.2'),
+        ])
+        self.assertEqual(list(elf_utils.data_sections(path)),
+                         [b'Hello\0World\0', b'Data'])
+
+    def test_pe_data_sections(self):
+        """
+        test only initialized data sections not executable are reported
+        """
+        path = _TESTS_DATA_DIR + '/prog.exe'
+        _write_pe(path, [
+            ('.text', _SCN_CNT_CODE | _SCN_MEM_EXECUTE | _SCN_MEM_READ,
+             b'code'),
+            ('.rdata', _SCN_CNT_INITIALIZED_DATA | _SCN_MEM_READ,
+             b'Hello\0World\0'),
+        ])
+        sections = [s.rstrip(b'\0') for s in pe_utils.data_sections(path)]
+        self.assertEqual(sections, [b'Hello\0World'])
+
+
+class TestLocalesDepends(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(_TESTS_DATA_DIR, exist_ok=True)
+        self.hook = MMPackBuildHook('foo', 'amd64-debian', '', '.')
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def _depends(self, rodata: bytes, catalogs: Dict[str, List[str]]):
+        path = _TESTS_DATA_DIR + '/prog'
+        _write_elf(path, [('.rodata', _SHT_PROGBITS, _SHF_ALLOC, rodata)])
+
+        pkg = PackageInfo('foo-bin')
+        pkg.files = {path}
+        locales_pkgs = []
+        for name, msgids in catalogs.items():
+            locales_pkg = PackageInfo(name)
+            locales_pkg.provides['locales'] = set(msgids)
+            locales_pkgs.append(locales_pkg)
+
+        self.hook.update_depends(pkg, [pkg] + locales_pkgs)
+        return [dep[0] for dep in pkg.deplist]
+
+    def test_depends_msgid_found(self):
+        """
+        test dependency on locales packages whose msgids are in data section
+        """
+        rodata = (b'\x01\x02Open file\0\xff' + 'Café : %s'.encode('utf-8')
+                  + b'\0\xc3\xa9Quit\0')
+        deps = self._depends(rodata, {'foo-locales': ['Open file'],
+                                      'bar-locales': ['Café : %s'],
+                                      'baz-locales': ['Quit'],
+                                      'qux-locales': ['Close file']})
+        self.assertEqual(deps, ['foo-locales', 'bar-locales', 'baz-locales'])
+
+    def test_depends_short_msgid_ignored(self):
+        """
+        test msgids shorter than 4 bytes do not create dependency
+        """
+        deps = self._depends(b'OK\0Yes\0', {'foo-locales': ['OK', 'Yes']})
+        self.assertEqual(deps, [])
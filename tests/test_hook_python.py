@@ -2,18 +2,25 @@
 
 import unittest
 from glob import glob
-from os import environ
-from os.path import dirname, abspath, join
-from typing import Set
+from os import chdir, environ, getcwd, makedirs, scandir, stat, utime
+from os.path import dirname, abspath, exists, isdir, join, relpath
+from shutil import copy, copy2, rmtree
+from typing import Dict, Set
 
+from mmpack_build import hook_python
 from mmpack_build.package_info import PackageInfo
 from mmpack_build.hook_python import (_gen_py_importname, _gen_pysymbols,
-                                      _gen_pydepends, _FILENAME_GENERATOR)
+                                      _gen_pydepends, _relocate_tree,
+                                      _ImportNameResolver, _FILENAME_GENERATOR,
+                                      _PYSCRIPTS_SERVER)
+from mmpack_build.workspace import Workspace
 
 
 _testdir = dirname(abspath(__file__))
 _sitedir = join(_testdir, 'pydata')
 _tests_data_dir = environ.get('TESTSDIR', '.')
+_cache_dir = abspath(_tests_data_dir + '/tmp-hook-python-cache')
+_DEPENDS_CACHE_DIR = _cache_dir + '/pyscripts/depends'
 
 
 def _prefix_sitedir(files: Set[str]) -> Set[str]:
@@ -31,6 +38,11 @@ def _get_py_depends(pkgfiles: Set[str]) -> Set[str]:
     return used_symbols
 
 
+def _cache_entries() -> Dict[str, int]:
+    """Get the inode of each depends cache entry"""
+    return {e.name: e.inode() for e in scandir(_DEPENDS_CACHE_DIR)}
+
+
 def _get_py_dispatch(pkgfiles: Set[str]) -> Set[str]:
     return _gen_py_importname(_prefix_sitedir(pkgfiles), [_sitedir])
 
@@ -40,6 +52,14 @@ class TestPythonHook(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         _FILENAME_GENERATOR.reset(_tests_data_dir)
+        # pyscripts server must be (re)started with the test cache folder
+        _PYSCRIPTS_SERVER.stop()
+        Workspace().set_cachedir(_cache_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        _PYSCRIPTS_SERVER.stop()
+        rmtree(_cache_dir, ignore_errors=True)
 
     def test_provides_bare_module(self):
         """test provides module without package folder"""
@@ -253,6 +273,30 @@ class TestPythonHook(unittest.TestCase):
         imports = _get_py_depends(pkgfiles)
         self.assertEqual(imports, refimports)
 
+    def test_depends_sharded(self):
+        """test depends of several top-level packages, computed twice"""
+        shards = [
+            ['pkg_imported/__init__.py'],
+            ['multi2/__init__.py', 'multi2/foo.py', 'multi2/bar.py'],
+        ]
+        refimports = {}
+        for pkgfiles in shards:
+            for pypkg, syms in _get_py_depends(pkgfiles).items():
+                refimports.setdefault(pypkg, set()).update(syms)
+
+        # Drop cached results so that shards are inspected in parallel
+        rmtree(_DEPENDS_CACHE_DIR)
+        imports = _get_py_depends(shards[0] + shards[1])
+        self.assertEqual(imports, refimports)
+        cached = _cache_entries()
+        self.assertEqual(len(cached), sum(len(s) for s in shards))
+
+        # 2nd computation reuses cached results of 1st one: cache entries are
+        # not rewritten
+        imports = _get_py_depends(shards[0] + shards[1])
+        self.assertEqual(imports, refimports)
+        self.assertEqual(_cache_entries(), cached)
+
     def test_depends_launcher(self):
         """test dependent imports with simple package with no import"""
         pkgfiles = ['launcher']
@@ -337,3 +381,162 @@ class TestPythonHook(unittest.TestCase):
         }
         dispatch = _get_py_dispatch(pkgfiles)
         self.assertEqual(dispatch, refdispatch)
+
+
+def _write_tree(basedir: str, files: Dict[str, str]):
+    for path, content in files.items():
+        path = join(basedir, path)
+        makedirs(dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+
+
+def _read_tree(basedir: str) -> Dict[str, str]:
+    tree = {}
+    for path in glob(basedir + '/**', recursive=True):
+        if not isdir(path):
+            with open(path, encoding='utf-8') as stream:
+                tree[relpath(path, basedir)] = stream.read()
+    return tree
+
+
+class TestRelocateTree(unittest.TestCase):
+    def setUp(self):
+        self.srcdir = abspath(_tests_data_dir + '/tmp-relocate/src')
+        self.dstdir = abspath(_tests_data_dir + '/tmp-relocate/dst')
+        makedirs(self.srcdir)
+        makedirs(self.dstdir)
+
+        # Record the files hashed to check conflicts
+        self.hashed = []
+        sha256sum = hook_python.sha256sum
+
+        def _sha256sum(path: str) -> str:
+            self.hashed.append(path)
+            return sha256sum(path)
+
+        self.addCleanup(setattr, hook_python, 'sha256sum', sha256sum)
+        hook_python.sha256sum = _sha256sum
+
+    def tearDown(self):
+        rmtree(dirname(self.srcdir), ignore_errors=True)
+
+    def test_missing_dest_moved(self):
+        """test folder missing in destination is moved as a whole"""
+        _write_tree(self.srcdir, {'pkg/__init__.py': '', 'pkg/a.py': 'a'})
+        ino = stat(self.srcdir + '/pkg').st_ino
+
+        _relocate_tree(self.srcdir, self.dstdir)
+        self.assertEqual(stat(self.dstdir + '/pkg').st_ino, ino)
+        self.assertFalse(exists(self.srcdir + '/pkg'))
+        self.assertEqual(_read_tree(self.dstdir),
+                         {'pkg/__init__.py': '', 'pkg/a.py': 'a'})
+
+    def test_merge(self):
+        """test content is merged into existing tree"""
+        _write_tree(self.dstdir, {'pkg/__init__.py': '', 'pkg/a.py': 'a'})
+        _write_tree(self.srcdir, {'pkg/sub/b.py': 'b', 'other.py': 'o'})
+
+        _relocate_tree(self.srcdir, self.dstdir)
+        self.assertEqual(_read_tree(self.dstdir), {
+            'pkg/__init__.py': '',
+            'pkg/a.py': 'a',
+            'pkg/sub/b.py': 'b',
+            'other.py': 'o',
+        })
+        self.assertEqual(self.hashed, [])
+
+    def test_same_file_stat(self):
+        """test identical conflicting files are accepted on their status"""
+        _write_tree(self.srcdir, {'pkg/a.py': 'same content'})
+        makedirs(self.dstdir + '/pkg')
+        copy2(self.srcdir + '/pkg/a.py', self.dstdir + '/pkg/a.py')
+
+        _relocate_tree(self.srcdir, self.dstdir)
+        self.assertEqual(_read_tree(self.dstdir), {'pkg/a.py': 'same content'})
+        self.assertEqual(self.hashed, [])
+
+    def test_same_file_sha256(self):
+        """test identical conflicting files are accepted on their sha256"""
+        _write_tree(self.srcdir, {'pkg/a.py': 'same content'})
+        makedirs(self.dstdir + '/pkg')
+        copy(self.srcdir + '/pkg/a.py', self.dstdir + '/pkg/a.py')
+        utime(self.dstdir + '/pkg/a.py', (0, 0))
+
+        _relocate_tree(self.srcdir, self.dstdir)
+        self.assertEqual(_read_tree(self.dstdir), {'pkg/a.py': 'same content'})
+        self.assertEqual(sorted(self.hashed),
+                         [self.dstdir + '/pkg/a.py',
+                          self.srcdir + '/pkg/a.py'])
+
+    def test_different_files(self):
+        """test conflicting files with different content raise an error"""
+        _write_tree(self.srcdir, {'pkg/a.py': 'content', 'b.py': 'b'})
+        _write_tree(self.dstdir, {'pkg/a.py': 'CONTENT'})
+        with self.assertRaises(FileExistsError):
+            _relocate_tree(self.srcdir, self.dstdir)
+
+        _write_tree(self.dstdir, {'pkg/a.py': 'longer content'})
+        with self.assertRaises(FileExistsError):
+            _relocate_tree(self.srcdir, self.dstdir)
+
+    def test_file_replacing_folder(self):
+        """test file conflicting with folder raises an error"""
+        _write_tree(self.srcdir, {'pkg/a.py': 'a'})
+        _write_tree(self.dstdir, {'pkg': 'not a folder'})
+        with self.assertRaises(FileExistsError):
+            _relocate_tree(self.srcdir, self.dstdir)
+
+
+_EXT = '.cpython-311-x86_64-linux-gnu.so'
+
+# Root module names of files, as computed by the astroid based resolution used
+# previously. Files of 'site/' are located in the sitedir, the other ones are
+# resolved relatively to the current directory.
+_REF_ROOT_MODNAMES = {
+    'site/abimod.abi3.so': 'abimod',
+    'site/fastmod' + _EXT: 'fastmod',
+    'site/winmod.pyd': 'winmod',
+    'site/topmod.py': 'topmod',
+    'site/regpkg/__init__.py': 'regpkg',
+    'site/regpkg/_ext' + _EXT: 'regpkg',
+    'site/regpkg/sub/impl.py': 'regpkg',
+    'site/cpkg/__init__' + _EXT: 'cpkg',
+    'site/cpkg/m.py': 'cpkg',
+    'site/nspace/pkg_a/__init__.py': 'nspace.pkg_a',
+    'site/nspace/pkg_a/sub/mod.py': 'nspace.pkg_a',
+    'site/ns1/ns2/pkg/__init__.py': 'ns1.ns2.pkg',
+    'site/ns1/ns2/pkg/mod.py': 'ns1.ns2.pkg',
+    'site/nsext/ext' + _EXT: 'nsext.ext',
+    'site/nsext/sub/__init__.py': 'nsext.sub',
+    'site/nsext/sub/m.py': 'nsext.sub',
+    'localmod.py': 'localmod',
+    'localpkg/__init__.py': 'localpkg',
+    'localpkg/m.py': 'localpkg',
+}
+
+
+class TestImportNameResolver(unittest.TestCase):
+    def setUp(self):
+        self.basedir = abspath(_tests_data_dir + '/tmp-import-name')
+        _write_tree(self.basedir, {f: '' for f in _REF_ROOT_MODNAMES})
+
+        self.addCleanup(chdir, getcwd())
+        chdir(self.basedir)
+
+    def tearDown(self):
+        rmtree(self.basedir, ignore_errors=True)
+
+    def test_root_modname(self):
+        """test root module names match the astroid based resolution"""
+        resolver = _ImportNameResolver([self.basedir + '/site'])
+        modnames = {f: resolver.root_modname(join(self.basedir, f))
+                    for f in _REF_ROOT_MODNAMES}
+        self.assertEqual(modnames, _REF_ROOT_MODNAMES)
+
+    def test_most_specific_sitedir(self):
+        """test file is resolved relatively to its most specific sitedir"""
+        resolver = _ImportNameResolver([self.basedir, self.basedir + '/site'])
+        self.assertEqual(resolver.root_modname('site/nsext/sub/m.py'),
+                         'nsext.sub')
+        self.assertEqual(resolver.root_modname('localpkg/m.py'), 'localpkg')
@@ -1,14 +1,22 @@
 # @mindmaze_header@
+import io
+import logging
 import os
+import sys
 import unittest
 import tarfile
+from subprocess import PIPE, Popen
 from typing import Dict
-from shutil import rmtree
+from shutil import rmtree, which
 
-from mmpack_build.common import sha256sum
-from mmpack_build.src_package import SrcPackage
+from mmpack_build import binary_package, common
+from mmpack_build.binary_package import BinaryPackage
+from mmpack_build.common import log_raw, set_log_file, sha256sum
+from mmpack_build.src_package import (SrcPackage, _OutputLogger,
+                                      _pump_build_output, _sync_srcdir)
 from mmpack_build.mm_version import Version
 from mmpack_build.package_info import DispatchData
+from mmpack_build.workspace import Workspace
 
 
 _TEST_SRCPKG = 'testsrc.tar.xz'
@@ -22,6 +30,276 @@ def _create_test_srcpkg(content: Dict[str, str]):
     tar.close()
 
 
+# Child writing partial lines alternately on its standard output and error
+_INTERLEAVED_OUTPUT_SCRIPT = """
+import os, time
+for fd, data in [(1, b'out-'), (2, b'err-'), (1, b'line\\n'),
+                 (2, b'line\\n'), (1, b'tail')]:
+    os.write(fd, data)
+    time.sleep(0.05)
+"""
+
+
+class _BinaryOutput:
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+
+class TestBuildOutputLog(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(_TESTS_DATA_DIR, exist_ok=True)
+        self.logfile = _TESTS_DATA_DIR + '/build.log'
+        self.prev_logger = common.LOGGER
+        self.prev_strlist = list(common.TMP_LOG_STRLIST)
+        common.LOGGER = None
+        common.TMP_LOG_STRLIST.clear()
+
+    def tearDown(self):
+        logger = logging.getLogger('mmpack-build')
+        for handler in list(logger.handlers):
+            if getattr(handler, 'baseFilename', '') == self.logfile:
+                logger.removeHandler(handler)
+                handler.close()
+
+        common.LOGGER = self.prev_logger
+        common.TMP_LOG_STRLIST[:] = self.prev_strlist
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def _log_content(self) -> str:
+        for handler in common.LOGGER.handlers:
+            handler.flush()
+        with open(self.logfile, encoding='utf-8') as stream:
+            return stream.read()
+
+    def test_log_raw_before_logger(self):
+        """
+        test raw data logged before the log file is set is not lost
+        """
+        log_raw(b'first\nsecond\n')
+        self.assertEqual(common.TMP_LOG_STRLIST, [[logging.INFO, 'first'],
+                                                  [logging.INFO, 'second']])
+
+        set_log_file(self.logfile)
+        log_raw(b'third\n')
+        lines = self._log_content().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith(': INFO: first'))
+        self.assertTrue(lines[1].endswith(': INFO: second'))
+        self.assertEqual(lines[2], 'third')
+
+    def test_partial_last_line(self):
+        """
+        test incomplete line is held until completed or output closed
+        """
+        set_log_file(self.logfile)
+        file_out = _BinaryOutput()
+        output = _OutputLogger(file_out)
+
+        output.write(b'abc')
+        output.write(b'def\ngh')
+        self.assertEqual(self._log_content(), 'abcdef\n')
+
+        output.write(b'i')
+        output.close()
+        self.assertEqual(self._log_content(), 'abcdef\nghi\n')
+        self.assertEqual(file_out.buffer.getvalue(), b'abcdef\nghi\n')
+
+    def test_outputs_not_mixed(self):
+        """
+        test lines of standard output and error are not mixed in log
+        """
+        set_log_file(self.logfile)
+        with Popen([sys.executable, '-c', _INTERLEAVED_OUTPUT_SCRIPT],
+                   stdout=PIPE, stderr=PIPE) as proc:
+            _pump_build_output(proc)
+
+        self.assertEqual(sorted(self._log_content().splitlines()),
+                         ['err-line', 'out-line', 'tail'])
+
+
+def _write_tree(topdir: str, content: Dict[str, str]):
+    for relpath, data in content.items():
+        path = os.path.join(topdir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(data)
+
+
+def _read_tree(topdir: str) -> Dict[str, str]:
+    content = {}
+    for root, dirs, files in os.walk(topdir):
+        reldir = os.path.relpath(root, topdir)
+        for name in files:
+            with open(os.path.join(root, name), encoding='utf-8') as stream:
+                content[os.path.normpath(f'{reldir}/{name}')] = stream.read()
+        if not dirs and not files:
+            content[reldir + '/'] = None
+
+    return content
+
+
+class TestSyncSrcdir(unittest.TestCase):
+    def setUp(self):
+        self.srcdir = _TESTS_DATA_DIR + '/sync-src'
+        self.dstdir = _TESTS_DATA_DIR + '/sync-dst'
+        self.manifest = _TESTS_DATA_DIR + '/sync-manifest.json'
+        os.makedirs(self.dstdir)
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def _sync(self, content: Dict[str, str]):
+        _write_tree(self.srcdir, content)
+        _sync_srcdir(self.srcdir, self.dstdir, self.manifest)
+        self.assertFalse(os.path.exists(self.srcdir))
+
+    def test_unchanged_and_changed(self):
+        """
+        test only the modified sources are replaced, artifacts are kept
+        """
+        self._sync({'main.c': 'int main;', 'lib/foo.c': 'int foo;'})
+        _write_tree(self.dstdir, {'main.o': 'obj', 'lib/foo.o': 'obj'})
+        unchanged_ino = os.stat(self.dstdir + '/lib/foo.c').st_ino
+        changed_ino = os.stat(self.dstdir + '/main.c').st_ino
+
+        self._sync({'main.c': 'int main = 1;', 'lib/foo.c': 'int foo;'})
+        self.assertEqual(_read_tree(self.dstdir), {
+            'main.c': 'int main = 1;',
+            'main.o': 'obj',
+            'lib/foo.c': 'int foo;',
+            'lib/foo.o': 'obj',
+        })
+        self.assertEqual(os.stat(self.dstdir + '/lib/foo.c').st_ino,
+                         unchanged_ino)
+        self.assertNotEqual(os.stat(self.dstdir + '/main.c').st_ino,
+                            changed_ino)
+
+    def test_removed(self):
+        """
+        test removed sources and their directories are removed unless they
+        contain build artifacts
+        """
+        self._sync({'main.c': 'int main;', 'lib/foo.c': 'int foo;',
+                    'lib/sub/bar.c': 'int bar;', 'util/baz.c': 'int baz;'})
+        _write_tree(self.dstdir, {'util/baz.o': 'obj'})
+
+        self._sync({'main.c': 'int main;'})
+        self.assertEqual(_read_tree(self.dstdir), {
+            'main.c': 'int main;',
+            'util/baz.o': 'obj',
+        })
+
+    def test_type_changed(self):
+        """
+        test sources changed from file to directory and conversely
+        """
+        self._sync({'foo': 'file', 'bar/a.c': 'int a;', 'bar/b.c': 'int b;'})
+        _write_tree(self.dstdir, {'bar/a.o': 'obj'})
+
+        self._sync({'foo/c.c': 'int c;', 'bar': 'file'})
+        self.assertEqual(_read_tree(self.dstdir), {
+            'foo/c.c': 'int c;',
+            'bar': 'file',
+        })
+
+        self._sync({'foo': 'file again', 'bar/a.c': 'int a;'})
+        self.assertEqual(_read_tree(self.dstdir), {
+            'foo': 'file again',
+            'bar/a.c': 'int a;',
+        })
+
+
+class TestBinaryPackageCache(unittest.TestCase):
+    def setUp(self):
+        self.instdir = _TESTS_DATA_DIR + '/binpkg-inst'
+        self.builddir = _TESTS_DATA_DIR + '/binpkg-build'
+        _write_tree(self.instdir, {'bin/tool': 'tool', 'share/doc': 'doc'})
+        Workspace().set_cachedir(_TESTS_DATA_DIR + '/binpkg-cache')
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def _create(self) -> BinaryPackage:
+        pkg = BinaryPackage('tool', Version('1.0'), 'toolsrc', 'amd64-debian',
+                            'tag', self.instdir, '0' * 64, False)
+        pkg.install_files = {'bin/tool', 'share/doc'}
+        pkg.create(self.instdir, self.builddir)
+        return pkg
+
+    @unittest.skipUnless(which('zstd'), 'zstd not available')
+    def test_archive_reused(self):
+        """
+        test package created again from the same staged tree reuses the
+        archive created the first time
+        """
+        ref = self._create()
+        rmtree(self.builddir)
+
+        # The archive must be retrieved from cache, not created again
+        def _create_tarball(*args):
+            raise AssertionError(f'archive created again: {args}')
+
+        self.addCleanup(setattr, binary_package, 'create_tarball',
+                        binary_package.create_tarball)
+        binary_package.create_tarball = _create_tarball
+
+        pkg = self._create()
+        self.assertEqual(pkg.pkg_path, ref.pkg_path)
+        self.assertEqual((pkg.pkg_size, pkg.pkg_sha256),
+                         (ref.pkg_size, ref.pkg_sha256))
+        self.assertEqual(pkg.pkg_size, os.path.getsize(pkg.pkg_path))
+        self.assertEqual(pkg.pkg_sha256, sha256sum(pkg.pkg_path))
+
+
+class TestBinaryPackageSha256sums(unittest.TestCase):
+    def setUp(self):
+        self.instdir = _TESTS_DATA_DIR + '/binpkg-inst'
+        self.builddir = _TESTS_DATA_DIR + '/binpkg-build'
+        self.copyright = 'share/licenses/tool/copyright'
+        _write_tree(self.instdir, {'bin/tool': 'tool',
+                                   self.copyright: 'Copyright'})
+        Workspace().set_cachedir(_TESTS_DATA_DIR + '/binpkg-cache')
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def _sha256sums(self) -> Dict[str, str]:
+        path = (self.builddir + '/staging/tool/var/lib/mmpack/metadata/'
+                'tool.sha256sums')
+        with open(path, encoding='utf-8') as stream:
+            return dict(line.strip().split(': ') for line in stream)
+
+    @unittest.skipUnless(which('zstd'), 'zstd not available')
+    def test_forgotten_files_rehashed(self):
+        """
+        test hashes carried from install are reused while forgotten files
+        are hashed again
+        """
+        pkg = BinaryPackage('tool', Version('1.0'), 'toolsrc', 'amd64-debian',
+                            'tag', self.instdir, '0' * 64, False)
+        pkg.install_files = {'bin/tool', self.copyright}
+
+        # The carried hash of bin/tool is not the actual one: it shows up in
+        # sha256sums only if the carried hash is reused.
+        carried = 'reg-' + 'c' * 64
+        pkg.install_files_sha256 = {
+            'bin/tool': carried,
+            self.copyright: sha256sum(f'{self.instdir}/{self.copyright}',
+                                      follow_symlink=False),
+        }
+
+        # copyright file rewritten after install
+        _write_tree(self.instdir, {self.copyright: 'Copyright 2026'})
+        pkg.forget_files_sha256([self.copyright])
+
+        pkg.create(self.instdir, self.builddir)
+        copyright_sha = sha256sum(f'{self.instdir}/{self.copyright}',
+                                  follow_symlink=False)
+        sha256sums = self._sha256sums()
+        self.assertEqual(sha256sums['bin/tool'], carried)
+        self.assertEqual(sha256sums[self.copyright], copyright_sha)
+
+
 class TestSrcPackageClass(unittest.TestCase):
     abs_testdir = '.'
 
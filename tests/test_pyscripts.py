@@ -0,0 +1,366 @@
+# @mindmaze_header@
+
+import json
+import os
+import sys
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import dirname, abspath, join
+from shutil import copytree, rmtree
+from subprocess import run
+
+import pkg_resources
+
+from pyscripts.depends import DependsInspector, _init_worker
+from pyscripts.utils import is_namespace_pkg
+
+
+_sitedir = join(dirname(abspath(__file__)), 'pydata')
+_tests_data_dir = abspath(os.environ.get('TESTSDIR', '.') + '/tmp-pyscripts')
+
+
+def _naive_used_pkgs(used_symbols):
+    """reference grouping: filter all symbols for each package found"""
+    used = {}
+    for modname in used_symbols:
+        modpath = modname.split('.')
+        pypkg = modpath.pop(0)
+        while is_namespace_pkg(pypkg):
+            pypkg += '.' + modpath.pop(0)
+
+        if pypkg not in used:
+            used[pypkg] = {s for s in used_symbols
+                           if s.startswith(pypkg + '.')}
+
+    return used
+
+
+class TestDependsUsedPkgs(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sys.path.insert(0, _sitedir)
+        is_namespace_pkg.cache_clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(_sitedir)
+        is_namespace_pkg.cache_clear()
+
+    def test_used_pkgs_grouping(self):
+        """test grouping of used symbols by package"""
+        inspector = DependsInspector([])
+        inspector.used_symbols = {
+            'multi',
+            'multi.somefunc',
+            'multi.bar.Employee',
+            'simple.MainData.__init__',
+            'nspace.pkg_a.NSpacePkgAData',
+            'nspace.pkg_a.NSpacePkgAData.show',
+            'nspace.pkg_b',
+        }
+        self.assertEqual(dict(inspector.used_pkgs()), {
+            'multi': {'multi.somefunc', 'multi.bar.Employee'},
+            'simple': {'simple.MainData.__init__'},
+            'nspace.pkg_a': {'nspace.pkg_a.NSpacePkgAData',
+                             'nspace.pkg_a.NSpacePkgAData.show'},
+            'nspace.pkg_b': set(),
+        })
+
+    def test_used_pkgs_large(self):
+        """test grouping of used symbols on synthetic large module set"""
+        used_symbols = set()
+        for pkgidx in range(300):
+            pypkg = f'synth_pkg{pkgidx}'
+            if pkgidx % 10 == 0:
+                pypkg = f'nspace.pkg{pkgidx}'
+            used_symbols.add(pypkg)
+            for modidx in range(5):
+                for symidx in range(10):
+                    used_symbols.add(f'{pypkg}.mod{modidx}.Class{symidx}')
+                    used_symbols.add(f'{pypkg}.mod{modidx}.func{symidx}')
+
+        inspector = DependsInspector([])
+        inspector.used_symbols = used_symbols
+        self.assertEqual(dict(inspector.used_pkgs()),
+                         _naive_used_pkgs(used_symbols))
+
+
+def _run_provides(sitedir: str, files: list, cache_dir: str) -> dict:
+    infile = _tests_data_dir + '/provides.pyfiles'
+    with open(infile, 'w', encoding='utf-8') as stream:
+        stream.write('\n'.join(join(sitedir, f) for f in files))
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    cmd = [sys.executable, '-m', 'pyscripts', '--site-path=' + sitedir,
+           '--cache-dir=' + cache_dir, 'provides', infile]
+    proc = run(cmd, capture_output=True, check=True, env=env)
+    return json.loads(proc.stdout)
+
+
+def _write_pyfiles(basedir: str, files: dict):
+    for path, content in files.items():
+        path = join(basedir, path)
+        os.makedirs(dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+
+
+def _run_depends(sitedirs: list, files: list, cache_dir: str) -> dict:
+    infile = _tests_data_dir + '/depends.pyfiles'
+    with open(infile, 'w', encoding='utf-8') as stream:
+        stream.write('\n'.join(files))
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    cmd = [sys.executable, '-m', 'pyscripts', '--cache-dir=' + cache_dir]
+    cmd += ['--site-path=' + d for d in sitedirs]
+    cmd += ['depends', infile]
+    proc = run(cmd, capture_output=True, check=True, env=env)
+    return json.loads(proc.stdout)
+
+
+_REF_EXTPKG_DEPS = {'extpkg': ['extpkg.Klass', 'extpkg.Klass.method']}
+
+
+class TestDependsWorker(unittest.TestCase):
+
+    def test_spawned_worker_pkg_resources(self):
+        """test site paths are known by pkg_resources in spawned worker"""
+        sys_path = [p for p in sys.path if abspath(p or '.') != _sitedir]
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(sys_path, [_sitedir])) as executor:
+            entry = executor.submit(pkg_resources.get_entry_info, 'Multi==1.0',
+                                    'console_scripts', 'anentry').result()
+
+        self.assertEqual(entry.module_name, 'multi.__main__')
+
+
+class TestDependsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = _tests_data_dir + '/cache'
+        self.extdir = _tests_data_dir + '/ext'
+        self.appfile = _tests_data_dir + '/app/main.py'
+        _write_pyfiles(_tests_data_dir, {
+            'app/main.py': 'import extpkg\n\nextpkg.Klass().method()\n',
+            'ext/extpkg/__init__.py': ('class Klass:\n'
+                                       '    def method(self):\n'
+                                       '        pass\n'),
+            'ext/otherpkg/__init__.py': ('class Base:\n'
+                                         '    def method(self):\n'
+                                         '        pass\n'),
+        })
+
+    def tearDown(self):
+        rmtree(_tests_data_dir, ignore_errors=True)
+
+    def _cached_results(self):
+        try:
+            return os.listdir(self.cache_dir + '/depends')
+        except FileNotFoundError:
+            return []
+
+    def test_external_module_change(self):
+        """test cached depends are not reused if external module changed"""
+        deps = _run_depends([self.extdir], [self.appfile], self.cache_dir)
+        self.assertEqual(deps, _REF_EXTPKG_DEPS)
+        self.assertEqual(len(self._cached_results()), 1)
+
+        # Klass now inherits its method from another package
+        _write_pyfiles(self.extdir, {
+            'extpkg/__init__.py': ('from otherpkg import Base\n\n\n'
+                                   'class Klass(Base):\n'
+                                   '    pass\n'),
+        })
+        deps = _run_depends([self.extdir], [self.appfile], self.cache_dir)
+        self.assertEqual(deps, {'extpkg': ['extpkg.Klass'],
+                                'otherpkg': ['otherpkg.Base.method']})
+
+    def test_site_paths_change(self):
+        """test cached depends are not reused if site paths change"""
+        _run_depends([self.extdir], [self.appfile], self.cache_dir)
+        otherdir = _tests_data_dir + '/other'
+        os.makedirs(otherdir)
+        _run_depends([self.extdir, otherdir], [self.appfile], self.cache_dir)
+        self.assertEqual(len(self._cached_results()), 2)
+
+    def test_failed_import_not_cached(self):
+        """test depends of file with failed imports are not cached"""
+        deps = _run_depends([], [self.appfile], self.cache_dir)
+        self.assertEqual(deps, {})
+        self.assertEqual(self._cached_results(), [])
+
+        # Once the module can be imported, dependency is found
+        deps = _run_depends([self.extdir], [self.appfile], self.cache_dir)
+        self.assertEqual(deps, _REF_EXTPKG_DEPS)
+
+
+# Server whose command writes on stdout file descriptor like C extensions
+# loaded by astroid may do
+_NOISY_SERVER_SCRIPT = """
+import os
+from pyscripts import serve
+
+
+def noisy_provides(files, *args):
+    os.write(1, b'C-level noise\\n')
+    print('python noise')
+    return files
+
+
+serve.run_provides = noisy_provides
+serve.run_server([])
+"""
+
+# Server reporting the astroid cache clears and the site path in use when its
+# command is run
+_CLEAR_COUNT_SERVER_SCRIPT = """
+import sys
+from pyscripts import serve
+
+clears = []
+
+
+def counted_provides(files, *args):
+    return [files, len(clears), sys.path[0]]
+
+
+serve.astroid_manager.clear_cache = lambda: clears.append(sys.path[0])
+serve.run_provides = counted_provides
+serve.run_server([])
+"""
+
+
+class TestServer(unittest.TestCase):
+
+    def test_responses_not_corrupted(self):
+        """test writes on stdout file descriptor do not corrupt responses"""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+        requests = [{'command': 'provides', 'files': [f'file{i}.py']}
+                    for i in range(3)]
+        proc = run([sys.executable, '-c', _NOISY_SERVER_SCRIPT],
+                   input=''.join(json.dumps(r) + '\n' for r in requests),
+                   capture_output=True, check=True, env=env, text=True)
+
+        responses = [json.loads(line) for line in proc.stdout.splitlines()]
+        self.assertEqual(responses, [
+            {'result': r['files'], 'log': 'python noise\n'}
+            for r in requests
+        ])
+        self.assertEqual(proc.stderr.count('C-level noise'), 3)
+
+    def test_site_paths_switch(self):
+        """test modules are resolved in the site paths of each request"""
+        _write_pyfiles(_tests_data_dir, {
+            'app/main.py': 'import extpkg\n\nextpkg.Klass().method()\n',
+            'site1/extpkg/__init__.py': ('class Klass:\n'
+                                         '    def method(self):\n'
+                                         '        pass\n'),
+            'site2/extpkg/__init__.py': ('from otherpkg import Base\n\n\n'
+                                         'class Klass(Base):\n'
+                                         '    pass\n'),
+            'site2/otherpkg/__init__.py': ('class Base:\n'
+                                           '    def method(self):\n'
+                                           '        pass\n'),
+        })
+        self.addCleanup(rmtree, _tests_data_dir, ignore_errors=True)
+
+        files = [_tests_data_dir + '/app/main.py']
+        requests = [{'command': 'depends', 'files': files,
+                     'site_paths': [_tests_data_dir + '/' + site]}
+                    for site in ('site1', 'site2', 'site1')]
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+        proc = run([sys.executable, '-m', 'pyscripts', 'serve'],
+                   input=''.join(json.dumps(r) + '\n' for r in requests),
+                   capture_output=True, check=True, env=env, text=True)
+
+        results = [json.loads(line)['result']
+                   for line in proc.stdout.splitlines()]
+        ref_site2 = {'extpkg': ['extpkg.Klass'],
+                     'otherpkg': ['otherpkg.Base.method']}
+        self.assertEqual(results,
+                         [_REF_EXTPKG_DEPS, ref_site2, _REF_EXTPKG_DEPS])
+
+    def test_batch_grouped_by_site_paths(self):
+        """test batch is run grouped by site paths, results kept in order"""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+        sites = [abspath(_tests_data_dir + '/' + s) for s in ('s1', 's2')]
+        batch = [{'command': 'provides', 'files': [f'file{i}.py'],
+                  'site_paths': [sites[i % 2]]}
+                 for i in range(4)]
+        proc = run([sys.executable, '-c', _CLEAR_COUNT_SERVER_SCRIPT],
+                   input=json.dumps({'batch': batch}) + '\n',
+                   capture_output=True, check=True, env=env, text=True)
+
+        result = json.loads(proc.stdout)['result']
+        self.assertEqual(result, [
+            [r['files'], 1 + i % 2, sites[i % 2]]
+            for i, r in enumerate(batch)
+        ])
+
+
+class TestProvidesExportTable(unittest.TestCase):
+
+    def setUp(self):
+        self.sitedir = _tests_data_dir + '/site'
+        self.cache_dir = _tests_data_dir + '/cache'
+        copytree(join(_sitedir, 'multi'), self.sitedir + '/multi')
+
+    def tearDown(self):
+        rmtree(_tests_data_dir, ignore_errors=True)
+
+    def test_export_table_reuse(self):
+        """test provides served from export table after module change"""
+        # Make bar.py define a class inheriting from a class of foo.py
+        with open(self.sitedir + '/multi/bar.py', 'a',
+                  encoding='utf-8') as stream:
+            stream.write('\n\nfrom multi.foo import MainData\n\n\n'
+                         'class BarData(MainData):\n'
+                         '    pass\n')
+
+        files = ['multi/__init__.py', 'multi/foo.py', 'multi/bar.py']
+        ref = _run_provides(self.sitedir, files, self.cache_dir)
+        self.assertTrue(os.listdir(self.cache_dir + '/provides'))
+        self.assertEqual(_run_provides(self.sitedir, files, self.cache_dir),
+                         ref)
+        self.assertIn('multi.bar.BarData', ref['multi'])
+        self.assertNotIn('new_method', self._bar_entry_class_syms())
+
+        # Add method to the MainData base class in foo.py: the entry of
+        # bar.py must be regenerated even though bar.py is unchanged since
+        # its BarData class inherits from MainData.
+        foo_path = self.sitedir + '/multi/foo.py'
+        with open(foo_path, encoding='utf-8') as stream:
+            content = stream.read()
+        content = content.replace(
+            '    def disclose_private(',
+            '    def new_method(self):\n'
+            '        return 1\n\n'
+            '    def disclose_private(')
+        with open(foo_path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+
+        syms = _run_provides(self.sitedir, files, self.cache_dir)
+        self.assertEqual(set(syms['multi']) - set(ref['multi']),
+                         {'multi.foo.MainData.new_method'})
+        self.assertEqual(set(ref['multi']) - set(syms['multi']), set())
+        self.assertIn('new_method', self._bar_entry_class_syms())
+
+    def _bar_entry_class_syms(self) -> list:
+        """get MainData symbols recorded in export table entry of bar.py"""
+        provides_dir = self.cache_dir + '/provides'
+        for name in os.listdir(provides_dir):
+            with open(join(provides_dir, name), encoding='utf-8') as stream:
+                classes = json.load(stream)['classes']
+            if 'multi.bar.BarData' in classes:
+                return classes['multi.foo.MainData']['syms']
+
+        self.fail('no export table entry for multi.bar')
+        return []
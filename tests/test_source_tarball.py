@@ -0,0 +1,116 @@
+# @mindmaze_header@
+import os
+import time
+import unittest
+from shutil import copy, rmtree, which
+from threading import Lock
+
+from mmpack_build.archive import open_tarball
+from mmpack_build.errors import MMPackBuildError
+from mmpack_build.source_tarball import SourceTarball
+from mmpack_build.workspace import Workspace
+
+
+_TESTS_DATA_DIR = os.path.abspath(os.environ.get('TESTSDIR', '.')
+                                  + '/tmp-source-tarball')
+_PROJECTS = [f'prj{i}' for i in range(6)]
+_SPECFILE = os.path.dirname(os.path.abspath(__file__)) \
+    + '/specfiles/simple.yaml'
+
+
+class TestMultiProjectSources(unittest.TestCase):
+    def setUp(self):
+        self.srcdir = _TESTS_DATA_DIR + '/src'
+        os.makedirs(self.srcdir)
+        with open(self.srcdir + '/projects.mmpack', 'w',
+                  encoding='utf-8') as stream:
+            stream.write('\n'.join(_PROJECTS))
+
+        Workspace().set_builddir(_TESTS_DATA_DIR + '/build')
+        Workspace().set_outdir(_TESTS_DATA_DIR + '/out')
+        self.started = []
+        self._lock = Lock()
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def _source_tarball(self, jobs: int, failing: str = None):
+        srctar = SourceTarball('path', self.srcdir, jobs=jobs)
+
+        # Projects finish in reverse order of submission
+        def _gen_project_sources(subdir: str):
+            with self._lock:
+                self.started.append(subdir)
+            time.sleep(0.01 * (len(_PROJECTS) - _PROJECTS.index(subdir)))
+            if subdir == failing:
+                raise MMPackBuildError(f'{subdir} failed')
+            return subdir
+
+        srctar._gen_project_sources = _gen_project_sources
+        return srctar
+
+    def test_order(self):
+        """
+        test projects are reported in order and not generated too far ahead
+        """
+        jobs = 2
+        srctar = self._source_tarball(jobs)
+        results = []
+        for prj in srctar.iter_mmpack_srcs():
+            with self._lock:
+                self.assertLessEqual(len(self.started),
+                                     len(results) + jobs + 1)
+            results.append(prj)
+
+        self.assertEqual(results, _PROJECTS)
+
+    def test_error(self):
+        """
+        test error of a project is raised after the previous projects and
+        stops the generation of the next ones
+        """
+        srctar = self._source_tarball(jobs=2, failing='prj2')
+        results = []
+        with self.assertRaisesRegex(MMPackBuildError, 'prj2 failed'):
+            for prj in srctar.iter_mmpack_srcs():
+                results.append(prj)
+
+        self.assertEqual(results, ['prj0', 'prj1'])
+        self.assertNotIn('prj5', self.started)
+
+
+class TestSourceCompression(unittest.TestCase):
+    def setUp(self):
+        self.prjdir = _TESTS_DATA_DIR + '/simple'
+        os.makedirs(self.prjdir + '/mmpack')
+        copy(_SPECFILE, self.prjdir + '/mmpack/specs')
+        with open(self.prjdir + '/hello.c', 'w', encoding='utf-8') as stream:
+            stream.write('int main(void) { return 0; }\n')
+
+        Workspace().set_builddir(_TESTS_DATA_DIR + '/build')
+        Workspace().set_outdir(_TESTS_DATA_DIR + '/out')
+
+    def tearDown(self):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    @unittest.skipUnless(which('zstd'), 'zstd not available')
+    def test_zst_roundtrip(self):
+        """
+        test zstd compressed source package is recognized and unpacked
+        """
+        srctar = SourceTarball('path', self.prjdir, src_compression='zst')
+        prj = next(srctar.iter_mmpack_srcs())
+        self.assertEqual(os.path.basename(prj.tarball),
+                         'simple_1.0.0_src.tar.zst')
+        with open(prj.tarball, 'rb') as stream:
+            self.assertEqual(stream.read(4), b'\x28\xb5\x2f\xfd')
+        with open_tarball(prj.tarball) as tar:
+            self.assertIn('./hello.c', tar.getnames())
+
+        srcpkg = SourceTarball('guess', prj.tarball)
+        self.assertEqual(srcpkg.trace['pkg']['method'], 'srcpkg')
+        unpacked = next(srcpkg.iter_mmpack_srcs())
+        self.assertEqual((unpacked.name, unpacked.version),
+                         ('simple', '1.0.0'))
+        with open(unpacked.srcdir + '/hello.c', encoding='utf-8') as stream:
+            self.assertEqual(stream.read(), 'int main(void) { return 0; }\n')
@@ -0,0 +1,184 @@
+# @mindmaze_header@
+import os
+import tarfile
+import unittest
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from shutil import rmtree
+from threading import Thread
+from typing import List
+
+from mmpack_build.common import sha256sum
+from mmpack_build.syspkg_manager_base import SysPkg, SysPkgManager
+from mmpack_build.syspkg_manager_pacman_msys2 import _load_db_index
+from mmpack_build.workspace import Workspace
+
+
+_TESTS_DATA_DIR = os.path.abspath(os.environ.get('TESTSDIR', '.')
+                                  + '/tmp-syspkg')
+_REPO_DIR = _TESTS_DATA_DIR + '/repo'
+
+# content of each fake system package: list of the files it provides
+_SYSPKGS = {
+    'libfoo1': ['usr/lib/libfoo.so.1', 'usr/share/doc/foo/README'],
+    'libfoo-dev': ['usr/include/foo.h', 'usr/lib/libfoo.so'],
+    'foo-bin': ['usr/bin/foo', 'usr/share/doc/foo/README'],
+    'foo-data': ['usr/share/foo/data.txt'],
+}
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class _FakeSysPkgManager(SysPkgManager):
+    """
+    System package manager whose packages are text files listing the files
+    they provide
+    """
+    def __init__(self, baseurl: str):
+        self._baseurl = baseurl
+
+    def parse_pkgindex(self, builddir: str,
+                       srcnames: List[str]) -> List[SysPkg]:
+        pkgs = []
+        for name in _SYSPKGS:
+            pkg = SysPkg()
+            pkg.name = name
+            pkg.version = '1.2.3-1'
+            pkg.filename = name + '.pkg'
+            pkg.url = f'{self._baseurl}/{pkg.filename}'
+            pkg.sha256 = sha256sum(f'{_REPO_DIR}/{pkg.filename}')
+            pkgs.append(pkg)
+
+        return pkgs
+
+    def _extract_syspkg(self, pkgfile: str, unpackdir: str) -> List[str]:
+        with open(pkgfile, encoding='utf-8') as stream:
+            return stream.read().split()
+
+
+class TestSysPkgManager(unittest.TestCase):
+    server = None
+
+    @classmethod
+    def setUpClass(cls):
+        os.makedirs(_REPO_DIR, exist_ok=True)
+        for name, files in _SYSPKGS.items():
+            with open(f'{_REPO_DIR}/{name}.pkg', 'w', encoding='utf-8') as fp:
+                fp.write('\n'.join(files))
+
+        handler = partial(_QuietHandler, directory=_REPO_DIR)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.builddir = _TESTS_DATA_DIR + '/build'
+        os.makedirs(self.builddir, exist_ok=True)
+        Workspace().set_cachedir(_TESTS_DATA_DIR + '/cache')
+
+    def tearDown(self):
+        rmtree(self.builddir, ignore_errors=True)
+        rmtree(_TESTS_DATA_DIR + '/cache', ignore_errors=True)
+
+    def _fetch_unpack(self):
+        host, port = self.server.server_address
+        mgr = _FakeSysPkgManager(f'http://{host}:{port}')
+        return mgr.fetch_unpack(['foo'], self.builddir, self.builddir)
+
+    def test_fetch_unpack_mapping(self):
+        """
+        test files -> sysdep mapping of concurrent fetch_unpack
+        """
+        version, files_sysdep = self._fetch_unpack()
+
+        self.assertEqual(str(version), '1.2.3')
+        self.assertEqual(files_sysdep, {
+            'usr/lib/libfoo.so.1': 'libfoo1',
+            'usr/include/foo.h': 'libfoo-dev',
+            'usr/lib/libfoo.so': 'libfoo-dev',
+            'usr/bin/foo': 'foo-bin',
+            # provided by 2 packages: the last one in list must win
+            'usr/share/doc/foo/README': 'foo-bin',
+            'usr/share/foo/data.txt': 'foo-data',
+        })
+
+    def test_fetch_unpack_deterministic(self):
+        """
+        test fetch_unpack mapping is identical between downloads and cache use
+        """
+        ref = self._fetch_unpack()
+        rmtree(self.builddir)
+        os.makedirs(self.builddir)
+
+        for _ in range(3):
+            _, files_sysdep = self._fetch_unpack()
+            self.assertEqual(list(files_sysdep.items()), list(ref[1].items()))
+
+
+def _create_pacman_db(path: str, pkgs: List[dict]):
+    with tarfile.open(path, 'w:gz') as tar:
+        for pkg in pkgs:
+            dirname = f'{pkg["NAME"]}-{pkg["VERSION"]}'
+            desc = ''.join(f'%{k}%\n{v}\n\n' for k, v in pkg.items())
+            srcdir = f'{os.path.dirname(path)}/{dirname}'
+            os.makedirs(srcdir, exist_ok=True)
+            with open(srcdir + '/desc', 'w', encoding='utf-8') as stream:
+                stream.write(desc)
+            tar.add(srcdir, arcname=dirname)
+
+
+class TestPacmanDb(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.tmpdir = _TESTS_DATA_DIR + '/pacman'
+        os.makedirs(self.tmpdir, exist_ok=True)
+        Workspace().set_cachedir(_TESTS_DATA_DIR + '/cache')
+
+    def tearDown(self):
+        rmtree(self.tmpdir, ignore_errors=True)
+        rmtree(_TESTS_DATA_DIR + '/cache', ignore_errors=True)
+
+    def test_load_db_index(self):
+        """
+        test source -> packages index of pacman database, parsed and cached
+        """
+        pkgs = [
+            {'NAME': 'libfoo', 'BASE': 'foo', 'VERSION': '1.0-1',
+             'FILENAME': 'libfoo-1.0-1.pkg.tar.zst', 'SHA256SUM': 'aa',
+             'DESC': 'foo library'},
+            {'NAME': 'bar', 'BASE': 'bar', 'VERSION': '2.0-3',
+             'FILENAME': 'bar-2.0-3.pkg.tar.zst', 'SHA256SUM': 'bb'},
+            {'NAME': 'foo-tools', 'BASE': 'foo', 'VERSION': '1.0-1',
+             'FILENAME': 'foo-tools-1.0-1.pkg.tar.zst', 'SHA256SUM': 'cc'},
+        ]
+        dbfile = self.tmpdir + '/repo.db'
+        _create_pacman_db(dbfile, pkgs)
+
+        index = _load_db_index(dbfile)
+        self.assertEqual(sorted(index.keys()), ['bar', 'foo'])
+        self.assertEqual([p['name'] for p in index['foo']],
+                         ['libfoo', 'foo-tools'])
+        self.assertEqual(index['bar'], [{
+            'name': 'bar',
+            'version': '2.0-3',
+            'source': 'bar',
+            'filename': 'bar-2.0-3.pkg.tar.zst',
+            'sha256': 'bb',
+        }])
+
+        # Index must be reloaded from cache once the db has been parsed
+        for name in os.listdir(self.tmpdir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.tmpdir, name))
+        self.assertEqual(_load_db_index(dbfile), index)
@@ -0,0 +1,173 @@
+# @mindmaze_header@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from shutil import rmtree
+from threading import Thread
+
+from mmpack_build.common import sha256sum
+from mmpack_build.workspace import Workspace, cached_download
+
+
+_TESTS_DATA_DIR = os.path.abspath(os.environ.get('TESTSDIR', '.')
+                                  + '/tmp-workspace')
+_CACHE_DIR = _TESTS_DATA_DIR + '/cache'
+
+
+class _CountingHandler(SimpleHTTPRequestHandler):
+    num_get = 0
+
+    def do_GET(self):
+        type(self).num_get += 1
+        super().do_GET()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, 'wb') as stream:
+        stream.write(data)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as stream:
+        return stream.read()
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = _TESTS_DATA_DIR + '/tmp'
+        os.makedirs(self.tmpdir, exist_ok=True)
+        self.wrk = Workspace()
+        self.wrk.set_cachedir(_CACHE_DIR)
+        self.prev_maxsize = self.wrk._cache_maxsize
+
+    def tearDown(self):
+        self.wrk._cache_maxsize = self.prev_maxsize
+        rmtree(_TESTS_DATA_DIR, ignore_errors=True)
+
+    def test_cache_get_by_name_and_sha(self):
+        """
+        test file stored in cache can be retrieved by name or sha256
+        """
+        path = self.tmpdir + '/file.tar.gz'
+        _write_file(path, b'some content')
+        digest = sha256sum(path)
+        self.wrk.cache_file(path)
+
+        # Content is stored once whatever the name
+        other = self.tmpdir + '/other.tar.gz'
+        _write_file(other, b'some content')
+        self.wrk.cache_file(other)
+        self.assertEqual(os.listdir(_CACHE_DIR + '/objects'), [digest])
+
+        os.unlink(path)
+        self.assertTrue(self.wrk.cache_get(path))
+        self.assertEqual(_read_file(path), b'some content')
+
+        # Retrieving again a file linked to cache must leave it intact
+        self.assertTrue(self.wrk.cache_get(path))
+        self.assertEqual(_read_file(path), b'some content')
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['file.tar.gz', 'other.tar.gz'])
+
+        retrieved = self.tmpdir + '/retrieved'
+        self.assertTrue(self.wrk.cache_get(retrieved, digest))
+        self.assertEqual(_read_file(retrieved), b'some content')
+
+        self.assertFalse(self.wrk.cache_get(self.tmpdir + '/unknown'))
+
+        # A file can be retrieved by a name other than its basename
+        self.wrk.cache_file(path, name='alias')
+        aliased = self.tmpdir + '/aliased'
+        self.assertEqual(self.wrk.cache_get(aliased, name='alias'), digest)
+        self.assertEqual(_read_file(aliased), b'some content')
+        self.assertFalse(self.wrk.cache_get(aliased, name='unknown'))
+        self.assertFalse(self.wrk.cache_get(retrieved, '0' * 64))
+
+        # Retrieved and cached files do not share their inode: modifying or
+        # touching one of them does not affect the other
+        obj = self.wrk._cache_object(digest)
+        self.assertFalse(os.path.samefile(obj, retrieved))
+        self.assertFalse(os.path.samefile(obj, other))
+        _write_file(retrieved, b'modified content')
+        self.assertTrue(self.wrk.cache_get(retrieved, digest))
+        self.assertEqual(_read_file(retrieved), b'some content')
+        os.utime(retrieved, (0, 0))
+        self.assertTrue(self.wrk.cache_get(self.tmpdir + '/third', digest))
+        self.assertEqual(os.stat(retrieved).st_mtime, 0)
+
+        # A name refers to the last cached file with this name
+        _write_file(other, b'new content')
+        self.wrk.cache_file(other)
+        os.unlink(other)
+        self.assertTrue(self.wrk.cache_get(other))
+        self.assertEqual(_read_file(other), b'new content')
+
+    def test_cleanup_lru(self):
+        """
+        test cleanup evicts the least recently used files beyond max size
+        """
+        self.wrk._cache_maxsize = 2500
+        for i, name in enumerate(['a', 'b', 'c']):
+            path = f'{self.tmpdir}/{name}'
+            _write_file(path, bytes([i]) * 1000)
+            self.wrk.cache_file(path)
+            os.utime(self.wrk._cache_object(sha256sum(path)), (i, i))
+
+        # Use 'a' so that 'b' becomes the least recently used
+        self.assertTrue(self.wrk.cache_get(self.tmpdir + '/a'))
+        self.wrk.cleanup_cache()
+
+        for name, present in [('a', True), ('b', False), ('c', True)]:
+            self.assertEqual(bool(self.wrk.cache_get(f'{self.tmpdir}/{name}')),
+                             present)
+        self.assertEqual(sorted(os.listdir(_CACHE_DIR + '/names')),
+                         ['a', 'c'])
+
+    def test_cleanup_skipped_while_in_use(self):
+        """
+        test cleanup does not evict files while cache is in use
+        """
+        path = self.tmpdir + '/file'
+        _write_file(path, b'data')
+        self.wrk.cache_file(path)
+        self.wrk._cache_maxsize = 0
+
+        with self.wrk._cache_lock(shared=True):
+            self.wrk.cleanup_cache()
+        self.assertTrue(self.wrk.cache_get(path))
+
+        self.wrk.cleanup_cache()
+        self.assertFalse(self.wrk.cache_get(path))
+
+    def test_concurrent_cached_download(self):
+        """
+        test concurrent downloads of the same url are done only once
+        """
+        srvdir = _TESTS_DATA_DIR + '/srv'
+        os.makedirs(srvdir)
+        _write_file(srvdir + '/data.bin', os.urandom(1 << 20))
+
+        handler = partial(_CountingHandler, directory=srvdir)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            host, port = server.server_address
+            url = f'http://{host}:{port}/data.bin'
+            dsts = [f'{self.tmpdir}/dst{i}/data.bin' for i in range(8)]
+            for dst in dsts:
+                os.makedirs(os.path.dirname(dst))
+            with ThreadPoolExecutor(max_workers=len(dsts)) as executor:
+                list(executor.map(partial(cached_download, url), dsts))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(_CountingHandler.num_get, 1)
+        ref = sha256sum(srvdir + '/data.bin')
+        for dst in dsts:
+            self.assertEqual(sha256sum(dst), ref)